@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks which are run by hand, e.g.
+``python -m benchmarks.marshalling``.
+"""
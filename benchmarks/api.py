@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""Measures latency and throughput of catalog API endpoints.
+
+A synthetic campus from :func:`benchmarks.catalog_sync.make_catalog` is
+loaded, and requests of each scenario are sent in process through the
+Flask test client, one at a time. Scenarios cover the filters of
+``/api/courses`` and the detail endpoints; detail scenarios go through
+different entities in turn. The 50th and 99th percentiles of latency and
+requests per second are reported for each scenario.
+
+Responses are not cached unless ``--cache`` is given, so that the work of
+handlers is measured rather than lookups of the cache.
+
+Run with ``python -m benchmarks.api``, with the environment variables of
+``manage.py`` set. Give ``-o results.json`` to write the results as JSON,
+which can be compared between commits.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from dash.app import create_app
+from dash.catalog.models import (
+    Campus,
+    Course,
+    Department,
+    GenEduCategory,
+    Subject,
+)
+from dash.catalog.scraper import update_catalog
+from dash.extensions import db
+from dash.settings import Config
+from .catalog_sync import git_revision, make_catalog
+
+
+def seed(app, n):
+    """Loads a campus of ``n`` courses, and returns a dict of IDs and
+    values of it used by scenarios.
+    """
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        campus = Campus(code='BENCH', name='Benchmark',
+                        scraper='benchmarks.api')
+        db.session.add(campus)
+        db.session.commit()
+        departments, subjects, categories, courses = make_catalog(n)
+        with update_catalog(campus) as catalog:
+            catalog.hold_departments(departments)
+            catalog.hold_subjects(subjects)
+            catalog.hold_gen_edu_categories(categories)
+            catalog.hold_courses(courses)
+        del departments, subjects, categories, courses
+
+        def ids(model, limit=100):
+            return [id for id, in db.session.query(model.id)
+                    .order_by(model.id).limit(limit)]
+        values = {
+            'campus_id': campus.id,
+            # Pages of 20 courses.
+            'pages': min(max(n // 20, 1), 50),
+            'course_ids': ids(Course),
+            'subject_ids': ids(Subject),
+            'department_ids': ids(Department),
+            'category_ids': ids(GenEduCategory),
+        }
+        db.session.remove()
+        return values
+
+
+def scenarios(values):
+    """Returns a list of tuples of the name of a scenario and a function
+    which returns the URL of the ``i``-th request.
+    """
+    campus_id = values['campus_id']
+    course_ids = values['course_ids']
+    subject_ids = values['subject_ids']
+    department_id = values['department_ids'][0]
+    category_id = values['category_ids'][0]
+    pages = values['pages']
+
+    def fixed(url):
+        return lambda i: url
+
+    def each(url, ids):
+        return lambda i: url.format(ids[i % len(ids)])
+
+    return [
+        ('courses', fixed('/api/courses')),
+        ('courses?name', fixed('/api/courses?name=Subject+12')),
+        ('courses?instructor', fixed('/api/courses?instructor=Instructor+7')),
+        ('courses?type=general&category_id', fixed(
+            '/api/courses?type=general&category_id={0}'.format(category_id))),
+        ('courses?type=major&target_grade',
+         fixed('/api/courses?type=major&target_grade=2')),
+        ('courses?department_id', fixed(
+            '/api/courses?department_id={0}'.format(department_id))),
+        ('campus courses', fixed(
+            '/api/campuses/{0}/courses'.format(campus_id))),
+        ('campus courses?department_id&type', fixed(
+            '/api/campuses/{0}/courses?department_id={1}&type=major'
+            .format(campus_id, department_id))),
+        ('courses?page',
+         lambda i: '/api/courses?page={0}'.format(i % pages + 1)),
+        ('courses?ids', lambda i: '/api/courses?ids={0}'.format(','.join(
+            str(course_ids[(i + j) % len(course_ids)]) for j in range(10)))),
+        ('subjects', fixed('/api/subjects')),
+        ('course', each('/api/courses/{0}', course_ids)),
+        ('campus course', each(
+            '/api/campuses/{0}/courses/{{0}}'.format(campus_id), course_ids)),
+        ('subject', each('/api/subjects/{0}', subject_ids)),
+        ('department', each('/api/departments/{0}', values['department_ids'])),
+        ('campus', fixed('/api/campuses/{0}'.format(campus_id))),
+    ]
+
+
+def percentile(sorted_values, p):
+    """Returns the ``p``-th percentile of sorted values by nearest rank."""
+    rank = max(int(round(p / 100.0 * len(sorted_values))), 1)
+    return sorted_values[rank - 1]
+
+
+def run(client, url_of, requests, warmup):
+    """Sends requests of a scenario, and returns a dict of measurements."""
+    for i in range(warmup):
+        client.get(url_of(i))
+    latencies = []
+    timer = timeit.default_timer
+    start = timer()
+    for i in range(requests):
+        url = url_of(i)
+        sent = timer()
+        response = client.get(url)
+        latencies.append(timer() - sent)
+        if response.status_code != 200:
+            raise RuntimeError('{0} responded with {1}'.format(
+                url, response.status_code))
+    elapsed = timer() - start
+    latencies.sort()
+    return {
+        'requests': requests,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'rps': requests / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--courses', type=int, default=10000,
+                        help='number of courses of the campus')
+    parser.add_argument('-r', '--requests', type=int, default=200,
+                        help='number of requests of a scenario')
+    parser.add_argument('-w', '--warmup', type=int, default=10,
+                        help='number of requests before measuring')
+    parser.add_argument('-k', '--scenario', action='append',
+                        help='run scenarios whose name contains this')
+    parser.add_argument('-d', '--database',
+                        help='URI of an empty database to use; defaults to '
+                             'a temporary SQLite file')
+    parser.add_argument('--cache', action='store_true',
+                        help='cache responses')
+    parser.add_argument('-o', '--output',
+                        help='path of a JSON file to write results to')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='dash-benchmark-')
+    try:
+        class BenchmarkConfig(Config):
+            SQLALCHEMY_DATABASE_URI = args.database or \
+                'sqlite:///' + os.path.join(tmpdir, 'dash.db')
+            CATALOG_SNAPSHOT_DIR = os.path.join(tmpdir, 'snapshots')
+            CACHE_TYPE = 'simple' if args.cache else 'null'
+            CACHE_NO_NULL_WARNING = True
+
+        app = create_app(BenchmarkConfig)
+        values = seed(app, args.courses)
+        with app.app_context():
+            dialect = db.engine.dialect.name
+        client = app.test_client()
+        results = []
+        print('{0:<36} {1:>9} {2:>9} {3:>8}'.format(
+            'scenario', 'p50 ms', 'p99 ms', 'req/s'))
+        for name, url_of in scenarios(values):
+            if args.scenario and not any(k in name for k in args.scenario):
+                continue
+            result = run(client, url_of, args.requests, args.warmup)
+            result['scenario'] = name
+            results.append(result)
+            print('{0:<36} {1:9.2f} {2:9.2f} {3:8.1f}'.format(
+                name, result['p50'] * 1e3, result['p99'] * 1e3,
+                result['rps']))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'revision': git_revision(),
+                'python': sys.version.split()[0],
+                'database': dialect,
+                'courses': args.courses,
+                'cache': args.cache,
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""Measures :func:`dash.catalog.scraper.update_catalog` on synthetic
+campuses of several sizes.
+
+For each size, a campus is loaded into an empty database, synced again
+unchanged, and synced again with a few courses changed, added and
+removed. Wall time, number of queries and peak memory allocated during
+each sync are recorded. Peak memory is traced with :mod:`tracemalloc`,
+which slows the sync down, so times are comparable only between runs
+with the same options. Give ``--no-memory`` to measure time only.
+
+Run with ``python -m benchmarks.catalog_sync``, with the environment
+variables of ``manage.py`` set. The database is a temporary SQLite file
+unless ``-d`` is given. Give ``-o results.json`` to write the results as
+JSON, which can be compared between commits.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import sqlalchemy.event
+
+from dash.app import create_app
+from dash.catalog import staging
+from dash.catalog.models import (
+    Campus,
+    Course,
+    CourseClass,
+    Department,
+    GenEduCategory,
+    Subject,
+)
+from dash.catalog.scraper import update_catalog
+from dash.extensions import db
+from dash.settings import Config
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+
+def make_catalog(n, seed=0, changed=False):
+    """Returns entities of a campus with ``n`` courses, in the shapes of
+    ``tests/factories.py``. A third of courses are general ones in a
+    category. A course is in one to three departments, and has up to three
+    classes. The same arguments give the same catalog.
+
+    :param changed: If True, 5% of courses have another instructor, and 1%
+                    are replaced by new ones.
+    """
+    rand = random.Random(seed)
+    departments = [Department(code='D{0:05d}'.format(i),
+                              name='Department {0}'.format(i))
+                   for i in range(max(n // 50, 10))]
+    subjects = [Subject(code='S{0:06d}'.format(i),
+                        name='Subject {0}'.format(i))
+                for i in range(max(n // 2, 1))]
+    categories = [GenEduCategory(code='G{0}'.format(i),
+                                 name='Category {0}'.format(i))
+                  for i in range(10)]
+    courses = []
+    for i in range(n):
+        code = 'C{0:07d}'.format(i)
+        instructor = 'Instructor {0}'.format(rand.randrange(n))
+        if changed:
+            roll = rand.random()
+            if roll < 0.01:
+                code = 'N{0:07d}'.format(i)
+            elif roll < 0.06:
+                instructor += ' Jr.'
+        general = i % 3 == 0
+        course = Course(
+            code=code, instructor=instructor,
+            credit=rand.choice([1.0, 2.0, 3.0]),
+            subject=subjects[rand.randrange(len(subjects))],
+            major=not general,
+            gen_edu_category=rand.choice(categories) if general else None,
+            target_grade=None if general else rand.randint(1, 4),
+        )
+        for department in rand.sample(departments, rand.randint(1, 3)):
+            department.courses.add(course)
+        for _ in range(rand.randint(0, 3)):
+            start = rand.randint(1, 8)
+            course.classes.append(CourseClass(
+                day_of_week=rand.randint(0, 6), start_period=start,
+                end_period=start + 3))
+        courses.append(course)
+    return departments, subjects, categories, courses
+
+
+class QueryCounter(object):
+    """Counts queries sent through an engine."""
+
+    def __init__(self, engine):
+        self.count = 0
+        sqlalchemy.event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def measure(campus, catalog, counter, memory=True):
+    """Syncs a catalog, and returns a dict of measurements."""
+    departments, subjects, categories, courses = catalog
+    memory = memory and tracemalloc is not None
+    counter.count = 0
+    if memory:
+        tracemalloc.start()
+    start = time.time()
+    with update_catalog(campus) as held:
+        held.hold_departments(departments)
+        held.hold_subjects(subjects)
+        held.hold_gen_edu_categories(categories)
+        held.hold_courses(courses)
+    seconds = time.time() - start
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {
+        'seconds': seconds,
+        'queries': counter.count,
+        'peak_memory': peak,
+        'stats': dict((table, dict(operations))
+                      for table, operations in held.stats.items()),
+    }
+
+
+def benchmark(app, n, counter, memory=True):
+    """Returns measurements of the phases for a campus of ``n`` courses."""
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        campus = Campus(code='BENCH', name='Benchmark',
+                        scraper='benchmarks.catalog_sync')
+        db.session.add(campus)
+        db.session.commit()
+        results = []
+        for phase, changed in [('initial', False), ('unchanged', False),
+                               ('changed', True)]:
+            catalog = make_catalog(n, changed=changed)
+            result = measure(campus, catalog, counter, memory)
+            result.update({'courses': n, 'phase': phase})
+            results.append(result)
+            del catalog
+            db.session.expunge_all()
+            campus = Campus.query.filter_by(code='BENCH').one()
+        db.session.remove()
+        return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            stderr=subprocess.STDOUT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--courses', type=int, nargs='+',
+                        default=[1000, 10000, 100000],
+                        help='numbers of courses of campuses')
+    parser.add_argument('-d', '--database',
+                        help='URI of an empty database to use; defaults to '
+                             'a temporary SQLite file')
+    parser.add_argument('--staging', choices=['auto', 'on', 'off'],
+                        default='auto',
+                        help='whether to sync through staging tables')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='do not trace peak memory')
+    parser.add_argument('-o', '--output',
+                        help='path of a JSON file to write results to')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='dash-benchmark-')
+    try:
+        class BenchmarkConfig(Config):
+            SQLALCHEMY_DATABASE_URI = args.database or \
+                'sqlite:///' + os.path.join(tmpdir, 'dash.db')
+            CATALOG_SNAPSHOT_DIR = os.path.join(tmpdir, 'snapshots')
+            CATALOG_SYNC_STAGING = {'auto': None, 'on': True,
+                                    'off': False}[args.staging]
+            CACHE_TYPE = 'simple'
+
+        app = create_app(BenchmarkConfig)
+        with app.app_context():
+            counter = QueryCounter(db.engine)
+            dialect = db.engine.dialect.name
+            staged = staging.enabled()
+        results = []
+        print('{0:>8} {1:>10} {2:>9} {3:>8} {4:>10}'.format(
+            'courses', 'phase', 'seconds', 'queries', 'peak MiB'))
+        for n in args.courses:
+            for result in benchmark(app, n, counter, args.memory):
+                results.append(result)
+                peak = result['peak_memory']
+                print('{0:>8} {1:>10} {2:9.2f} {3:8d} {4:>10}'.format(
+                    n, result['phase'], result['seconds'], result['queries'],
+                    '-' if peak is None else
+                    '{0:.1f}'.format(peak / 2.0 ** 20)))
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'revision': git_revision(),
+                'python': sys.version.split()[0],
+                'database': dialect,
+                'staging': staged,
+                'tracemalloc': args.memory and tracemalloc is not None,
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
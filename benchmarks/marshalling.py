@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Compares precompiled serializers with :func:`flask_restful.marshal`
+on a page of courses built in memory.
+
+Run with ``python -m benchmarks.marshalling``.
+"""
+from __future__ import print_function
+
+import argparse
+import datetime as dt
+import json
+import timeit
+
+import pytz
+from flask.ext.restful import marshal
+
+from dash.catalog import api, models, occupancy
+from dash.catalog.marshalling import compile_fields
+
+
+def make_courses(n):
+    """Returns ``n`` transient courses shaped like scraped ones."""
+    now = dt.datetime(2015, 3, 1, tzinfo=pytz.utc)
+    campus = models.Campus(id=1, code='HYU', name='Campus', created_at=now)
+    departments = [
+        models.Department(id=i, code='D{0}'.format(i),
+                          name='Department {0}'.format(i),
+                          campus=campus, created_at=now)
+        for i in range(1, 11)
+    ]
+    category = models.GenEduCategory(id=1, code='G1', name='Category',
+                                     created_at=now)
+    courses = []
+    for i in range(1, n + 1):
+        subject = models.Subject(id=i, code='SUB{0}'.format(i),
+                                 name='Subject {0}'.format(i),
+                                 created_at=now)
+        course = models.Course(
+            id=i, code='{0:05d}'.format(i), instructor='Instructor',
+            credit=3.0, subject_id=subject.id, subject=subject,
+            gen_edu_category_id=category.id if i % 3 == 0 else None,
+            gen_edu_category=category if i % 3 == 0 else None,
+            target_grade=i % 4 + 1, created_at=now,
+        )
+        for j in range(2):
+            models.DepartmentCourse(
+                department=departments[(i + j) % len(departments)],
+                course=course)
+        course.classes = [
+            models.CourseClass(id=i * 2 + d, day_of_week=d,
+                               start_period=i % 10, end_period=i % 10 + 2,
+                               created_at=now)
+            for d in range(2)
+        ]
+        course.occupancy = occupancy.classes_mask(course.classes)
+        courses.append(course)
+    return courses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--courses', type=int, default=100,
+                        help='number of courses in a page')
+    parser.add_argument('-r', '--repeat', type=int, default=50,
+                        help='number of pages to serialize')
+    args = parser.parse_args()
+
+    courses = make_courses(args.courses)
+    serialize = compile_fields(api.course_fields)
+    expected = json.dumps([marshal(c, api.course_fields) for c in courses])
+    assert json.dumps([serialize(c) for c in courses]) == expected
+
+    results = []
+    for name, f in [('marshal', lambda c: marshal(c, api.course_fields)),
+                    ('compiled', serialize)]:
+        elapsed = min(timeit.repeat(lambda: [f(c) for c in courses],
+                                    number=args.repeat, repeat=3))
+        per_course = elapsed / (args.repeat * args.courses)
+        results.append(per_course)
+        print('{0:>10}: {1:8.2f} us/course'.format(name, per_course * 1e6))
+    print('{0:>10}: {1:8.2f}x'.format('speedup', results[0] / results[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Measures :func:`dash.catalog.timetable.iter_timetables` on random
+groups of options.
+
+Scenarios are those of ``tests/test_timetable.py``: sparse groups of which
+the first 1000 timetables are taken, and dense groups with no timetable,
+of which the whole search space is explored. Each scenario is run several
+times, and the best and median times are reported.
+
+Run with ``python -m benchmarks.timetable``, with the environment
+variables of ``manage.py`` set. Give ``-o results.json`` to write the
+results as JSON, which can be compared between commits.
+"""
+from __future__ import print_function
+
+import argparse
+import itertools
+import json
+import random
+import sys
+import timeit
+
+from dash.catalog.timetable import iter_timetables
+from tests.test_timetable import random_groups
+from .catalog_sync import git_revision
+
+#: Tuples of number of groups, options in a group, periods in a day and
+#: number of timetables taken, or None for all of them.
+SCENARIOS = [
+    (10, 20, 26, 1000),
+    (12, 24, 26, 1000),
+    (10, 20, 8, None),
+    (12, 24, 8, None),
+]
+
+
+def measure(groups, limit, repeat):
+    """Returns a dict of measurements of searching ``groups``."""
+    timer = timeit.default_timer
+    seconds = []
+    for _ in range(repeat):
+        start = timer()
+        found = sum(1 for _ in itertools.islice(iter_timetables(groups),
+                                                limit))
+        seconds.append(timer() - start)
+    seconds.sort()
+    return {
+        'timetables': found,
+        'best': seconds[0],
+        'median': seconds[len(seconds) // 2],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='number of runs of a scenario')
+    parser.add_argument('-o', '--output',
+                        help='path of a JSON file to write results to')
+    args = parser.parse_args()
+
+    results = []
+    print('{0:>6} {1:>7} {2:>7} {3:>6} {4:>10} {5:>9} {6:>9}'.format(
+        'groups', 'options', 'periods', 'limit', 'timetables', 'best s',
+        'median s'))
+    for n_groups, n_options, n_periods, limit in SCENARIOS:
+        groups = random_groups(random.Random(42), n_groups, n_options,
+                               n_periods=n_periods)
+        result = measure(groups, limit, args.repeat)
+        result.update({'groups': n_groups, 'options': n_options,
+                       'periods': n_periods, 'limit': limit})
+        results.append(result)
+        print('{0:>6} {1:>7} {2:>7} {3:>6} {4:>10} {5:9.3f} {6:9.3f}'.format(
+            n_groups, n_options, n_periods, limit or '-',
+            result['timetables'], result['best'], result['median']))
+        sys.stdout.flush()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'revision': git_revision(),
+                'python': sys.version.split()[0],
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,7 +12,7 @@ from dash.extensions import (
     migrate,
     api,
 )
-from dash import public, user, catalog
+from dash import public, user, catalog, timing
 
 
 def create_app(config_object=ProdConfig):
@@ -42,6 +42,7 @@ def register_extensions(app):
     login_manager.init_app(app)
     migrate.init_app(app, db)
     api.init_app(app)
+    timing.init_app(app)
 
     if app.config.get('ENV') == 'dev':
         from dash.extensions_dev import (
@@ -1,3 +1,3 @@
 '''The catalog module.'''
 
-from . import api
+from . import api, changes, snapshot
@@ -1,21 +1,41 @@
 # -*- coding: utf-8 -*-
+import base64
+import binascii
 from functools import wraps
+import itertools
+import json
+import numbers
 from collections import Mapping
 from six import iteritems, text_type
 import sqlalchemy.sql.expression
 from sqlalchemy.orm.exc import NoResultFound
-from flask import Blueprint, render_template, abort
+from flask import Blueprint, _request_ctx_stack, render_template, abort, \
+    request
+from flask.ext.sqlalchemy import Pagination
 from flask.ext.login import login_required
 from flask.ext.restful import (
     Resource,
     reqparse,
     fields,
-    marshal,
+    inputs,
 )
 
-from dash.catalog import models
+from dash.catalog import conflicts, models, occupancy, streaming
+from dash.catalog.caching import (
+    cached_response,
+    catalog_version,
+    conditional_response,
+    digest,
+)
+from dash.catalog.marshalling import compile_fields, select_fields
+from dash.catalog.search import (
+    keyword_filter_criterion,
+    like_filter_criterion,
+)
+from dash.catalog.timetable import iter_timetables
 from dash.database import db
-from dash.extensions import api
+from dash.extensions import api, cache
+from dash.timing import timed
 
 
 def extend(dst, *args):
@@ -68,6 +88,14 @@ class CourseType(fields.Raw):
         return 'general' if value is True else 'major'
 
 
+class Occupancy(fields.Raw):
+    """Custom field for weekly occupancy masks. Masks are formatted in
+    the fixed-width text form from :func:`dash.catalog.occupancy.to_hex`.
+    """
+    def format(self, value):
+        return occupancy.to_hex(value)
+
+
 course_fields = extend(entity_fields, {
     'type': CourseType(attribute='general'),
     'instructor': fields.String,
@@ -86,20 +114,98 @@ course_fields = extend(entity_fields, {
     'departments': fields.List(fields.Nested(department_fields),
                                attribute=lambda c: [d for d in c.departments]),
     'classes': fields.List(fields.Nested(course_class_fields)),
+    'occupancy': Occupancy,
 })
 
 
+def comma_separated(value):
+    """Type of request arguments which are lists separated by commas."""
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+
+def id_list(value):
+    """Type of request arguments which are lists of IDs separated by
+    commas.
+    """
+    return [int(v) for v in comma_separated(value)]
+
+
 class ResourceWithQuery(Resource):
+    """Base class for API endpoints of entities.
+
+    Clients may narrow the output with ``fields``, a comma-separated list
+    of keys of fields, in which nested fields are given with dotted keys,
+    e.g. ``fields=id,instructor,subject.name``. Fields of related entities,
+    listed in :attr:`relationships`, are shown only if they are in
+    ``fields`` or ``expand``, e.g. ``expand=classes`` shows all fields of
+    courses which are not of related entities, and their classes. Without
+    both, every field is shown. Related entities which are not shown are
+    not loaded by :meth:`query`.
+    """
     model = None
     fields = None
+    #: Serializer compiled from :attr:`fields` with
+    #: :func:`dash.catalog.marshalling.compile_fields`.
+    serializer = None
+    #: Keys of fields of related entities.
+    relationships = ()
+    #: Maximum number of serializers kept for selections of fields.
+    max_serializers = 64
+    method_decorators = [cached_response, conditional_response]
+    selection_parser = reqparse.RequestParser()
+    selection_parser.add_argument('fields', type=comma_separated)
+    selection_parser.add_argument('expand', type=comma_separated)
 
     @classmethod
     def query(cls, **kwargs):
         return db.session.query(cls.model)
 
+    @classmethod
+    def selection(cls):
+        """Returns ``fields`` and ``expand`` of the current request as a
+        tuple of tuples, in which arguments not given are None.
+        """
+        ctx = _request_ctx_stack.top
+        if ctx is None:
+            return None, None
+        selection = getattr(ctx, 'field_selection', None)
+        if selection is None:
+            args = cls.selection_parser.parse_args()
+            selection = ctx.field_selection = tuple(
+                None if args[key] is None else tuple(args[key])
+                for key in ('fields', 'expand'))
+        return selection
+
+    @classmethod
+    def selected(cls):
+        """Returns a tuple of the set of keys of fields selected in the
+        current request and their serializer. Serializers are compiled
+        once for each selection.
+        """
+        selection = cls.selection()
+        if selection == (None, None):
+            return frozenset(cls.fields), cls.serializer
+        serializers = cls.__dict__.get('_serializers')
+        if serializers is None:
+            serializers = {}
+            cls._serializers = serializers
+        selected = serializers.get(selection)
+        if selected is None:
+            try:
+                spec = select_fields(cls.fields, selection[0], selection[1],
+                                     cls.relationships)
+            except ValueError:
+                abort(400)
+            if len(serializers) >= cls.max_serializers:
+                serializers.clear()
+            selected = frozenset(spec), compile_fields(spec)
+            serializers[selection] = selected
+        return selected
+
     @classmethod
     def marshal(cls, data):
-        return marshal(data, cls.fields)
+        with timed('marshal'):
+            return cls.selected()[1](data)
 
 
 class Entity(ResourceWithQuery):
@@ -113,52 +219,190 @@ class Entity(ResourceWithQuery):
             abort(404)
 
 
-def like_filter_criterion(column, keyword, case_sensitive=False):
-    criterion_func = column.ilike if not case_sensitive else column.like
+def occupancy_columns(entity):
+    """Returns the columns of occupancy masks of days of courses."""
+    return [getattr(entity, name) for name in models.OCCUPANCY_COLUMNS]
 
-    for word in keyword.split():
-        yield criterion_func("%{}%".format(word))
+
+def fits_filter_criterion(entity, occupied):
+    """Returns a criterion which holds for courses of which the occupancy
+    mask does not overlap ``occupied``.
+
+    The mask of each day is tested with ``&`` on its column, so courses
+    are filtered in SQL along with the other criteria, with one bound
+    parameter for each day occupied.
+    """
+    criteria = [column.op('&')(day_mask) == 0
+                for column, day_mask in zip(occupancy_columns(entity),
+                                            occupancy.day_masks(occupied))
+                if day_mask]
+    if not criteria:
+        return sqlalchemy.sql.expression.true()
+    return sqlalchemy.and_(*criteria)
 
 
 class Collection(ResourceWithQuery):
     """Base class for API endpoints that shows list of entities.
+
+    Entities are streamed as newline-delimited JSON if the client prefers
+    it. See :mod:`dash.catalog.streaming`.
     """
+    #: Number of entities fetched at a time when streaming.
+    batch_size = 100
+
     @classmethod
     def query(cls, **kwargs):
         return super(Collection, cls).query(**kwargs).order_by(cls.model.id)
 
     def get(self, **kwargs):
         query = self.query(**kwargs)
+        if streaming.requested():
+            return self.stream(query)
         items = query.all()
         ret_objects = [self.marshal(item) for item in items]
         return {
             'objects': ret_objects,
         }, 200
 
+    def stream(self, query, limit=None, offset=None):
+        """Returns a response which streams entities from a query as
+        newline-delimited JSON.
+        """
+        batches = streaming.iter_batches(query, self.model.id,
+                                         self.batch_size, limit, offset)
+        return streaming.response(batches, self.marshal)
+
+
+def encode_cursor(key):
+    """Encodes the sort key of the last entity in a page into an opaque
+    cursor token.
+    """
+    data = json.dumps(key, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Decodes a cursor token from :func:`encode_cursor`.
+
+    :raises ValueError: if the token is malformed.
+    """
+    try:
+        data = base64.urlsafe_b64decode(
+            token.encode('ascii') + b'=' * (-len(token) % 4))
+        key = json.loads(data.decode('utf-8'))
+    except (TypeError, UnicodeError, binascii.Error) as e:
+        raise ValueError('malformed cursor: {0}'.format(e))
+    if isinstance(key, bool) or not isinstance(key, numbers.Integral):
+        raise ValueError('malformed cursor')
+    return key
+
 
 class PaginatedCollection(Collection):
     """Base class for API endpoints that shows list of entities with
     pagination.
+
+    Totals of entities and pages are returned unless ``count`` is false.
+    Totals are cached for each set of filtering arguments and catalog
+    version, since they can change only when catalog is updated.
+
+    Pages are addressed with ``page`` by default. If ``after`` is given,
+    pages are addressed with cursor tokens instead: ``after`` should be
+    empty for the first page, and the ``next`` token of a page for the
+    page following it. Cursor pages are fetched by seeking on the ID of
+    entities, so the cost of a page does not depend on its depth.
+
+    Pages addressed with ``page`` can be streamed as newline-delimited
+    JSON. Streamed pages do not carry totals, and pages past the last one
+    are empty instead of not found.
     """
     parser = reqparse.RequestParser()
     parser.add_argument('page', type=int)
     parser.add_argument('results_per_page', type=int)
+    parser.add_argument('after', type=text_type)
+    parser.add_argument('count', type=inputs.boolean)
+
+    #: Names of arguments which do not change the set of entities.
+    paging_args = frozenset(['page', 'results_per_page', 'after', 'count'])
 
     def get(self, **kwargs):
         args = self.parser.parse_args()
+        if args.get('after') is not None:
+            return self.get_after(args, **kwargs)
+
         page = args.get('page') or 1
+        per_page = args.get('results_per_page') or 20
+        if page < 1:
+            abort(404)
 
         query = self.query(**kwargs)
-        pagination = query.paginate(
-            page,
-            per_page=args.get('results_per_page') or 20,
-        )
+        if streaming.requested():
+            return self.stream(query, per_page, (page - 1) * per_page)
+        items = query.limit(per_page).offset((page - 1) * per_page).all()
+        if not items and page != 1:
+            abort(404)
 
-        ret_objects = [self.marshal(item) for item in pagination.items]
-        return {
-            'num_results': pagination.total,
+        ret_objects = [self.marshal(item) for item in items]
+        ret = {
             'page': page,
-            'num_pages': pagination.pages,
+            'objects': ret_objects,
+        }
+        if args.get('count') is not False:
+            # No need to count if the first page is not full.
+            if page == 1 and len(items) < per_page:
+                total = len(items)
+            else:
+                total = self.count(query, args, **kwargs)
+            pagination = Pagination(None, page, per_page, total, items)
+            ret['num_results'] = pagination.total
+            ret['num_pages'] = pagination.pages
+        return ret, 200
+
+    def count(self, query, args, **kwargs):
+        """Returns the number of entities in the collection. Numbers are
+        cached with the key from :meth:`count_cache_key`.
+        """
+        key = self.count_cache_key(args, **kwargs)
+        total = cache.get(key)
+        if total is None:
+            total = query.order_by(None).count()
+            cache.set(key, total)
+        return total
+
+    def count_cache_key(self, args, **kwargs):
+        """Returns the cache key for the number of entities, which is
+        derived from the endpoint, the filtering arguments and the catalog
+        version.
+        """
+        filters = sorted((k, v) for k, v in iteritems(args)
+                         if k not in self.paging_args and v is not None)
+        return 'count:{0}:{1}:{2}'.format(request.endpoint,
+                                          catalog_version(),
+                                          digest(filters,
+                                                 sorted(iteritems(kwargs))))
+
+    def get_after(self, args, **kwargs):
+        """Returns a page addressed with a cursor token.
+        """
+        query = self.query(**kwargs)
+        after = args['after']
+        if after:
+            try:
+                query = query.filter(self.model.id > decode_cursor(after))
+            except ValueError:
+                abort(400)
+
+        per_page = args.get('results_per_page') or 20
+        if per_page < 1:
+            abort(400)
+        items = query.limit(per_page + 1).all()
+        next_token = None
+        if len(items) > per_page:
+            items = items[:per_page]
+            next_token = encode_cursor(items[-1].id)
+
+        ret_objects = [self.marshal(item) for item in items]
+        return {
+            'next': next_token,
             'objects': ret_objects,
         }, 200
 
@@ -201,6 +445,15 @@ def when(variable, query_processor, **query_processors):
 class CampusMixin(object):
     model = models.Campus
     fields = campus_fields
+    serializer = staticmethod(compile_fields(campus_fields))
+    relationships = ('departments',)
+
+    @classmethod
+    def query(cls, **kwargs):
+        q = super(CampusMixin, cls).query(**kwargs)
+        if 'departments' in cls.selected()[0]:
+            q = q.options(db.subqueryload(cls.model.departments))
+        return q
 
 
 class Campus(CampusMixin, Entity):
@@ -216,6 +469,7 @@ qp_department_campus_id = lambda q, v: q.filter(models.Department.campus_id == v
 class DepartmentMixin(object):
     model = models.Department
     fields = department_fields
+    serializer = staticmethod(compile_fields(department_fields))
 
 
 @when('campus_id', qp_department_campus_id)
@@ -231,6 +485,7 @@ class DepartmentList(DepartmentMixin, Collection):
 class SubjectMixin(object):
     model = models.Subject
     fields = subject_fields
+    serializer = staticmethod(compile_fields(subject_fields))
 
 
 class Subject(SubjectMixin, Entity):
@@ -244,6 +499,7 @@ class SubjectList(SubjectMixin, PaginatedCollection):
 class GenEduCategoryMixin(object):
     model = models.GenEduCategory
     fields = gen_edu_category_fields
+    serializer = staticmethod(compile_fields(gen_edu_category_fields))
 
 
 class GenEduCategory(GenEduCategoryMixin, Entity):
@@ -257,17 +513,31 @@ class GenEduCategoryList(GenEduCategoryMixin, Collection):
 class CourseMixin(ResourceWithQuery):
     model = models.Course
     fields = course_fields
+    serializer = staticmethod(compile_fields(course_fields))
+    relationships = ('subject', 'gen_edu_category', 'category',
+                     'departments', 'classes')
 
     @classmethod
     def query(cls, **kwargs):
         # contains_eager() is used instead of joinedload() for filtering
         # by fields of subject. subqueryload() is used to make
-        # pagination correct.
-        return super(CourseMixin, cls).query(**kwargs) \
-            .join(cls.model.subject) \
-            .options(db.contains_eager(cls.model.subject)) \
-            .options(db.subqueryload(cls.model.department_courses)
-                       .joinedload(models.DepartmentCourse.department))
+        # pagination correct. Related entities which are not shown are
+        # not loaded.
+        q = super(CourseMixin, cls).query(**kwargs)
+        keys = cls.selected()[0]
+        if 'subject' in keys:
+            q = q.join(cls.model.subject) \
+                .options(db.contains_eager(cls.model.subject))
+        else:
+            q = q.options(db.lazyload(cls.model.subject))
+        if not keys & set(['gen_edu_category', 'category']):
+            q = q.options(db.lazyload(cls.model.gen_edu_category))
+        if 'departments' in keys:
+            q = q.options(db.subqueryload(cls.model.department_courses)
+                            .joinedload(models.DepartmentCourse.department))
+        if 'classes' in keys:
+            q = q.options(db.subqueryload(cls.model.classes))
+        return q
 
     @classmethod
     def filter_related(cls, q, dept_id, campus_id):
@@ -305,7 +575,17 @@ class Course(CourseMixin, Entity):
 
 
 class CourseList(CourseMixin, PaginatedCollection):
+    """API endpoint of courses.
+
+    Courses of which the IDs are given in ``ids`` are returned at once
+    without pagination, e.g. ``/courses?ids=1,2,3``, so that clients
+    holding many IDs fetch them with one request and one query instead
+    of one request for each course. Courses are returned in the order of
+    ``ids``, once each. Other filters still apply, and IDs of courses
+    which do not exist or do not match them are omitted.
+    """
     parser = PaginatedCollection.parser.copy()
+    parser.add_argument('ids', type=id_list)
     parser.add_argument('name', type=text_type)
     parser.add_argument('subject_code', type=text_type)
     parser.add_argument('instructor', type=text_type)
@@ -313,12 +593,39 @@ class CourseList(CourseMixin, PaginatedCollection):
     parser.add_argument('category_id', type=int)
     parser.add_argument('target_grade', type=int)
     parser.add_argument('department_id', type=int)
+    parser.add_argument('occupied', type=occupancy.from_hex)
+    parser.add_argument('free', type=occupancy.from_hex)
+
+    #: Maximum number of IDs in ``ids``.
+    max_ids = 200
+
+    def get(self, **kwargs):
+        ids = self.parser.parse_args().get('ids')
+        if ids is None:
+            return super(CourseList, self).get(**kwargs)
+        if len(ids) > self.max_ids:
+            abort(400)
+        if not ids:
+            return {'objects': []}, 200
+        query = self.query(**kwargs).filter(self.model.id.in_(ids))
+        by_id = dict((item.id, item) for item in query.all())
+        items = [by_id.pop(id) for id in ids if id in by_id]
+        if streaming.requested():
+            # At most max_ids courses are streamed, in one batch.
+            return streaming.response([items], self.marshal)
+        return {
+            'objects': [self.marshal(item) for item in items],
+        }, 200
 
     @classmethod
     def query(cls, **kwargs):
         q = super(CourseList, cls).query(**kwargs)
         entity = cls.model
         args = cls.parser.parse_args()
+        if (args.get('name') or args.get('subject_code')) and \
+                'subject' not in cls.selected()[0]:
+            # Keywords in these are matched against subjects.
+            q = q.join(entity.subject)
 
         dept_id = args.get('department_id')
         campus_id = kwargs.get('campus_id')
@@ -341,16 +648,134 @@ class CourseList(CourseMixin, PaginatedCollection):
         for argname in ('name', 'subject_code', 'instructor'):
             argval = args.get(argname)
             if argval:
-                column = getattr(cls.model, argname)
-                q = q.filter(*like_filter_criterion(column, argval))
+                q = q.filter(*keyword_filter_criterion(argname, argval))
 
         for argname, column in attrs_for_eq:
             argval = args.get(argname)
             if argval:
                 q = q.filter(column == argval)
 
+        occupied = args.get('occupied')
+        free = args.get('free')
+        if occupied is not None or free is not None:
+            if free is not None:
+                occupied = (occupied or occupancy.EMPTY) | \
+                    (occupancy.FULL & ~free)
+            q = q.filter(fits_filter_criterion(entity, occupied))
+
         return q
 
+
+class Timetables(Resource):
+    """API endpoint that lists timetables without time conflicts.
+
+    A timetable has one course for each subject in ``subject_id`` and
+    every course in ``course_id``. Subjects for which some course is
+    given in ``course_id`` are satisfied by that course.
+    """
+    method_decorators = [cached_response]
+    parser = reqparse.RequestParser()
+    parser.add_argument('subject_id', type=int, action='append')
+    parser.add_argument('course_id', type=int, action='append')
+    parser.add_argument('limit', type=int)
+
+    #: Maximum number of timetables in a response.
+    max_limit = 1000
+
+    def get(self, **kwargs):
+        args = self.parser.parse_args()
+        subject_ids = args.get('subject_id') or []
+        course_ids = args.get('course_id') or []
+        if not subject_ids and not course_ids:
+            abort(400)
+        limit = min(args.get('limit') or 100, self.max_limit)
+        if limit < 1:
+            abort(400)
+
+        # Duplicate course would conflict with itself.
+        course_ids = sorted(set(course_ids), key=course_ids.index)
+
+        Course = models.Course
+        criteria = []
+        if subject_ids:
+            criteria.append(Course.subject_id.in_(subject_ids))
+        if course_ids:
+            criteria.append(Course.id.in_(course_ids))
+        q = db.session.query(Course.id, Course.subject_id,
+                             *occupancy_columns(Course)) \
+            .filter(db.or_(*criteria))
+        campus_id = kwargs.get('campus_id')
+        if campus_id:
+            q = CourseMixin.filter_related(q, None, campus_id)
+        courses = [(row[0], row[1], occupancy.from_day_masks(row[2:]))
+                   for row in q.order_by(Course.id)]
+
+        subject_of = dict((course_id, subject_id)
+                          for course_id, subject_id, _ in courses)
+        masks = dict((course_id, mask) for course_id, _, mask in courses)
+        if any(course_id not in subject_of for course_id in course_ids):
+            abort(404)
+        groups = [[(course_id, masks[course_id])]
+                  for course_id in course_ids]
+        pinned = set(subject_of[course_id] for course_id in course_ids)
+        for subject_id in subject_ids:
+            if subject_id in pinned:
+                continue
+            pinned.add(subject_id)
+            groups.append([(course_id, mask)
+                           for course_id, s_id, mask in courses
+                           if s_id == subject_id])
+
+        timetables = iter_timetables(groups)
+        ret_objects = [{'course_ids': list(t)}
+                       for t in itertools.islice(timetables, limit)]
+        truncated = next(timetables, None) is not None
+        return {
+            'truncated': truncated,
+            'objects': ret_objects,
+        }, 200
+
+
+class CourseConflicts(Resource):
+    """API endpoint that lists courses of a campus whose classes conflict
+    with the classes of a course.
+    """
+    method_decorators = [cached_response]
+
+    def get(self, campus_id, id):
+        matrix = conflicts.get_matrix(campus_id)
+        try:
+            return {
+                'course_id': id,
+                'conflicts': matrix.conflicts(id),
+            }, 200
+        except KeyError:
+            abort(404)
+
+
+class CourseConflictList(Resource):
+    """API endpoint that lists conflicting courses of a campus for each
+    course in ``course_id``.
+    """
+    method_decorators = [cached_response]
+    parser = reqparse.RequestParser()
+    parser.add_argument('course_id', type=int, action='append')
+
+    def get(self, campus_id):
+        args = self.parser.parse_args()
+        course_ids = args.get('course_id') or []
+        matrix = conflicts.get_matrix(campus_id)
+        try:
+            ret_objects = [{
+                'course_id': course_id,
+                'conflicts': matrix.conflicts(course_id),
+            } for course_id in course_ids]
+        except KeyError:
+            abort(404)
+        return {
+            'objects': ret_objects,
+        }, 200
+
 api.add_resource(Campus, '/campuses/<int:id>')
 api.add_resource(CampusList, '/campuses')
 api.add_resource(Department,
@@ -369,3 +794,10 @@ api.add_resource(Course,
 api.add_resource(CourseList,
                  '/courses',
                  '/campuses/<int:campus_id>/courses')
+api.add_resource(CourseConflicts,
+                 '/campuses/<int:campus_id>/courses/<int:id>/conflicts')
+api.add_resource(CourseConflictList,
+                 '/campuses/<int:campus_id>/conflicts')
+api.add_resource(Timetables,
+                 '/timetables',
+                 '/campuses/<int:campus_id>/timetables')
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""Updating catalogs of several campuses at once.
+
+Updating the catalog of a campus mostly waits for its course registration
+system, so updating campuses one after another takes about the sum of
+their times, which no longer fits in the nightly window.
+:func:`update_campuses` runs the scrapers of campuses concurrently in a
+pool of processes instead.
+
+Each campus is updated in a fresh process with its own application, and
+so with its own database session and transaction. A campus whose scraper
+fails is rolled back, and does not affect the others. A :class:`Result`
+is returned for each campus, so that failures can be reported at the end.
+"""
+import collections
+import importlib
+import multiprocessing
+import time
+
+from flask import current_app
+
+from dash.catalog.models import Campus
+from dash.extensions import db
+
+
+__all__ = ['Result', 'update_campuses', 'summary']
+
+
+class Result(collections.namedtuple('Result', ['code', 'seconds', 'error'])):
+    """Result of updating the catalog of a campus. ``error`` is a message
+    if the update failed, or None.
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+#: Settings of the current application which the processes take over
+#: from it, by name or prefix. The rest are those of the config object.
+_SETTINGS = ('SQLALCHEMY_DATABASE_URI', 'CATALOG_')
+
+
+def _update(args):
+    # Imported here, since dash.app imports this package.
+    from dash.app import create_app
+    config_object, settings, code = args
+    start = time.time()
+    app = create_app(config_object)
+    app.config.update(settings)
+    with app.app_context():
+        try:
+            campus = Campus.query.filter_by(code=code).first()
+            if campus is None:
+                return Result(code, 0.0, 'no such campus')
+            importlib.import_module(campus.scraper).update(campus)
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception(
+                'Failed to update catalog of campus {0}'.format(code))
+            return Result(code, time.time() - start,
+                          '{0}: {1}'.format(type(e).__name__, e))
+        finally:
+            db.session.remove()
+            db.get_engine(app).dispose()
+    return Result(code, time.time() - start, None)
+
+
+def update_campuses(codes, config_object, processes=None):
+    """Updates catalogs of campuses concurrently, using the scraper of each
+    campus as ``manage.py update_catalog -c <code>`` does.
+
+    :param codes: Codes of campuses.
+    :param config_object: Import path of the config object from which the
+                          processes create their applications, such as
+                          ``'dash.settings.ProdConfig'``. The database and
+                          catalog settings are taken over from the current
+                          application.
+    :param processes: Number of campuses updated at once. Defaults to the
+                      number of CPUs.
+    :returns: List of :class:`Result` objects in the order of ``codes``.
+    """
+    codes = list(codes)
+    if not codes:
+        return []
+    processes = min(processes or multiprocessing.cpu_count(), len(codes))
+    settings = dict((key, value) for key, value in current_app.config.items()
+                    if key.startswith(_SETTINGS))
+    # Connections must not be shared with the forked processes.
+    db.session.remove()
+    db.get_engine(current_app).dispose()
+    pool = multiprocessing.Pool(processes, maxtasksperchild=1)
+    try:
+        return pool.map(_update, [(config_object, settings, code)
+                                   for code in codes],
+                        chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def summary(results):
+    """Returns lines summarizing results of :func:`update_campuses`."""
+    width = max([len(result.code) for result in results] + [4])
+    lines = []
+    for result in results:
+        line = u'{0:<{width}}  {1:<6}  {2:7.1f}s'.format(
+            result.code, 'ok' if result.ok else 'failed', result.seconds,
+            width=width)
+        if not result.ok:
+            line += u'  ' + result.error
+        lines.append(line)
+    failed = sum(1 for result in results if not result.ok)
+    lines.append(u'{0} campuses updated, {1} failed'.format(
+        len(results) - failed, failed))
+    return lines
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""Caching of data derived from catalog.
+
+Catalog is changed only by :func:`dash.catalog.scraper.update_catalog`,
+which creates a new :class:`dash.catalog.models.CatalogVersion` on each
+run. Everything cached here is keyed on the latest version, so entries
+for older versions are never read again and just expire.
+
+The latest version is itself cached for ``CATALOG_VERSION_TIMEOUT``
+seconds. ``update_catalog`` stores the new version in the cache when it
+commits, so if the cache backend is shared by all processes, new
+versions are seen immediately. Otherwise, they are seen within the
+timeout.
+"""
+from functools import wraps
+import hashlib
+
+from flask import current_app, request
+from six import iteritems
+from werkzeug.http import quote_etag
+
+from dash.catalog import models, streaming
+from dash.extensions import cache
+
+
+__all__ = [
+    'catalog_version',
+    'publish_catalog_version',
+    'digest',
+    'cached_response',
+    'conditional_response',
+]
+
+CATALOG_VERSION_KEY = 'catalog_version'
+
+
+def catalog_version():
+    """Returns the ID of the latest catalog version.
+    """
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        version = models.CatalogVersion.current()
+        cache.set(CATALOG_VERSION_KEY, version,
+                  timeout=current_app.config['CATALOG_VERSION_TIMEOUT'])
+    return version
+
+
+def publish_catalog_version(version):
+    """Stores the ID of a newly committed catalog version in the cache.
+    """
+    cache.set(CATALOG_VERSION_KEY, version,
+              timeout=current_app.config['CATALOG_VERSION_TIMEOUT'])
+
+
+def digest(*args):
+    """Returns a hexadecimal digest of the representations of arguments.
+    """
+    return hashlib.sha1(repr(args).encode('utf-8')).hexdigest()
+
+
+def request_digest():
+    """Returns a digest of the view arguments, the query arguments and the
+    preferred media type of the current request. Query arguments are
+    normalized, so it does not matter in which order they are given.
+    """
+    view_args = sorted(iteritems(request.view_args or {}))
+    query_args = sorted(request.args.items(multi=True))
+    return digest(view_args, query_args, streaming.requested())
+
+
+def cached_response(f):
+    """A decorator for methods of API resources which caches return values
+    for each endpoint, request arguments and catalog version. Only
+    successful responses are cached.
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        key = 'response:{0}:{1}:{2}'.format(request.endpoint,
+                                            catalog_version(),
+                                            request_digest())
+        rv = cache.get(key)
+        if rv is None:
+            rv = f(*args, **kwargs)
+            if isinstance(rv, tuple) and rv[1] == 200:
+                cache.set(key, rv)
+        return rv
+    return wrapper
+
+
+def conditional_response(f):
+    """A decorator for methods of API resources which adds strong ETags
+    to successful responses, and responds with 304 Not Modified without
+    calling the method if the client already has the data.
+
+    ETags are derived from the endpoint, request arguments and catalog
+    version, so they can be checked before the response is made. Since
+    they also depend on the preferred media type, responses vary on
+    ``Accept``.
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        etag = digest(request.endpoint, catalog_version(), request_digest())
+        headers = {'ETag': quote_etag(etag), 'Vary': 'Accept'}
+        if request.if_none_match.contains(etag):
+            return current_app.response_class(status=304, headers=headers)
+
+        rv = f(*args, **kwargs)
+        if isinstance(rv, current_app.response_class):
+            if rv.status_code == 200:
+                rv.headers.extend(headers)
+        elif isinstance(rv, tuple) and rv[1] == 200:
+            if len(rv) > 2:
+                headers = dict(rv[2], **headers)
+            rv = (rv[0], rv[1], headers)
+        return rv
+    return wrapper
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""Change feed of catalog.
+
+Clients which hold a copy of the catalog, such as the timetable UI with
+a cached snapshot, would otherwise download the whole catalog again
+after every update, though only a few entities change in an update.
+:func:`dash.catalog.scraper.update_catalog` records the IDs of entities
+created, updated and deleted in each catalog version, and
+``/catalog/changes?since=<version>`` lists entities changed after a
+version, so that such clients fetch only those.
+
+A course is also updated if its classes or departments change. Changes
+are kept for ``CATALOG_CHANGES_RETENTION_DAYS`` days. Clients holding an
+older version get ``410 Gone``, and should fetch the whole catalog.
+"""
+import collections
+import datetime
+
+from flask import abort, current_app
+from flask.ext.restful import Resource, reqparse
+
+from dash.catalog import models
+from dash.catalog.caching import cached_response, conditional_response
+from dash.database import db
+from dash.extensions import api
+from dash.utils import utcnow
+
+
+__all__ = ['Changes', 'Expired', 'record', 'prune', 'since']
+
+#: Tables of entities of which changes are recorded.
+ENTITIES = ('departments', 'subjects', 'gen_edu_categories', 'courses')
+#: Operations on entities, in the order in which they are listed.
+OPERATIONS = ('created', 'updated', 'deleted')
+
+
+class Expired(Exception):
+    """Raised if changes after a version are no longer kept."""
+
+
+class Changes(object):
+    """IDs of entities written by a sync, by table and operation."""
+
+    def __init__(self):
+        self._ids = dict((entity, dict((op, set()) for op in OPERATIONS))
+                         for entity in ENTITIES)
+
+    def add(self, entity, operation, ids):
+        """Adds IDs of entities of a table on which an operation was done.
+        """
+        self._ids[entity][operation].update(ids)
+
+    def ids(self, entity, operation):
+        """Returns a sorted list of IDs of entities of a table on which an
+        operation was done. Entities created or deleted are not listed as
+        updated.
+        """
+        ids = self._ids[entity][operation]
+        if operation == 'updated':
+            ids = ids - self._ids[entity]['created'] - \
+                self._ids[entity]['deleted']
+        return sorted(ids)
+
+    def __iter__(self):
+        """Yields ``(entity, operation, id)`` tuples."""
+        for entity in ENTITIES:
+            for operation in OPERATIONS:
+                for id in self.ids(entity, operation):
+                    yield entity, operation, id
+
+
+def record(version, changes):
+    """Records changes made in a catalog version. This does not commit.
+
+    :param version: :class:`dash.catalog.models.CatalogVersion` object,
+                    which has been flushed.
+    :param changes: :class:`Changes` object.
+    """
+    rows = [{'version_id': version.id, 'entity': entity,
+             'entity_id': id, 'operation': operation}
+            for entity, operation, id in changes]
+    if rows:
+        db.session.execute(models.CatalogChange.__table__.insert(), rows)
+
+
+def prune():
+    """Deletes changes of catalog versions older than
+    ``CATALOG_CHANGES_RETENTION_DAYS`` days. This does not commit.
+
+    :returns: Number of changes deleted.
+    """
+    CatalogChange = models.CatalogChange
+    CatalogVersion = models.CatalogVersion
+    cutoff = utcnow() - datetime.timedelta(
+        days=current_app.config['CATALOG_CHANGES_RETENTION_DAYS'])
+    return CatalogChange.query \
+        .filter(CatalogChange.version_id.in_(
+            db.session.query(CatalogVersion.id)
+                      .filter(CatalogVersion.created_at < cutoff))) \
+        .delete(synchronize_session=False)
+
+
+def _merge(operations):
+    first, last = operations[0], operations[-1]
+    if last == 'deleted':
+        return None if first == 'created' else 'deleted'
+    if 'created' in (first, last):
+        return 'created'
+    return 'updated'
+
+
+def since(version):
+    """Returns IDs of entities changed after a catalog version, as
+    ``ids[entity][operation]``. Changes in later versions are merged, so
+    an entity is listed once. An entity which was created and deleted
+    after the version is not listed.
+
+    :param version: ID of a catalog version, or 0 for the empty catalog.
+    :returns: A tuple of the ID of the latest version and the IDs.
+    :raises ValueError: if there is no such version.
+    :raises Expired: if changes after the version are no longer kept.
+    """
+    CatalogChange = models.CatalogChange
+    CatalogVersion = models.CatalogVersion
+    current = CatalogVersion.current()
+    if not 0 <= version <= current:
+        raise ValueError('no such catalog version: {0}'.format(version))
+
+    # Every version since the first one with changes has changes, so the
+    # versions before that one have been pruned, or were created before
+    # changes were recorded.
+    first = db.session.query(db.func.min(CatalogChange.version_id)).scalar()
+    q_missing = CatalogVersion.query.filter(CatalogVersion.id > version)
+    if first is not None:
+        q_missing = q_missing.filter(CatalogVersion.id < first)
+    if db.session.query(q_missing.exists()).scalar():
+        raise Expired(version)
+
+    operations = collections.OrderedDict()
+    for entity, entity_id, operation in db.session.query(
+            CatalogChange.entity, CatalogChange.entity_id,
+            CatalogChange.operation) \
+            .filter(CatalogChange.version_id > version) \
+            .filter(CatalogChange.version_id <= current) \
+            .order_by(CatalogChange.version_id, CatalogChange.id):
+        operations.setdefault((entity, entity_id), []).append(operation)
+    ids = dict((entity, dict((op, []) for op in OPERATIONS))
+               for entity in ENTITIES)
+    for (entity, entity_id), ops in operations.items():
+        operation = _merge(ops)
+        if operation is not None:
+            ids[entity][operation].append(entity_id)
+    for by_operation in ids.values():
+        for entity_ids in by_operation.values():
+            entity_ids.sort()
+    return current, ids
+
+
+class CatalogChanges(Resource):
+    """API endpoint that lists IDs of entities changed after the catalog
+    version in ``since``.
+    """
+    method_decorators = [cached_response, conditional_response]
+    parser = reqparse.RequestParser()
+    parser.add_argument('since', type=int, required=True)
+
+    def get(self):
+        args = self.parser.parse_args()
+        try:
+            version, ids = since(args['since'])
+        except ValueError:
+            abort(400)
+        except Expired:
+            abort(410)
+        return {
+            'since': args['since'],
+            'version': version,
+            'changes': ids,
+        }, 200
+
+
+api.add_resource(CatalogChanges, '/catalog/changes')
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""Columnar binary export of the courses of a campus.
+
+Batch jobs which compute timetables need only a few numbers per course,
+but loading a campus through the ORM builds full model objects for
+every course and class. :func:`export` writes those numbers as
+fixed-width NumPy arrays in one file, and :func:`load` maps the file
+with :class:`numpy.memmap`, so it opens instantly, and processes which
+load the same file share its pages through the OS cache.
+
+The file starts with :data:`MAGIC`, followed by the length of a JSON
+header as a little-endian 32-bit integer, the header, and the arrays.
+The header holds the dtype, shape and offset of each array, and offsets
+are aligned to :data:`ALIGNMENT` bytes. These arrays are written:
+
+``course_id``, ``subject_id``, ``gen_edu_category_id``, ``credit``,
+``target_grade``
+    One item per course, sorted by course ID. Missing IDs and grades are
+    stored as -1.
+``occupancy``
+    Occupancy mask of each course, as a row of ``MASK_BITS // 8`` bytes
+    in big-endian order.
+``class_offset``
+    Classes of the course at index ``i`` are at indexes from
+    ``class_offset[i]`` to ``class_offset[i + 1]`` of the class arrays.
+``class_day_of_week``, ``class_start_period``, ``class_end_period``
+    One item per class, grouped by course.
+"""
+import binascii
+import json
+import os
+import struct
+import tempfile
+
+import numpy as np
+from sqlalchemy import select
+
+from dash.catalog import models, occupancy
+from dash.catalog.conflicts import ConflictMatrix
+from dash.database import db
+
+
+__all__ = ['export', 'load', 'CourseArrays']
+
+#: Bytes which start a file of this format.
+MAGIC = b'DASHCOL1'
+#: Alignment of arrays in a file, in bytes.
+ALIGNMENT = 64
+
+_COURSE_DTYPES = [
+    ('course_id', '<i8'),
+    ('subject_id', '<i8'),
+    ('gen_edu_category_id', '<i8'),
+    ('credit', '<f8'),
+    ('target_grade', '<i2'),
+]
+_CLASS_DTYPES = [
+    ('class_day_of_week', '<i1'),
+    ('class_start_period', '<i1'),
+    ('class_end_period', '<i1'),
+]
+_MASK_BYTES = occupancy.MASK_BITS // 8
+
+
+class CourseArrays(object):
+    """Arrays of courses and classes loaded by :func:`load`. Each array
+    in the file is an attribute of the same name.
+
+    :param header: Header of the file.
+    :param arrays: Dict of arrays by name.
+    """
+
+    def __init__(self, header, arrays):
+        self.campus_id = header['campus_id']
+        self.version = header['version']
+        for name, array in arrays.items():
+            setattr(self, name, array)
+
+    def __len__(self):
+        return len(self.course_id)
+
+    def index(self, course_id):
+        """Returns the index of a course in the arrays.
+
+        :raises KeyError: if the course is not in the arrays.
+        """
+        i = int(np.searchsorted(self.course_id, course_id))
+        if i < len(self.course_id) and self.course_id[i] == course_id:
+            return i
+        raise KeyError(course_id)
+
+    def mask(self, i):
+        """Returns the occupancy mask of the course at an index as an
+        integer.
+        """
+        return int(binascii.hexlify(self.occupancy[i].tobytes()), 16)
+
+    def classes(self, i):
+        """Returns ``(day_of_week, start_period, end_period)`` tuples of
+        the classes of the course at an index.
+        """
+        start, end = self.class_offset[i], self.class_offset[i + 1]
+        return list(zip(self.class_day_of_week[start:end].tolist(),
+                        self.class_start_period[start:end].tolist(),
+                        self.class_end_period[start:end].tolist()))
+
+    def conflict_matrix(self):
+        """Returns the :class:`dash.catalog.conflicts.ConflictMatrix` over
+        the courses.
+        """
+        return ConflictMatrix.from_packed(self.course_id, self.occupancy)
+
+
+def _course_arrays(campus_id):
+    Course = models.Course.__table__
+    DepartmentCourse = models.DepartmentCourse.__table__
+    Department = models.Department.__table__
+    q_course_ids = select([DepartmentCourse.c.course_id]) \
+        .select_from(DepartmentCourse.join(Department)) \
+        .where(Department.c.campus_id == campus_id)
+    rows = db.session.execute(
+        select([Course.c.id,
+                Course.c.subject_id,
+                Course.c.gen_edu_category_id,
+                Course.c.credit,
+                Course.c.target_grade] +
+               [Course.c[name] for name in models.OCCUPANCY_COLUMNS])
+        .where(Course.c.id.in_(q_course_ids))
+        .order_by(Course.c.id)
+    ).fetchall()
+
+    arrays = {}
+    for i, (name, dtype) in enumerate(_COURSE_DTYPES):
+        arrays[name] = np.array([-1 if row[i] is None else row[i]
+                                 for row in rows], dtype=dtype)
+    # Masks of days are packed from the last day, so that the bytes of a
+    # mask are in big-endian order.
+    i_occupancy = len(_COURSE_DTYPES)
+    day_masks = np.array([row[i_occupancy:] for row in rows],
+                         dtype=np.int64) \
+        .reshape(len(rows), len(models.OCCUPANCY_COLUMNS))
+    arrays['occupancy'] = np.ascontiguousarray(
+        (day_masks[:, ::-1] & 0xffffffff).astype('>u4')
+    ).view(np.uint8).reshape(len(rows), _MASK_BYTES)
+
+    CourseClass = models.CourseClass.__table__
+    class_rows = db.session.execute(
+        select([CourseClass.c.course_id,
+                CourseClass.c.day_of_week,
+                CourseClass.c.start_period,
+                CourseClass.c.end_period])
+        .where(CourseClass.c.course_id.in_(q_course_ids))
+        .order_by(CourseClass.c.course_id,
+                  CourseClass.c.day_of_week,
+                  CourseClass.c.start_period)
+    ).fetchall()
+    class_course_ids = np.array([row[0] for row in class_rows],
+                                dtype='<i8')
+    arrays['class_offset'] = np.searchsorted(
+        class_course_ids,
+        np.append(arrays['course_id'], np.iinfo(np.int64).max),
+    ).astype('<i8')
+    for i, (name, dtype) in enumerate(_CLASS_DTYPES, 1):
+        arrays[name] = np.array([row[i] for row in class_rows], dtype=dtype)
+    return arrays
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def export(campus, path, version=None):
+    """Writes the courses and classes of a campus to a file. The file is
+    written to a temporary file first, and renamed.
+
+    :param campus: :class:`dash.catalog.models.Campus` object.
+    :param path: Path of the file.
+    :param version: ID of the catalog version of the data. Defaults to
+                    the latest version.
+    """
+    if version is None:
+        version = models.CatalogVersion.current()
+    arrays = _course_arrays(campus.id)
+    names = sorted(arrays)
+
+    # Offsets depend on the length of the header, which depends on the
+    # offsets, so data offsets are relative to the end of the header and
+    # made absolute on load.
+    header = {'campus_id': campus.id, 'version': version, 'arrays': {}}
+    offset = 0
+    for name in names:
+        array = arrays[name]
+        header['arrays'][name] = {
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+            'offset': offset,
+        }
+        offset = _aligned(offset + array.nbytes)
+    header_bytes = json.dumps(header, sort_keys=True).encode('utf-8')
+    data_start = _aligned(len(MAGIC) + 4 + len(header_bytes))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<I', len(header_bytes)))
+            f.write(header_bytes)
+            for name in names:
+                f.seek(data_start + header['arrays'][name]['offset'])
+                f.write(np.ascontiguousarray(arrays[name]).tobytes())
+            f.truncate(data_start + offset)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def load(path):
+    """Maps a file written by :func:`export`, and returns
+    :class:`CourseArrays` of which the arrays are read-only memory maps
+    of the file.
+
+    :raises ValueError: if the file is not of this format.
+    """
+    with open(path, 'rb') as f:
+        prefix = f.read(len(MAGIC) + 4)
+        if len(prefix) < len(MAGIC) + 4 or not prefix.startswith(MAGIC):
+            raise ValueError('not a columnar catalog file: {0}'.format(path))
+        header_length, = struct.unpack('<I', prefix[len(MAGIC):])
+        header = json.loads(f.read(header_length).decode('utf-8'))
+    data_start = _aligned(len(MAGIC) + 4 + header_length)
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        shape = tuple(spec['shape'])
+        if not all(shape):
+            # Empty files or regions cannot be mapped.
+            arrays[name] = np.zeros(shape, dtype=spec['dtype'])
+            continue
+        arrays[name] = np.memmap(path, dtype=spec['dtype'], mode='r',
+                                 offset=data_start + spec['offset'],
+                                 shape=shape)
+    return CourseArrays(header, arrays)
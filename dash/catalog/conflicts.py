@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Pairwise time conflicts between courses of a campus.
+
+Conflicts are computed in bulk from the occupancy masks of courses with
+NumPy, and kept in memory for each campus until catalog version
+changes. Since many courses share the same weekly schedule, the matrix
+is built over distinct masks only, and each course points to the row of
+its mask.
+"""
+import binascii
+import threading
+
+import numpy as np
+
+from dash.catalog import models, occupancy
+from dash.catalog.caching import catalog_version
+from dash.database import db
+
+
+__all__ = ['ConflictMatrix', 'get_matrix', 'discard']
+
+
+class ConflictMatrix(object):
+    """Conflict matrix over a set of courses.
+
+    :param course_ids: Sequence of IDs of courses.
+    :param masks: Sequence of occupancy masks of the courses, in the same
+                  order as ``course_ids``.
+    """
+
+    def __init__(self, course_ids, masks):
+        n_bytes = occupancy.MASK_BITS // 8
+        packed = np.frombuffer(
+            binascii.unhexlify(''.join(occupancy.to_hex(m) for m in masks)),
+            dtype=np.uint8,
+        ).reshape(len(masks), n_bytes)
+        self._build(course_ids, packed)
+
+    @classmethod
+    def from_packed(cls, course_ids, packed):
+        """Builds a conflict matrix from occupancy masks packed into an
+        array of shape ``(len(course_ids), MASK_BITS // 8)``, of which
+        each row holds the bytes of a mask in big-endian order.
+        """
+        matrix = cls.__new__(cls)
+        matrix._build(course_ids, np.asarray(packed, dtype=np.uint8))
+        return matrix
+
+    def _build(self, course_ids, packed):
+        course_ids = np.asarray(course_ids, dtype=np.int64)
+        order = np.argsort(course_ids)
+        self.course_ids = course_ids[order]
+        packed = packed[order]
+        n = len(self.course_ids)
+        if n:
+            distinct, self._mask_index = np.unique(packed, axis=0,
+                                                   return_inverse=True)
+        else:
+            distinct = packed
+            self._mask_index = np.zeros(0, dtype=np.int64)
+        bits = np.unpackbits(distinct, axis=1).astype(np.float32)
+        #: Conflicts between distinct masks.
+        self._matrix = np.dot(bits, bits.T) > 0
+
+    def __len__(self):
+        return len(self.course_ids)
+
+    def __contains__(self, course_id):
+        return self._position(course_id) is not None
+
+    def _position(self, course_id):
+        i = np.searchsorted(self.course_ids, course_id)
+        if i < len(self.course_ids) and self.course_ids[i] == course_id:
+            return i
+        return None
+
+    def row(self, course_id):
+        """Returns a boolean array which tells whether each course in
+        :attr:`course_ids` conflicts with the given course.
+
+        :raises KeyError: if the course is not in the matrix.
+        """
+        i = self._position(course_id)
+        if i is None:
+            raise KeyError(course_id)
+        return self._matrix[self._mask_index[i]][self._mask_index]
+
+    def conflicts(self, course_id):
+        """Returns the sorted list of IDs of courses which conflict with
+        the given course, except the course itself.
+
+        :raises KeyError: if the course is not in the matrix.
+        """
+        row = self.row(course_id)
+        return [int(c) for c in self.course_ids[row] if c != course_id]
+
+    def conflicts_any(self, course_ids):
+        """Returns the sorted list of IDs of courses which conflict with
+        any of the given courses, except the given courses.
+
+        :raises KeyError: if some course is not in the matrix.
+        """
+        course_ids = set(course_ids)
+        row = np.zeros(len(self.course_ids), dtype=bool)
+        for course_id in course_ids:
+            row |= self.row(course_id)
+        return [int(c) for c in self.course_ids[row]
+                if c not in course_ids]
+
+    @classmethod
+    def from_campus(cls, campus_id):
+        """Builds a conflict matrix over courses of a campus.
+        """
+        Course = models.Course
+        q_assoc = db.session.query(models.DepartmentCourse.course_id) \
+            .join(models.DepartmentCourse.department) \
+            .filter(models.Department.campus_id == campus_id)
+        rows = db.session.query(Course.id,
+                                *[getattr(Course, name)
+                                  for name in models.OCCUPANCY_COLUMNS]) \
+            .filter(Course.id.in_(q_assoc)) \
+            .all()
+        return cls([row[0] for row in rows],
+                   [occupancy.from_day_masks(row[1:]) for row in rows])
+
+
+_matrices = {}
+_lock = threading.Lock()
+
+
+def get_matrix(campus_id):
+    """Returns the conflict matrix over courses of a campus. The matrix
+    is built on first use, and kept in memory until catalog version is
+    changed or :func:`discard` is called for the campus.
+    """
+    version = catalog_version()
+    entry = _matrices.get(campus_id)
+    if entry is None or entry[0] != version:
+        with _lock:
+            entry = _matrices.get(campus_id)
+            if entry is None or entry[0] != version:
+                entry = (version, ConflictMatrix.from_campus(campus_id))
+                _matrices[campus_id] = entry
+    return entry[1]
+
+
+def discard(campus_id=None):
+    """Discards the conflict matrix of a campus kept in memory, if any.
+    If ``campus_id`` is None, all conflict matrices are discarded.
+    """
+    if campus_id is None:
+        _matrices.clear()
+    else:
+        _matrices.pop(campus_id, None)
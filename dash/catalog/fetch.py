@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""Concurrent fetching of pages for scrapers.
+
+Scrapers of course registration systems fetch hundreds of pages, such as
+one listing of courses per department, and spend most of their time
+waiting for responses. :class:`Fetcher` fetches pages with a pool of
+worker threads, so that several requests are in flight at once, while
+keeping scrapers polite and robust:
+
+* Requests to the same host are spaced by at least ``1 / rate``
+  seconds, however many workers there are.
+* Connection errors, timeouts and responses with a status in
+  :data:`RETRY_STATUSES` are retried with exponential backoff. A
+  ``Retry-After`` header in seconds is honored.
+* Each worker keeps a :class:`requests.Session`, so connections to a
+  host are reused.
+* With a ``cache`` directory, responses with an ``ETag`` or
+  ``Last-Modified`` header are stored on disk, and requests for them are
+  made conditional afterwards. Most pages do not change between nightly
+  runs, so they are answered with ``304 Not Modified`` and replayed from
+  :class:`ResponseCache` instead of being downloaded again. Replayed
+  responses have ``from_cache`` set to True.
+
+Results are parsed in the workers and yielded in the order of requests,
+so they can be held by :class:`dash.catalog.scraper.Catalog` directly::
+
+    def parse_courses(response):
+        ...  # Returns Course objects in the page.
+
+    with Fetcher(workers=8, rate=4, cache='/var/cache/dash') as fetcher:
+        with update_catalog(campus) as catalog:
+            for courses in fetcher.imap(parse_courses, urls):
+                catalog.hold_courses(courses)
+
+This requires packages in ``requirements/scraper.txt``.
+"""
+import errno
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import requests
+from six import string_types, text_type
+from six.moves import cPickle as pickle
+from six.moves.urllib.parse import urlsplit
+
+
+__all__ = ['Fetcher', 'ResponseCache', 'RETRY_STATUSES']
+
+#: Statuses of responses which are retried.
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+class RateLimiter(object):
+    """Spaces calls of :meth:`wait` for the same key by at least
+    ``interval`` seconds. This is thread-safe.
+    """
+
+    def __init__(self, interval, clock=time.time, sleep=time.sleep):
+        self.interval = interval
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._next = {}
+
+    def wait(self, key):
+        """Blocks until a call for ``key`` is allowed."""
+        with self._lock:
+            now = self._clock()
+            at = max(now, self._next.get(key, now))
+            self._next[key] = at + self.interval
+        if at > now:
+            self._sleep(at - now)
+
+
+class ResponseCache(object):
+    """Stores responses in files in a directory, keyed by request. This is
+    thread-safe, and may be shared by processes.
+
+    :param directory: Path of the directory, which is created if missing.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    @staticmethod
+    def key(method, url, params=None, data=None, json=None):
+        """Returns the key of a request, which is a digest of its method,
+        URL and body.
+        """
+        request = requests.Request(method.upper(), url, params=params,
+                                   data=data, json=json).prepare()
+        body = request.body or b''
+        if isinstance(body, text_type):
+            body = body.encode('utf-8')
+        digest = hashlib.sha1()
+        digest.update(u'{0} {1}\n'.format(request.method, request.url)
+                      .encode('utf-8'))
+        digest.update(body)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Returns the stored response, or None if there is none or it
+        cannot be read.
+        """
+        try:
+            with open(self._path(key), 'rb') as f:
+                return pickle.load(f)
+        except Exception:
+            # A missing file, or one broken by a crash, is a miss.
+            return None
+
+    def set(self, key, response):
+        """Stores a response. The file is replaced atomically, so readers
+        never see a partial response.
+        """
+        fd, path = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(response, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(path, self._path(key))
+        except Exception:
+            os.remove(path)
+            raise
+
+    def clear(self):
+        """Removes all stored responses."""
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+
+
+def _validators(response):
+    """Returns headers of a conditional request for a stored response."""
+    headers = {}
+    if 'ETag' in response.headers:
+        headers['If-None-Match'] = response.headers['ETag']
+    if 'Last-Modified' in response.headers:
+        headers['If-Modified-Since'] = response.headers['Last-Modified']
+    return headers
+
+
+class Fetcher(object):
+    """Fetches pages with a pool of worker threads.
+
+    :param workers: Number of worker threads.
+    :param rate: Maximum number of requests per second to a host, or None
+                 for no limit.
+    :param retries: Number of times a failed request is retried.
+    :param backoff: Seconds to wait before the first retry. The wait is
+                    doubled for each retry.
+    :param timeout: Timeout of a request in seconds.
+    :param headers: Dict of headers sent with every request.
+    :param cache: Path of a directory, or a :class:`ResponseCache` in
+                  which responses are stored, or None for no cache.
+    """
+
+    #: Maximum seconds to wait for a ``Retry-After`` header.
+    max_retry_after = 60
+
+    def __init__(self, workers=8, rate=None, retries=3, backoff=0.5,
+                 timeout=30, headers=None, cache=None):
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.headers = headers or {}
+        if isinstance(cache, string_types):
+            cache = ResponseCache(cache)
+        self.cache = cache
+        self._limiter = RateLimiter(1.0 / rate) if rate else None
+        self._local = threading.local()
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Stops the workers, and closes their connections."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        with self._sessions_lock:
+            for session in self._sessions:
+                session.close()
+            del self._sessions[:]
+
+    @property
+    def session(self):
+        """:class:`requests.Session` of the current thread."""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            self._local.session = session
+            with self._sessions_lock:
+                self._sessions.append(session)
+        return session
+
+    def _retry_after(self, response, attempt):
+        delay = self.backoff * (2 ** attempt)
+        if response is not None:
+            try:
+                delay = max(delay, min(
+                    float(response.headers.get('Retry-After', '')),
+                    self.max_retry_after))
+            except ValueError:
+                pass
+        return delay
+
+    def fetch(self, url, method='GET', **kwargs):
+        """Sends a request in the current thread, and returns the
+        response. Failed requests are retried. If a response to the same
+        request is in the cache, the request is made conditional, and the
+        stored response is returned if the page is not modified.
+
+        :param url: URL of the request.
+        :param method: Method of the request.
+        :param kwargs: Other arguments of :meth:`requests.Session.request`.
+        :raises requests.RequestException: if the request still fails
+                                           after retries, or the response
+                                           has an error status.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        key = cached = None
+        if self.cache is not None:
+            key = self.cache.key(method, url, params=kwargs.get('params'),
+                                 data=kwargs.get('data'),
+                                 json=kwargs.get('json'))
+            cached = self.cache.get(key)
+        if cached is not None:
+            headers = _validators(cached)
+            headers.update(kwargs.get('headers') or {})
+            kwargs['headers'] = headers
+        response = self._send(method, url, **kwargs)
+        if cached is not None and response.status_code == 304:
+            cached.from_cache = True
+            return cached
+        response.from_cache = False
+        if key is not None and response.status_code == 200 and \
+                _validators(response):
+            self.cache.set(key, response)
+        return response
+
+    def _send(self, method, url, **kwargs):
+        host = urlsplit(url).netloc
+        attempt = 0
+        while True:
+            if self._limiter is not None:
+                self._limiter.wait(host)
+            response = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or \
+                        attempt >= self.retries:
+                    response.raise_for_status()
+                    return response
+            time.sleep(self._retry_after(response, attempt))
+            attempt += 1
+
+    def _fetch_and_parse(self, args):
+        parse, item = args
+        if isinstance(item, string_types):
+            response = self.fetch(item)
+        else:
+            response = self.fetch(**item)
+        return parse(response)
+
+    def imap(self, parse, items):
+        """Fetches pages in the workers, and yields the results of
+        ``parse`` on the responses in the order of ``items``.
+
+        :param parse: Function which takes a :class:`requests.Response`.
+                      It is called in the workers.
+        :param items: Iterable of URLs, or of dicts of arguments of
+                      :meth:`fetch`.
+        :raises requests.RequestException: if a request fails. Results of
+                                           earlier requests have been
+                                           yielded.
+        """
+        if self._pool is None:
+            self._pool = ThreadPool(self.workers)
+        return self._pool.imap(self._fetch_and_parse,
+                               ((parse, item) for item in items))
+
+    def map(self, parse, items):
+        """Same as :meth:`imap`, but returns a list."""
+        return list(self.imap(parse, items))
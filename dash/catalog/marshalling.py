@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""Precompiled serializers for Flask-RESTful field specs.
+
+:func:`flask_restful.marshal` walks a dict of fields for each object it
+marshals: it instantiates field classes, splits attribute names on dots,
+looks for keys before attributes and dispatches on field types, all over
+again for every item of every page. :func:`compile_fields` does that walk
+once, and returns a function which produces the same output as
+``marshal`` with a plain attribute lookup and formatting call per field.
+
+Compiled serializers expect objects which expose fields as attributes,
+such as model instances. Field types which are not known here are still
+supported, by delegating to their ``output`` method.
+
+:func:`select_fields` narrows a dict of fields to the ones selected by a
+client, so that a serializer can be compiled for the selection.
+"""
+from collections import OrderedDict
+
+from flask.ext.restful import fields
+from six import get_unbound_function, iteritems, text_type
+
+
+__all__ = ['compile_fields', 'select_fields']
+
+
+def _make(field):
+    if isinstance(field, type):
+        return field()
+    return field
+
+
+def _compile_getter(key, attribute):
+    if attribute is None:
+        attribute = key
+    if callable(attribute):
+        return attribute
+    names = attribute.split('.')
+    if len(names) == 1:
+        name = names[0]
+        return lambda obj: getattr(obj, name, None)
+
+    def get_dotted(obj):
+        for name in names:
+            obj = getattr(obj, name, None)
+        return obj
+    return get_dotted
+
+
+def _compile_format(field):
+    field_type = type(field)
+    if field_type is fields.Raw:
+        return None
+    if field_type is fields.String:
+        return text_type
+    if field_type is fields.Integer:
+        return int
+    if field_type is fields.Float:
+        return float
+    if field_type is fields.DateTime and field.dt_format == 'iso8601':
+        return lambda value: value.isoformat()
+    return field.format
+
+
+def _compile_nested(field, get):
+    serialize = compile_fields(field.nested)
+    allow_null = field.allow_null
+    default = field.default
+
+    def output(obj):
+        value = get(obj)
+        if value is None:
+            if allow_null:
+                return None
+            elif default is not None:
+                return default
+        return serialize(value)
+    return output
+
+
+def _compile_list(key, field, get):
+    container = field.container
+    if type(container) is not fields.Nested or \
+            container.attribute is not None:
+        return lambda obj: field.output(key, obj)
+    output_item = _compile_nested(container, lambda value: value)
+    default = field.default
+
+    def output(obj):
+        value = get(obj)
+        if value is None:
+            return default
+        if isinstance(value, (dict, text_type, bytes)) or \
+                not hasattr(value, '__iter__'):
+            return field.output(key, obj)
+        return [output_item(v) for v in value]
+    return output
+
+
+def _compile_field(key, field):
+    if isinstance(field, dict):
+        return compile_fields(field)
+
+    field = _make(field)
+    field_type = type(field)
+    if field_type is fields.Nested:
+        return _compile_nested(field, _compile_getter(key, field.attribute))
+    if field_type is fields.List:
+        return _compile_list(key, field,
+                             _compile_getter(key, field.attribute))
+    if get_unbound_function(field_type.output) is not \
+            get_unbound_function(fields.Raw.output):
+        return lambda obj: field.output(key, obj)
+
+    get = _compile_getter(key, field.attribute)
+    format_value = _compile_format(field)
+    default = field.default
+    if format_value is None:
+        def output(obj):
+            value = get(obj)
+            return default if value is None else value
+    else:
+        def output(obj):
+            value = get(obj)
+            return default if value is None else format_value(value)
+    return output
+
+
+def compile_fields(spec):
+    """Compiles a dict of fields into a serializer function, which takes
+    an object, or a list or tuple of objects, and returns the same as
+    :func:`flask_restful.marshal` with the fields.
+
+    :param spec: Dict of fields, as passed to :func:`flask_restful.marshal`.
+    """
+    outputs = [(key, _compile_field(key, field))
+               for key, field in spec.items()]
+
+    def serialize(obj):
+        if isinstance(obj, (list, tuple)):
+            return [serialize(o) for o in obj]
+        return OrderedDict([(key, output(obj)) for key, output in outputs])
+    return serialize
+
+
+def _nested_spec(field):
+    """Returns the dict of fields nested in a field, or None."""
+    field = _make(field)
+    if isinstance(field, dict):
+        return field
+    if type(field) is fields.List:
+        field = field.container
+    if type(field) is fields.Nested:
+        return field.nested
+    return None
+
+
+def _replace_nested(field, spec):
+    """Returns a copy of a field of nested fields with other fields."""
+    field = _make(field)
+    if isinstance(field, dict):
+        return spec
+    if type(field) is fields.List:
+        container = _replace_nested(field.container, spec)
+        return fields.List(container, attribute=field.attribute,
+                           default=field.default)
+    return fields.Nested(spec, allow_null=field.allow_null,
+                         attribute=field.attribute, default=field.default)
+
+
+def _select(spec, paths):
+    tree = OrderedDict()
+    for path in paths:
+        key, _, rest = path.partition('.')
+        if key not in spec:
+            raise ValueError('no such field: {0}'.format(path))
+        if not rest:
+            tree[key] = None
+        elif tree.get(key, ()) is not None:
+            tree.setdefault(key, []).append(rest)
+    selected = OrderedDict()
+    for key, rest in iteritems(tree):
+        field = spec[key]
+        if rest is not None:
+            nested = _nested_spec(field)
+            if nested is None:
+                raise ValueError('no nested fields in {0}'.format(key))
+            field = _replace_nested(field, _select(nested, rest))
+        selected[key] = field
+    return selected
+
+
+def select_fields(spec, paths=None, expand=None, relationships=()):
+    """Returns a dict of the fields of ``spec`` selected by a client.
+
+    Fields of related entities, of which the keys are in
+    ``relationships``, are left out unless they are asked for. Without
+    ``paths`` and ``expand``, every field is selected.
+
+    :param spec: Dict of fields.
+    :param paths: Keys of fields, or None for every field which is not of
+                  related entities. Nested fields are selected with dotted
+                  keys, e.g. ``subject.name``.
+    :param expand: Keys of fields of related entities which are selected
+                   as a whole, or None for every one of them if ``paths``
+                   is None, and for none of them otherwise.
+    :param relationships: Keys of fields of related entities.
+    :raises ValueError: if a key is unknown, or not in ``relationships``
+                        for ``expand``.
+    """
+    if paths is None and expand is None:
+        return spec
+    if paths is None:
+        paths = [key for key in spec if key not in relationships]
+    for key in expand or ():
+        if key not in relationships:
+            raise ValueError('no such relationship: {0}'.format(key))
+    selected = _select(spec, list(paths) + list(expand or ()))
+    # Keys are in the same order as in the output of ``spec``.
+    return OrderedDict((key, selected[key]) for key in spec
+                       if key in selected)
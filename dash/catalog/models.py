@@ -2,6 +2,13 @@
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.ext.hybrid import hybrid_property
 import sqlalchemy.event
+from dash.catalog.occupancy import (
+    DAYS_PER_WEEK,
+    EMPTY,
+    classes_mask,
+    day_masks,
+    from_day_masks,
+)
 from dash.database import (
     Column,
     db,
@@ -48,6 +55,52 @@ class Campus(CatalogEntity):
         return u'<Campus({name})>'.format(name=self.name)
 
 
+class CatalogVersion(SurrogatePK, Model, CreatedAtMixin):
+
+    """A version of catalog. A new version is created whenever catalog
+    of a campus is updated, so data derived from catalog can be keyed on
+    the ID of the latest version.
+
+    The version is added in the transaction of the sync, and committed
+    with the catalog, so a version exists only if its catalog does.
+    """
+
+    __tablename__ = 'catalog_versions'
+    campus_id = ReferenceCol('campuses')
+    campus = relationship('Campus')
+
+    @classmethod
+    def current(cls):
+        """Returns the ID of the latest version, or 0 if catalog has never
+        been updated.
+        """
+        return db.session.query(db.func.max(cls.id)).scalar() or 0
+
+    def __repr__(self):
+        return '<CatalogVersion({id})>'.format(id=self.id)
+
+
+class CatalogChange(SurrogatePK, Model):
+
+    """A change of an entity in a catalog version. Changes are recorded by
+    :func:`dash.catalog.scraper.update_catalog`, and kept for a limited
+    time. See :mod:`dash.catalog.changes`.
+    """
+
+    __tablename__ = 'catalog_changes'
+    version_id = ReferenceCol('catalog_versions', index=True)
+    #: Name of the table of the entity, such as ``courses``.
+    entity = Column(db.String(40), nullable=False)
+    entity_id = Column(db.Integer, nullable=False)
+    #: One of ``created``, ``updated`` and ``deleted``.
+    operation = Column(db.String(10), nullable=False)
+
+    def __repr__(self):
+        return '<CatalogChange({version_id}, {entity}, {entity_id})>' \
+            .format(version_id=self.version_id, entity=self.entity,
+                    entity_id=self.entity_id)
+
+
 class DepartmentCourse(db.Model):
     """Association object class between Department and Course object.
     """
@@ -106,6 +159,12 @@ class Subject(CatalogEntity):
         return u'<Subject({name})>'.format(name=self.name)
 
 
+#: Names of the columns of courses which hold occupancy masks of days,
+#: from the first day of a week.
+OCCUPANCY_COLUMNS = tuple('occupancy_{0}'.format(day)
+                          for day in range(DAYS_PER_WEEK))
+
+
 class Course(CatalogEntity):
     __tablename__ = 'courses'
     __table_args__ = (
@@ -133,8 +192,36 @@ class Course(CatalogEntity):
                                     lazy='joined',
                                     )
     target_grade = Column(db.Integer, nullable=True)
+    #: Campus of which catalog a course was synced with, by which courses
+    #: without departments are told apart from those of other campuses.
+    #: Null for courses stored before campuses were recorded.
+    campus_id = ReferenceCol('campuses', nullable=True, index=True)
     #: True if a course might be said to be major.
     major = Column(db.Boolean, nullable=False)
+    #: Occupancy masks of the classes of a course on each day of a week,
+    #: which make up :attr:`occupancy`. See :mod:`dash.catalog.occupancy`.
+    occupancy_0 = Column(db.Integer, nullable=False, default=EMPTY)
+    occupancy_1 = Column(db.Integer, nullable=False, default=EMPTY)
+    occupancy_2 = Column(db.Integer, nullable=False, default=EMPTY)
+    occupancy_3 = Column(db.Integer, nullable=False, default=EMPTY)
+    occupancy_4 = Column(db.Integer, nullable=False, default=EMPTY)
+    occupancy_5 = Column(db.Integer, nullable=False, default=EMPTY)
+    occupancy_6 = Column(db.Integer, nullable=False, default=EMPTY)
+
+    @property
+    def occupancy(self):
+        """Weekly occupancy mask of the classes of a course, or None if
+        it is not set yet.
+        """
+        masks = [getattr(self, name) for name in OCCUPANCY_COLUMNS]
+        if any(m is None for m in masks):
+            return None
+        return from_day_masks(masks)
+
+    @occupancy.setter
+    def occupancy(self, mask):
+        for name, day_mask in zip(OCCUPANCY_COLUMNS, day_masks(mask)):
+            setattr(self, name, day_mask)
 
     @hybrid_property
     def name(self):
@@ -163,6 +250,12 @@ class Course(CatalogEntity):
     def general(self):
         return self.gen_edu_category_id.isnot(None)
 
+    def update_occupancy(self):
+        """Updates :attr:`occupancy` with the classes of a course. This
+        should be called whenever the classes are changed.
+        """
+        self.occupancy = classes_mask(self.classes)
+
     def __repr__(self):
         return '<Course({code})>'.format(code=self.code)
 
@@ -172,7 +265,17 @@ class Course(CatalogEntity):
 def check_course(mapper, connection, course):
     """Checks the constraint about course type.
     """
-    assert course.major is True or course.gen_edu_category_id is not None, \
+    check_course_type(course.major, course.gen_edu_category_id)
+
+
+def check_course_type(major, gen_edu_category_id):
+    """Checks the constraint about course type on column values. This is
+    for writes which bypass the ORM.
+
+    :param gen_edu_category_id: ID of the general education category, or
+                                its code in staging tables, or None.
+    """
+    assert major is True or gen_edu_category_id is not None, \
         ('a course should be major or associated with a general '
          'education category')
 
@@ -196,7 +299,6 @@ class CourseClass(SurrogatePK, Model, CreatedAtMixin):
         backref=db.backref(
             'classes',
             order_by='CourseClass.day_of_week, CourseClass.start_period',
-            lazy='joined',
         ),
         )
 
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Weekly occupancy bitmasks of courses.
+
+A week is split into :data:`DAYS_PER_WEEK` days, and each day is split
+into :data:`PERIODS_PER_DAY` periods. The slot at period ``p`` of day
+``d`` is mapped to bit ``d * PERIODS_PER_DAY + p`` of an integer. The
+occupancy of a set of classes is then the bitwise OR of the masks of
+the classes, and two sets of classes conflict with each other if and
+only if the bitwise AND of their masks is nonzero.
+
+Databases have no integers of :data:`MASK_BITS` bits, so a mask is stored
+as the masks of its days, in one 32-bit integer column for each day.
+Bit ``p`` of the mask of a day is the slot at period ``p``, and masks of
+days are signed, so bit 31 is the sign bit. Conflicts can then be tested
+in SQL with ``&`` on each column. See :func:`day_masks`.
+"""
+from functools import reduce
+import operator
+import string
+
+
+__all__ = [
+    'DAYS_PER_WEEK',
+    'PERIODS_PER_DAY',
+    'MASK_BITS',
+    'EMPTY',
+    'FULL',
+    'HEX_DIGITS',
+    'slot_mask',
+    'class_mask',
+    'classes_mask',
+    'to_hex',
+    'from_hex',
+    'day_masks',
+    'from_day_masks',
+]
+
+#: Number of days in a week.
+DAYS_PER_WEEK = 7
+#: Number of periods reserved for a day.
+PERIODS_PER_DAY = 32
+#: Number of bits in a weekly occupancy mask.
+MASK_BITS = DAYS_PER_WEEK * PERIODS_PER_DAY
+#: Occupancy mask of no classes.
+EMPTY = 0
+#: Occupancy mask of all slots in a week.
+FULL = (1 << MASK_BITS) - 1
+#: Number of hexadecimal digits in the text form of an occupancy mask.
+HEX_DIGITS = MASK_BITS // 4
+
+_DAY_FULL = (1 << PERIODS_PER_DAY) - 1
+_DAY_SIGN = 1 << (PERIODS_PER_DAY - 1)
+
+
+def slot_mask(day_of_week, start_period, end_period):
+    """Returns the occupancy mask of periods from ``start_period`` to
+    ``end_period`` (both inclusive) on ``day_of_week``.
+
+    :param day_of_week: Day of week, starting from 0.
+    :param start_period: First period of the slot.
+    :param end_period: Last period of the slot.
+    """
+    if not 0 <= day_of_week < DAYS_PER_WEEK:
+        raise ValueError('day_of_week should be in [0, {0})'
+                         .format(DAYS_PER_WEEK))
+    if not 0 <= start_period <= end_period < PERIODS_PER_DAY:
+        raise ValueError('periods should satisfy 0 <= start_period <= '
+                         'end_period < {0}'.format(PERIODS_PER_DAY))
+    width = end_period - start_period + 1
+    offset = day_of_week * PERIODS_PER_DAY + start_period
+    return ((1 << width) - 1) << offset
+
+
+def class_mask(course_class):
+    """Returns the occupancy mask of a
+    :class:`dash.catalog.models.CourseClass` object, or of any object with
+    ``day_of_week``, ``start_period`` and ``end_period`` attributes.
+    """
+    return slot_mask(course_class.day_of_week,
+                     course_class.start_period,
+                     course_class.end_period)
+
+
+def classes_mask(classes):
+    """Returns the occupancy mask of an iterable of course classes.
+    """
+    return reduce(operator.or_, (class_mask(c) for c in classes), EMPTY)
+
+
+def to_hex(mask):
+    """Returns the fixed-width text form of an occupancy mask, which is
+    :data:`HEX_DIGITS` lowercase hexadecimal digits.
+    """
+    if not EMPTY <= mask <= FULL:
+        raise ValueError('mask should fit in {0} bits'.format(MASK_BITS))
+    return '{0:0{1}x}'.format(mask, HEX_DIGITS)
+
+
+def from_hex(text):
+    """Parses the text form of an occupancy mask. Leading zeros may be
+    omitted.
+
+    :raises ValueError: if ``text`` is not a hexadecimal number which
+                        fits in :data:`MASK_BITS` bits.
+    """
+    if not 0 < len(text) <= HEX_DIGITS or \
+            any(c not in string.hexdigits for c in text):
+        raise ValueError('mask should have 1 to {0} hexadecimal digits'
+                         .format(HEX_DIGITS))
+    return int(text, 16)
+
+
+def day_masks(mask):
+    """Returns a list of the masks of days of an occupancy mask, as
+    signed 32-bit integers, from the first day of a week.
+    """
+    masks = []
+    for day in range(DAYS_PER_WEEK):
+        day_mask = (mask >> (day * PERIODS_PER_DAY)) & _DAY_FULL
+        if day_mask & _DAY_SIGN:
+            day_mask -= 1 << PERIODS_PER_DAY
+        masks.append(int(day_mask))
+    return masks
+
+
+def from_day_masks(masks):
+    """Returns the occupancy mask of which :func:`day_masks` returns
+    ``masks``.
+    """
+    mask = EMPTY
+    for day, day_mask in enumerate(masks):
+        mask |= (day_mask & _DAY_FULL) << (day * PERIODS_PER_DAY)
+    return mask
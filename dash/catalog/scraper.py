@@ -2,6 +2,18 @@
 from contextlib import contextmanager
 import collections
 
+from flask import current_app
+
+from dash.catalog import (
+    caching,
+    changes,
+    conflicts,
+    search,
+    snapshot,
+    staging,
+    sync,
+)
+from dash.catalog.models import CatalogVersion
 from dash.extensions import db
 
 
@@ -53,6 +65,13 @@ def update_catalog(campus):
     2. For each entity in A, check if the entity with same code exists
     in database. If exists, update it. If not, create it.
 
+    See :mod:`dash.catalog.sync` for how this is done in bulk, and
+    :mod:`dash.catalog.staging` for how this is done within the database
+    for large campuses. Numbers of rows written are set to ``stats`` of
+    the returned object on exit. A new catalog version is created only if
+    some row is written, and IDs of entities changed in the version are
+    recorded. See :mod:`dash.catalog.changes`.
+
     Syncing relationships is similar to syncing entities. Relationships
     are usually derived from filtering results of data source. For
     example, the relationships between department entities and course
@@ -61,18 +80,52 @@ def update_catalog(campus):
     Science' is selected for filtering, courses in the search result
     should be associated with the department.
 
+    When catalogs are synced through staging tables, the returned object
+    is a :py:class:`dash.catalog.staging.StagingCatalog`, which loads held
+    entities into the database in batches instead of keeping them. Then
+    entities may be held from generators without holding the whole
+    catalog in memory.
+
     :param campus: Campus of which catalog will be updated.
     :type campus: :py:class:`dash.catalog.models.Campus`
     """
-    catalog = Catalog()
+    # Looked up before the sync transaction, since the sqlite3 module of
+    # Python 2 commits the transaction in progress before the lookup.
+    search.has_fts()
+    if staging.enabled():
+        catalog = staging.StagingCatalog()
+        sync_catalog = staging.sync_catalog
+    else:
+        catalog = Catalog()
+        sync_catalog = sync.sync_catalog
     yield catalog
-    for d in catalog.departments:
-        d.campus = campus
-    db.session.add_all(catalog.departments)
-    db.session.add_all(catalog.subjects)
-    db.session.add_all(catalog.gen_edu_categories)
-    db.session.add_all(catalog.courses)
-    db.session.commit()
+    catalog.changes = changes.Changes()
+    catalog.stats = sync_catalog(campus, catalog, changes=catalog.changes)
+    if not sync.changed(catalog.stats):
+        db.session.commit()
+        return
+    search.reindex(changes=catalog.changes)
+    version = CatalogVersion(campus=campus)
+    db.session.add(version)
+    db.session.flush()
+    changes.record(version, catalog.changes)
+    changes.prune()
+    snapshot_path = snapshot.prepare(campus, version.id)
+    try:
+        db.session.commit()
+    except Exception:
+        snapshot.discard(snapshot_path)
+        raise
+    try:
+        snapshot.publish(campus, version.id, snapshot_path)
+    except Exception:
+        # The version is committed anyway, and its snapshot is written
+        # again with the next version.
+        current_app.logger.exception(
+            'Failed to publish snapshot of campus {0}'.format(campus.code))
+        snapshot.discard(snapshot_path)
+    caching.publish_catalog_version(version.id)
+    conflicts.discard(campus.id)
 
 
 class Catalog(object):
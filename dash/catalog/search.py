@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Keyword search over courses.
+
+Course search matches each word of a keyword as a substring of a field,
+case-insensitively. The way this is served depends on the database:
+
+* On PostgreSQL, ``ILIKE '%word%'`` criteria are served by trigram GIN
+  indexes from the ``pg_trgm`` extension.
+* On SQLite, words are matched against ``course_search``, an FTS5 table
+  with the trigram tokenizer which shadows searchable fields of courses.
+  This table is not updated by triggers, so :func:`reindex` should be
+  called whenever courses or subjects are written. A sync reindexes only
+  the courses it changed.
+
+Words shorter than three characters cannot be served by trigrams, and
+fall back to ``LIKE`` criteria.
+"""
+import sqlite3
+import weakref
+
+import sqlalchemy.event
+from sqlalchemy import DDL
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql import column, select, table
+
+from dash.catalog import models
+from dash.catalog.changes import OPERATIONS
+from dash.catalog.sync import CHUNK_SIZE
+from dash.database import db
+
+
+__all__ = ['like_filter_criterion', 'keyword_filter_criterion', 'reindex']
+
+#: Searchable fields of courses.
+FIELDS = {
+    'name': models.Course.name,
+    'subject_code': models.Course.subject_code,
+    'instructor': models.Course.instructor,
+}
+
+#: Minimum length of words which can be served by trigram indexes.
+MIN_TRIGRAM_WORD_LENGTH = 3
+
+course_search = table('course_search',
+                      column('rowid'),
+                      column('course_search'),
+                      *[column(field) for field in FIELDS])
+
+_create_course_search = DDL(
+    "CREATE VIRTUAL TABLE IF NOT EXISTS course_search "
+    "USING fts5(name, subject_code, instructor, tokenize='trigram')")
+_drop_course_search = DDL("DROP TABLE IF EXISTS course_search")
+
+_create_trigram_indexes = [
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"),
+    DDL("CREATE INDEX ix_subjects_name_trgm ON subjects "
+        "USING gin (name gin_trgm_ops)"),
+    DDL("CREATE INDEX ix_subjects_code_trgm ON subjects "
+        "USING gin (code gin_trgm_ops)"),
+    DDL("CREATE INDEX ix_courses_instructor_trgm ON courses "
+        "USING gin (instructor gin_trgm_ops)"),
+]
+
+#: Engines which have been checked for ``course_search``.
+_fts_engines = weakref.WeakKeyDictionary()
+
+
+def _fts_supported():
+    # The trigram tokenizer is available since SQLite 3.34.0.
+    return sqlite3.sqlite_version_info >= (3, 34, 0)
+
+
+@sqlalchemy.event.listens_for(models.Course.__table__, 'after_create')
+def _create_indexes(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        if _fts_supported():
+            try:
+                connection.execute(_create_course_search)
+            except OperationalError:
+                # FTS5 is not compiled in.
+                pass
+    elif connection.dialect.name == 'postgresql':
+        for ddl in _create_trigram_indexes:
+            connection.execute(ddl)
+    _fts_engines.pop(connection.engine, None)
+
+
+@sqlalchemy.event.listens_for(models.Course.__table__, 'after_drop')
+def _drop_indexes(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(_drop_course_search)
+    _fts_engines.pop(connection.engine, None)
+
+
+def has_fts(bind=None):
+    """Returns True if ``course_search`` exists in the database.
+
+    :param bind: Engine, or a connection which is used to look up the
+                 table. A connection in a transaction must be given on
+                 SQLite, since another connection may wait for its lock.
+    """
+    bind = bind or db.engine
+    engine = bind.engine
+    if engine.dialect.name != 'sqlite':
+        return False
+    exists = _fts_engines.get(engine)
+    if exists is None:
+        exists = bind.run_callable(engine.dialect.has_table, 'course_search')
+        _fts_engines[engine] = exists
+    return exists
+
+
+def like_filter_criterion(column, keyword, case_sensitive=False):
+    criterion_func = column.ilike if not case_sensitive else column.like
+
+    for word in keyword.split():
+        yield criterion_func("%{}%".format(word))
+
+
+def keyword_filter_criterion(field, keyword):
+    """Yields criteria which hold for courses of which the field contains
+    every word of the keyword, case-insensitively.
+
+    :param field: Name of a field in :data:`FIELDS`.
+    :param keyword: Words separated by whitespace.
+    """
+    col = FIELDS[field]
+    words = keyword.split()
+    if not has_fts():
+        for criterion in like_filter_criterion(col, keyword):
+            yield criterion
+        return
+
+    long_words = [w for w in words if len(w) >= MIN_TRIGRAM_WORD_LENGTH]
+    short_words = [w for w in words if len(w) < MIN_TRIGRAM_WORD_LENGTH]
+    if long_words:
+        expr = u' AND '.join(u'{0}:"{1}"'.format(field,
+                                                 w.replace(u'"', u'""'))
+                             for w in long_words)
+        q_fts = select([course_search.c.rowid]) \
+            .where(course_search.c.course_search.match(expr))
+        yield models.Course.id.in_(q_fts)
+    for criterion in like_filter_criterion(col, u' '.join(short_words)):
+        yield criterion
+
+
+def reindex(session=None, changes=None):
+    """Rebuilds ``course_search`` from courses and subjects, if the table
+    exists. This does not commit.
+
+    :param changes: :class:`dash.catalog.changes.Changes` object of a
+                    sync. If given, only rows of courses written by the
+                    sync, and of courses of subjects it updated, are
+                    rebuilt, instead of rows of every campus.
+    """
+    session = session or db.session
+    if not has_fts(session.connection()):
+        return
+    Course = models.Course
+    Subject = models.Subject
+    q_courses = select([Course.id, Subject.name, Subject.code,
+                        Course.instructor]) \
+        .select_from(Course.__table__.join(Subject.__table__))
+    insert = course_search.insert()
+    columns = ['rowid', 'name', 'subject_code', 'instructor']
+    if changes is None:
+        session.execute(course_search.delete())
+        session.execute(insert.from_select(columns, q_courses))
+        return
+
+    course_ids = set()
+    for operation in OPERATIONS:
+        course_ids.update(changes.ids('courses', operation))
+    subject_ids = changes.ids('subjects', 'updated')
+    for i in range(0, len(subject_ids), CHUNK_SIZE):
+        course_ids.update(id for id, in session.execute(
+            select([Course.id])
+            .where(Course.subject_id.in_(subject_ids[i:i + CHUNK_SIZE]))))
+    course_ids = sorted(course_ids)
+    for i in range(0, len(course_ids), CHUNK_SIZE):
+        chunk = course_ids[i:i + CHUNK_SIZE]
+        session.execute(course_search.delete()
+                        .where(course_search.c.rowid.in_(chunk)))
+        session.execute(insert.from_select(
+            columns, q_courses.where(Course.id.in_(chunk))))
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""Snapshots of the whole catalog of campuses.
+
+Clients which need the whole catalog of a campus, such as the timetable
+UI, would otherwise page through courses with hundreds of requests. A
+snapshot holds the campus with its departments, subjects, general
+education categories and courses in one gzipped JSON document, which is
+written by :func:`dash.catalog.scraper.update_catalog` for each catalog
+version of the campus, and served as a static file.
+
+Snapshots are written to ``CATALOG_SNAPSHOT_DIR``, as
+``campus-<campus id>.<version id>.json.gz``. Only the latest snapshot of
+each campus is kept. Since a snapshot never changes once written, it is
+served from its versioned URL with long-lived cache headers.
+
+The snapshot of a new version is written to a temporary file before the
+version is committed, and renamed once it is, so that a failure to write
+it rolls the version back instead of failing after the commit.
+"""
+import glob
+import gzip
+import json
+import os
+import re
+import tempfile
+
+from flask import abort, current_app, request, send_file
+from flask.ext.restful import Resource, fields
+
+from dash.catalog import models
+from dash.catalog.api import (
+    CourseMixin,
+    course_fields,
+    department_fields,
+    entity_fields,
+    extend,
+    gen_edu_category_fields,
+    subject_fields,
+)
+from dash.catalog.marshalling import compile_fields
+from dash.database import db
+from dash.extensions import api
+
+
+__all__ = ['build', 'prepare', 'publish', 'discard', 'write',
+           'latest_version', 'path']
+
+#: Seconds for which clients may cache a versioned snapshot.
+MAX_AGE = 365 * 24 * 60 * 60
+
+_FILENAME_RE = re.compile(r'^campus-(\d+)\.(\d+)\.json\.gz$')
+
+snapshot_campus_fields = extend(entity_fields, {
+    'name': fields.String,
+})
+
+#: Fields of courses in snapshots. Related entities are listed once in
+#: the snapshot, and referred to by their IDs.
+snapshot_course_fields = extend(
+    dict((k, v) for k, v in course_fields.items()
+         if k not in ('subject', 'gen_edu_category', 'category',
+                      'departments')),
+    {
+        'department_ids': fields.List(
+            fields.Integer,
+            attribute=lambda c: sorted(d.id for d in c.departments)),
+    },
+)
+
+_serialize_campus = compile_fields(snapshot_campus_fields)
+_serialize_department = compile_fields(department_fields)
+_serialize_subject = compile_fields(subject_fields)
+_serialize_gen_edu_category = compile_fields(gen_edu_category_fields)
+_serialize_course = compile_fields(snapshot_course_fields)
+
+
+def build(campus, version):
+    """Returns the snapshot document of a campus.
+
+    :param campus: :class:`dash.catalog.models.Campus` object.
+    :param version: ID of the catalog version of the snapshot.
+    """
+    Course = models.Course
+    q_courses = CourseMixin.filter_related(db.session.query(Course),
+                                           None, campus.id)
+    courses = q_courses \
+        .options(db.subqueryload(Course.classes)) \
+        .options(db.subqueryload(Course.department_courses)
+                   .joinedload(models.DepartmentCourse.department)) \
+        .order_by(Course.id) \
+        .all()
+    q_course_ids = CourseMixin.filter_related(db.session.query(Course.id),
+                                              None, campus.id)
+    subjects = models.Subject.query \
+        .filter(models.Subject.id.in_(
+            db.session.query(Course.subject_id)
+                      .filter(Course.id.in_(q_course_ids)))) \
+        .order_by(models.Subject.id) \
+        .all()
+    categories = models.GenEduCategory.query \
+        .filter(models.GenEduCategory.id.in_(
+            db.session.query(Course.gen_edu_category_id)
+                      .filter(Course.id.in_(q_course_ids)))) \
+        .order_by(models.GenEduCategory.id) \
+        .all()
+    departments = models.Department.query \
+        .filter_by(campus_id=campus.id) \
+        .order_by(models.Department.id) \
+        .all()
+    return {
+        'version': version,
+        'campus': _serialize_campus(campus),
+        'departments': [_serialize_department(d) for d in departments],
+        'subjects': [_serialize_subject(s) for s in subjects],
+        'gen_edu_categories': [_serialize_gen_edu_category(c)
+                               for c in categories],
+        'courses': [_serialize_course(c) for c in courses],
+    }
+
+
+def path(campus_id, version):
+    """Returns the path of the snapshot of a campus at a version."""
+    return os.path.join(current_app.config['CATALOG_SNAPSHOT_DIR'],
+                        'campus-{0}.{1}.json.gz'.format(campus_id, version))
+
+
+def _versions(campus_id):
+    pattern = os.path.join(current_app.config['CATALOG_SNAPSHOT_DIR'],
+                           'campus-{0}.*.json.gz'.format(campus_id))
+    versions = []
+    for filename in glob.glob(pattern):
+        match = _FILENAME_RE.match(os.path.basename(filename))
+        if match and int(match.group(1)) == campus_id:
+            versions.append(int(match.group(2)))
+    return versions
+
+
+def latest_version(campus_id):
+    """Returns the version of the latest snapshot of a campus, or None if
+    there is no snapshot.
+    """
+    return max(_versions(campus_id) or [None])
+
+
+def prepare(campus, version):
+    """Writes the snapshot of a campus to a temporary file, and returns
+    the path of the file. The snapshot is not served until it is renamed
+    by :func:`publish`.
+
+    :param campus: :class:`dash.catalog.models.Campus` object.
+    :param version: ID of the catalog version of the snapshot.
+    """
+    document = build(campus, version)
+    directory = current_app.config['CATALOG_SNAPSHOT_DIR']
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+                gz.write(json.dumps(document,
+                                    separators=(',', ':')).encode('utf-8'))
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return tmp_path
+
+
+def publish(campus, version, tmp_path):
+    """Renames a snapshot written by :func:`prepare`, and removes older
+    snapshots of the campus.
+    """
+    os.rename(tmp_path, path(campus.id, version))
+    for old_version in _versions(campus.id):
+        if old_version < version:
+            os.remove(path(campus.id, old_version))
+
+
+def discard(tmp_path):
+    """Removes a snapshot written by :func:`prepare`, if it is left."""
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+
+def write(campus, version):
+    """Writes the snapshot of a campus, and removes older snapshots of
+    the campus. The snapshot is written to a temporary file first, and
+    renamed, so readers never see a partial snapshot.
+
+    :param campus: :class:`dash.catalog.models.Campus` object.
+    :param version: ID of the catalog version of the snapshot.
+    """
+    publish(campus, version, prepare(campus, version))
+
+
+class CampusSnapshot(Resource):
+    """API endpoint that serves the latest snapshot of a campus, or the
+    snapshot at a version.
+
+    The latest snapshot should be revalidated by clients, while
+    versioned snapshots may be cached for :data:`MAX_AGE` seconds. The
+    versioned URL of the latest snapshot is given in the
+    ``Content-Location`` header.
+    """
+    def get(self, campus_id, version=None):
+        if version is None:
+            version = latest_version(campus_id)
+            if version is None:
+                abort(404)
+            cache_timeout = 0
+        else:
+            cache_timeout = MAX_AGE
+        filename = path(campus_id, version)
+        if not os.path.isfile(filename):
+            abort(404)
+
+        if request.accept_encodings['gzip']:
+            resp = send_file(filename, mimetype='application/json',
+                             conditional=True, cache_timeout=cache_timeout)
+            resp.headers['Content-Encoding'] = 'gzip'
+        else:
+            f = gzip.open(filename, 'rb')
+            resp = current_app.response_class(
+                iter(lambda: f.read(64 * 1024), b''),
+                mimetype='application/json')
+            resp.call_on_close(f.close)
+            resp.cache_control.public = True
+            resp.cache_control.max_age = cache_timeout
+        resp.headers['Vary'] = 'Accept-Encoding'
+        resp.headers['Content-Location'] = api.url_for(
+            CampusSnapshot, campus_id=campus_id, version=version)
+        return resp
+
+
+api.add_resource(CampusSnapshot,
+                 '/campuses/<int:campus_id>/snapshot',
+                 '/campuses/<int:campus_id>/snapshot/<int:version>')
@@ -0,0 +1,672 @@
+# -*- coding: utf-8 -*-
+"""Catalog sync through staging tables.
+
+:func:`dash.catalog.sync.sync_catalog` matches entities in Python, so it
+reads the stored catalog of a campus into the application. For large
+campuses, :func:`sync_catalog` loads entities from data source into
+temporary staging tables instead, and reconciles the catalog with them
+in a fixed number of set-based statements, so stored rows never leave
+the database. The catalog and the returned numbers of rows are the same
+as those of :func:`dash.catalog.sync.sync_catalog`, except that a
+matched row is updated as a whole if any synced column has changed.
+
+Entities are loaded into staging tables in batches while a scraper
+holds them, by :class:`StagingCatalog`, so the catalog is never held in
+memory as a whole either.
+
+On PostgreSQL, staging tables are loaded with ``COPY``, and rows are
+updated with ``UPDATE ... FROM``. On other databases, such as SQLite
+used by tests, staging tables are loaded with ``executemany()``, and
+rows are updated with correlated subqueries.
+
+Codes are not unique in the schema, since catalogs used to be stored
+more than once, so ``INSERT ... ON CONFLICT`` cannot be used. Staged rows
+are given the ID of the matched stored row first, and staged rows
+without one are inserted with ``INSERT ... SELECT``.
+"""
+import collections
+import io
+import itertools
+
+import six
+from flask import current_app
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Float,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    and_,
+    exists,
+    func,
+    literal,
+    not_,
+    or_,
+    select,
+    true,
+)
+
+from dash.catalog import models, sync
+from dash.catalog.changes import Changes
+from dash.catalog.occupancy import classes_mask, day_masks
+from dash.database import db
+from dash.utils import utcnow
+
+
+__all__ = ['sync_catalog', 'enabled']
+
+#: Number of bytes of rows buffered for a ``COPY`` statement.
+COPY_BUFFER_SIZE = 1 << 20
+
+_departments = models.Department.__table__
+_subjects = models.Subject.__table__
+_gen_edu_categories = models.GenEduCategory.__table__
+_courses = models.Course.__table__
+_course_classes = models.CourseClass.__table__
+_department_course = models.DepartmentCourse.__table__
+
+_metadata = MetaData()
+
+
+def _staging_table(name, *columns):
+    return Table(name, _metadata, *columns, prefixes=['TEMPORARY'])
+
+
+def _entity_staging_table(name):
+    """Returns a staging table of departments, subjects or general
+    education categories. Entities related to a held course are staged
+    with ``course_seq`` of the course.
+    """
+    return _staging_table(
+        name,
+        Column('seq', Integer),
+        Column('course_seq', Integer),
+        Column('id', Integer, index=True),
+        Column('code', String(40), index=True),
+        Column('name', String(80)),
+    )
+
+
+_stage_departments = _entity_staging_table('stage_departments')
+_stage_subjects = _entity_staging_table('stage_subjects')
+_stage_gen_edu_categories = _entity_staging_table('stage_gen_edu_categories')
+_stage_courses = _staging_table(
+    'stage_courses',
+    Column('seq', Integer, index=True),
+    Column('id', Integer, index=True),
+    Column('code', String(40), index=True),
+    Column('subject_code', String(40)),
+    Column('gen_edu_category_code', String(40)),
+    Column('instructor', String(80)),
+    Column('credit', Float),
+    Column('subject_id', Integer),
+    Column('gen_edu_category_id', Integer),
+    Column('target_grade', Integer),
+    Column('major', Boolean(create_constraint=False)),
+    Column('campus_id', Integer),
+    *[Column(name, Integer) for name in models.OCCUPANCY_COLUMNS]
+)
+#: Classes from data source. ``ordinal`` tells apart classes of a course
+#: with the same periods.
+_stage_course_classes = _staging_table(
+    'stage_course_classes',
+    Column('course_seq', Integer),
+    Column('course_code', String(40)),
+    Column('course_id', Integer, index=True),
+    Column('day_of_week', Integer),
+    Column('start_period', Integer),
+    Column('end_period', Integer),
+    Column('ordinal', Integer),
+)
+_stage_department_course = _staging_table(
+    'stage_department_course',
+    Column('course_seq', Integer),
+    Column('department_code', String(40)),
+    Column('course_code', String(40)),
+    Column('department_id', Integer),
+    Column('course_id', Integer, index=True),
+)
+#: Stored courses of the campus before the sync.
+_stage_old_courses = _staging_table(
+    'stage_old_courses',
+    Column('id', Integer),
+    Column('code', String(40)),
+    Column('subject_id', Integer),
+    Column('gen_edu_category_id', Integer),
+)
+#: Stored classes of synced courses, numbered as staged classes are.
+_stage_stored_classes = _staging_table(
+    'stage_stored_classes',
+    Column('id', Integer),
+    Column('course_id', Integer, index=True),
+    Column('day_of_week', Integer),
+    Column('start_period', Integer),
+    Column('end_period', Integer),
+    Column('ordinal', Integer),
+)
+#: Stored rows which may be matched with staged rows. Stored tables are
+#: not indexed by code.
+_stage_candidates = _staging_table(
+    'stage_candidates',
+    Column('id', Integer),
+    Column('code', String(40), index=True),
+)
+
+
+def enabled():
+    """Returns True if catalogs should be synced through staging tables.
+    This is set by ``CATALOG_SYNC_STAGING``, and defaults to whether the
+    database is PostgreSQL.
+    """
+    staging = current_app.config.get('CATALOG_SYNC_STAGING')
+    if staging is None:
+        return db.engine.dialect.name == 'postgresql'
+    return staging
+
+
+def _copy_text(value):
+    """Returns a value in the text format of ``COPY``."""
+    if value is None:
+        return u'\\N'
+    if isinstance(value, bool):
+        return u't' if value else u'f'
+    if isinstance(value, float):
+        value = repr(value)
+    return six.text_type(value) \
+        .replace(u'\\', u'\\\\') \
+        .replace(u'\t', u'\\t') \
+        .replace(u'\n', u'\\n') \
+        .replace(u'\r', u'\\r')
+
+
+def _copy(conn, table, rows):
+    preparer = conn.dialect.identifier_preparer
+    columns = list(table.c)
+    processors = [c.type.bind_processor(conn.dialect) for c in columns]
+    statement = 'COPY {0} ({1}) FROM STDIN'.format(
+        preparer.format_table(table),
+        ', '.join(preparer.format_column(c) for c in columns))
+    cursor = conn.connection.cursor()
+    try:
+        buf = io.BytesIO()
+        for row in rows:
+            values = []
+            for column, process in zip(columns, processors):
+                value = row.get(column.name)
+                if process is not None:
+                    value = process(value)
+                values.append(_copy_text(value))
+            buf.write((u'\t'.join(values) + u'\n').encode('utf-8'))
+            if buf.tell() >= COPY_BUFFER_SIZE:
+                buf.seek(0)
+                cursor.copy_expert(statement, buf)
+                buf = io.BytesIO()
+        if buf.tell():
+            buf.seek(0)
+            cursor.copy_expert(statement, buf)
+    finally:
+        cursor.close()
+
+
+def _load(conn, table, rows):
+    """Loads rows, given as dicts of values by column name, into a
+    staging table.
+    """
+    if conn.dialect.name == 'postgresql':
+        _copy(conn, table, rows)
+        return
+    rows = list(rows)
+    if rows:
+        conn.execute(table.insert(), rows)
+
+
+def _count(stats, table, operation, result):
+    if result.rowcount:
+        stats[table.name][operation] += result.rowcount
+
+
+def _ids(conn, query):
+    return [id for id, in conn.execute(query)]
+
+
+def _distinct(a, b):
+    return or_(a != b,
+               and_(a == None, b != None),  # noqa
+               and_(a != None, b == None))  # noqa
+
+
+def _update_from(conn, table, stage, columns, stats, changes):
+    """Updates rows of ``table`` from the staged rows of the same IDs, of
+    which any of ``columns`` has changed.
+    """
+    on = table.c.id == stage.c.id
+    differs = or_(*[_distinct(table.c[c], stage.c[c]) for c in columns])
+    changes.add(table.name, 'updated', _ids(
+        conn, select([table.c.id]).where(and_(on, differs))))
+    if conn.dialect.name == 'postgresql':
+        stmt = table.update() \
+            .where(and_(on, differs)) \
+            .values(dict((c, stage.c[c]) for c in columns))
+    else:
+        stmt = table.update() \
+            .where(exists().where(and_(on, differs))) \
+            .values(dict((c, select([stage.c[c]]).where(on).as_scalar())
+                         for c in columns))
+    _count(stats, table, 'updated', conn.execute(stmt))
+
+
+def _match(conn, stage, table, *criteria):
+    """Sets the ID of each staged row without one to the lowest ID of the
+    rows of ``table`` with the same code which satisfy ``criteria``.
+    """
+    candidates = _stage_candidates
+    conn.execute(candidates.delete())
+    conn.execute(candidates.insert().from_select(
+        ['id', 'code'],
+        select([table.c.id, table.c.code])
+        .where(and_(table.c.code.in_(select([stage.c.code])), *criteria))))
+    conn.execute(
+        stage.update()
+        .where(stage.c.id == None)  # noqa
+        .values(id=select([func.min(candidates.c.id)])
+                .where(candidates.c.code == stage.c.code)
+                .as_scalar()))
+
+
+def _upsert(conn, stage, table, columns, values, scope, stats, changes,
+            now):
+    """Matches staged rows with stored rows by code, updates matched rows
+    and inserts the rest.
+
+    :param columns: Names of columns to sync, besides ``code``.
+    :param values: Dict of expressions of other columns to insert, which
+                   are the same for all inserted rows.
+    :param scope: Criterion of stored rows which may be matched.
+    """
+    _match(conn, stage, table, scope)
+    _update_from(conn, table, stage, columns, stats, changes)
+
+    max_id = conn.execute(select([func.max(table.c.id)])).scalar() or 0
+    # Rows inserted here are told from rows inserted meanwhile for other
+    # campuses by their codes and the values inserted with them.
+    inserted = and_(table.c.id > max_id,
+                    table.c.code.in_(select([stage.c.code])
+                                     .where(stage.c.id == None)),  # noqa
+                    *[table.c[name] == value
+                      for name, value in sorted(values.items())])
+    values = dict(values, created_at=literal(now, table.c.created_at.type))
+    names = ['code'] + list(columns) + sorted(values)
+    result = conn.execute(table.insert().from_select(
+        names,
+        select([stage.c.code] + [stage.c[c] for c in columns] +
+               [values[name] for name in sorted(values)])
+        .where(stage.c.id == None)))  # noqa
+    _count(stats, table, 'inserted', result)
+    if result.rowcount:
+        changes.add(table.name, 'created', _ids(
+            conn, select([table.c.id]).where(inserted)))
+    _match(conn, stage, table, inserted)
+
+
+class StagingCatalog(object):
+    """A :class:`dash.catalog.scraper.Catalog` which loads held entities
+    into staging tables in batches, instead of keeping them.
+
+    Each held entity is turned into rows at once, and the rows are loaded
+    when ``batch_size`` of them are pending, so memory used does not
+    depend on the size of the catalog, and entities may be held from
+    generators. Entities related to a held course are staged with the
+    course, and refer to each other by code. Entities with the same code
+    are resolved when the catalog is synced, as in
+    :func:`dash.catalog.sync.collect`.
+
+    The staging tables are created when the catalog is created, before
+    the scraper writes anything, since the sqlite3 module of Python 2
+    commits the transaction in progress before DDL.
+
+    :param session: Session in whose transaction the staging tables are
+                    created.
+    :param batch_size: Number of rows loaded at once. Defaults to
+                       ``CATALOG_SYNC_BATCH_SIZE``.
+    """
+
+    def __init__(self, session=None, batch_size=None):
+        self.session = session or db.session
+        self.batch_size = batch_size or \
+            current_app.config['CATALOG_SYNC_BATCH_SIZE']
+        self._seq = itertools.count(1)
+        self._pending = dict((table, []) for table in _metadata.sorted_tables)
+        self._n_pending = 0
+        #: Connection on which the staging tables have been created.
+        self.conn = self.session.connection()
+        # Staging tables are left behind by a failed sync if DDL was not
+        # transactional, and by every sync on SQLite.
+        for table in _metadata.sorted_tables:
+            table.drop(bind=self.conn, checkfirst=True)
+            table.create(bind=self.conn)
+
+    def _add(self, table, row):
+        self._pending[table].append(row)
+        self._n_pending += 1
+
+    def _hold(self, table, entities, course_seq=None):
+        for e in entities:
+            self._add(table, {'seq': next(self._seq),
+                              'course_seq': course_seq,
+                              'code': e.code, 'name': e.name})
+            self._flush_if_full()
+
+    def _flush_if_full(self):
+        if self._n_pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Loads pending rows into the staging tables. Held entities which
+        were added to the session are expunged.
+        """
+        conn = self.conn
+        sync.detach_held(self.session)
+        for table, rows in self._pending.items():
+            _load(conn, table, rows)
+            del rows[:]
+        self._n_pending = 0
+
+    def hold_departments(self, departments):
+        """Holds department objects from an iterable."""
+        self._hold(_stage_departments, departments)
+
+    def hold_subjects(self, subjects):
+        """Holds subject objects from an iterable."""
+        self._hold(_stage_subjects, subjects)
+
+    def hold_gen_edu_categories(self, categories):
+        """Holds general education category objects from an iterable."""
+        self._hold(_stage_gen_edu_categories, categories)
+
+    def hold_courses(self, courses):
+        """Holds course objects from an iterable, with their classes and
+        related entities.
+
+        :raises AssertionError: if a course is neither major nor related
+                                with a general education category.
+        """
+        for c in courses:
+            category = c.gen_edu_category
+            seq = next(self._seq)
+            row = {
+                'seq': seq,
+                'code': c.code,
+                'subject_code': c.subject.code,
+                'gen_edu_category_code': (category.code
+                                          if category is not None else None),
+                'instructor': c.instructor,
+                'credit': c.credit,
+                'target_grade': c.target_grade,
+                'major': c.major,
+            }
+            # Categories are referred to by code until the sync.
+            models.check_course_type(row['major'],
+                                     row['gen_edu_category_code'])
+            row.update(zip(models.OCCUPANCY_COLUMNS,
+                           day_masks(classes_mask(c.classes))))
+            self._add(_stage_courses, row)
+            self._hold(_stage_subjects, [c.subject], seq)
+            if category is not None:
+                self._hold(_stage_gen_edu_categories, [category], seq)
+            departments = sorted(c.departments, key=lambda d: d.code)
+            self._hold(_stage_departments, departments, seq)
+            for d in departments:
+                self._add(_stage_department_course, {
+                    'course_seq': seq,
+                    'department_code': d.code,
+                    'course_code': c.code,
+                })
+            ordinals = collections.Counter()
+            for cc in c.classes:
+                periods = (cc.day_of_week, cc.start_period, cc.end_period)
+                ordinals[periods] += 1
+                self._add(_stage_course_classes, {
+                    'course_seq': seq,
+                    'course_code': c.code,
+                    'day_of_week': cc.day_of_week,
+                    'start_period': cc.start_period,
+                    'end_period': cc.end_period,
+                    'ordinal': ordinals[periods],
+                })
+            self._flush_if_full()
+
+
+def _deduplicate(conn):
+    """Deletes staged rows of entities which are not synced, since
+    another entity with the same code was held first.
+    """
+    stage = _stage_courses
+    first = stage.alias()
+    conn.execute(stage.delete().where(
+        stage.c.seq > select([func.min(first.c.seq)])
+        .where(first.c.code == stage.c.code).as_scalar()))
+    for table in (_stage_course_classes, _stage_department_course,
+                  _stage_departments, _stage_subjects,
+                  _stage_gen_edu_categories):
+        conn.execute(table.delete().where(and_(
+            table.c.course_seq != None,  # noqa
+            not_(table.c.course_seq.in_(select([stage.c.seq]))))))
+    # Held entities come before entities related to held courses.
+    for table in (_stage_departments, _stage_subjects,
+                  _stage_gen_edu_categories):
+        held = table.alias()
+        conn.execute(table.delete().where(and_(
+            table.c.course_seq != None,  # noqa
+            table.c.code.in_(select([held.c.code])
+                             .where(held.c.course_seq == None)))))  # noqa
+        first = table.alias()
+        conn.execute(table.delete().where(
+            table.c.seq > select([func.min(first.c.seq)])
+            .where(first.c.code == table.c.code).as_scalar()))
+
+
+def _same_class(a, b):
+    return and_(a.c.course_id == b.c.course_id,
+                a.c.day_of_week == b.c.day_of_week,
+                a.c.start_period == b.c.start_period,
+                a.c.end_period == b.c.end_period,
+                a.c.ordinal == b.c.ordinal)
+
+
+def _sync_classes(conn, stats, changes, now):
+    stage = _stage_course_classes
+    stored = _stage_stored_classes
+    conn.execute(stage.update().values(
+        course_id=select([_stage_courses.c.id])
+        .where(_stage_courses.c.code == stage.c.course_code)
+        .as_scalar()))
+    conn.execute(stored.insert().from_select(
+        ['id', 'course_id', 'day_of_week', 'start_period', 'end_period'],
+        select([_course_classes.c.id,
+                _course_classes.c.course_id,
+                _course_classes.c.day_of_week,
+                _course_classes.c.start_period,
+                _course_classes.c.end_period])
+        .where(_course_classes.c.course_id.in_(
+            select([_stage_courses.c.id])))))
+    other = stored.alias()
+    conn.execute(stored.update().values(
+        ordinal=select([func.count()])
+        .where(and_(other.c.course_id == stored.c.course_id,
+                    other.c.day_of_week == stored.c.day_of_week,
+                    other.c.start_period == stored.c.start_period,
+                    other.c.end_period == stored.c.end_period,
+                    other.c.id <= stored.c.id))
+        .as_scalar()))
+
+    not_staged = not_(exists().where(_same_class(stage, stored)))
+    not_stored = not_(exists().where(_same_class(stored, stage)))
+    changes.add(_courses.name, 'updated', _ids(
+        conn, select([stored.c.course_id]).where(not_staged)))
+    changes.add(_courses.name, 'updated', _ids(
+        conn, select([stage.c.course_id]).where(not_stored)))
+    _count(stats, _course_classes, 'deleted', conn.execute(
+        _course_classes.delete().where(_course_classes.c.id.in_(
+            select([stored.c.id]).where(not_staged)))))
+    _count(stats, _course_classes, 'inserted', conn.execute(
+        _course_classes.insert().from_select(
+            ['created_at', 'course_id', 'day_of_week', 'start_period',
+             'end_period'],
+            select([literal(now, _course_classes.c.created_at.type),
+                    stage.c.course_id,
+                    stage.c.day_of_week,
+                    stage.c.start_period,
+                    stage.c.end_period])
+            .where(not_stored))))
+
+
+def _sync_department_courses(conn, campus_id, stats, changes):
+    stage = _stage_department_course
+    conn.execute(stage.update().values(
+        department_id=select([_stage_departments.c.id])
+        .where(_stage_departments.c.code == stage.c.department_code)
+        .as_scalar(),
+        course_id=select([_stage_courses.c.id])
+        .where(_stage_courses.c.code == stage.c.course_code)
+        .as_scalar()))
+    same_pair = and_(
+        stage.c.department_id == _department_course.c.department_id,
+        stage.c.course_id == _department_course.c.course_id)
+    stale = and_(
+        _department_course.c.department_id.in_(
+            select([_departments.c.id])
+            .where(_departments.c.campus_id == campus_id)),
+        not_(exists().where(same_pair)))
+    new = not_(exists().where(same_pair))
+    changes.add(_courses.name, 'updated', _ids(
+        conn, select([_department_course.c.course_id]).where(stale)))
+    changes.add(_courses.name, 'updated', _ids(
+        conn, select([stage.c.course_id]).where(new)))
+    _count(stats, _department_course, 'deleted', conn.execute(
+        _department_course.delete().where(stale)))
+    _count(stats, _department_course, 'inserted', conn.execute(
+        _department_course.insert().from_select(
+            ['department_id', 'course_id'],
+            select([stage.c.department_id, stage.c.course_id])
+            .where(new))))
+
+
+def _delete_ids(conn, table, criterion, stats, changes):
+    """Deletes rows of an entity table which satisfy ``criterion``."""
+    changes.add(table.name, 'deleted',
+                _ids(conn, select([table.c.id]).where(criterion)))
+    _count(stats, table, 'deleted',
+           conn.execute(table.delete().where(criterion)))
+
+
+def _delete_unused(conn, table, stage, column, old_column, stats, changes):
+    """Deletes rows of ``table`` which are not staged, were used by the
+    campus or have the code of a staged row, and are not referred to by
+    ``column`` of courses.
+    """
+    _delete_ids(conn, table, and_(
+        not_(table.c.id.in_(
+            select([stage.c.id]).where(stage.c.id != None))),  # noqa
+        or_(table.c.id.in_(select([old_column])),
+            table.c.code.in_(select([stage.c.code]))),
+        not_(exists().where(column == table.c.id))), stats, changes)
+
+
+def sync_catalog(campus, catalog, session=None, changes=None):
+    """Syncs the catalog of a campus with entities held by a
+    :class:`dash.catalog.scraper.Catalog` object through staging tables.
+    This is a drop-in replacement for
+    :func:`dash.catalog.sync.sync_catalog`, and does not commit either.
+
+    :param campus: Campus of which catalog will be synced.
+    :param catalog: :class:`dash.catalog.scraper.Catalog` object.
+    :param changes: :class:`dash.catalog.changes.Changes` object to which
+                    IDs of written entities are added, if given.
+    :returns: Numbers of rows inserted, updated and deleted, as
+              ``stats[table name][operation]``.
+    """
+    changes = changes if changes is not None else Changes()
+    if not isinstance(catalog, StagingCatalog):
+        held = catalog
+        catalog = StagingCatalog(session)
+        catalog.hold_departments(held.departments)
+        catalog.hold_subjects(held.subjects)
+        catalog.hold_gen_edu_categories(held.gen_edu_categories)
+        catalog.hold_courses(held.courses)
+    catalog.flush()
+    conn = catalog.conn
+    sync.lock(conn)
+    stats = collections.defaultdict(collections.Counter)
+    now = utcnow()
+    tables = _metadata.sorted_tables
+    if conn.dialect.name == 'postgresql':
+        for table in tables:
+            conn.execute('ANALYZE {0}'.format(
+                conn.dialect.identifier_preparer.format_table(table)))
+    _deduplicate(conn)
+
+    _upsert(conn, _stage_departments, _departments, ['name'],
+            {'campus_id': literal(campus.id)},
+            _departments.c.campus_id == campus.id, stats, changes, now)
+    _upsert(conn, _stage_subjects, _subjects, ['name'], {}, true(),
+            stats, changes, now)
+    _upsert(conn, _stage_gen_edu_categories, _gen_edu_categories, ['name'],
+            {}, true(), stats, changes, now)
+
+    conn.execute(_stage_courses.update().values(
+        campus_id=literal(campus.id),
+        subject_id=select([_stage_subjects.c.id])
+        .where(_stage_subjects.c.code == _stage_courses.c.subject_code)
+        .as_scalar(),
+        gen_edu_category_id=select([_stage_gen_edu_categories.c.id])
+        .where(_stage_gen_edu_categories.c.code ==
+               _stage_courses.c.gen_edu_category_code)
+        .as_scalar()))
+    q_linked_course_ids = select([_department_course.c.course_id])
+    conn.execute(_stage_old_courses.insert().from_select(
+        ['id', 'code', 'subject_id', 'gen_edu_category_id'],
+        select([_courses.c.id, _courses.c.code, _courses.c.subject_id,
+                _courses.c.gen_edu_category_id])
+        .where(or_(
+            _courses.c.campus_id == campus.id,
+            _courses.c.id.in_(
+                q_linked_course_ids
+                .select_from(_department_course.join(_departments))
+                .where(_departments.c.campus_id == campus.id)),
+            and_(_courses.c.campus_id == None,  # noqa
+                 not_(_courses.c.id.in_(q_linked_course_ids)),
+                 _courses.c.code.in_(select([_stage_courses.c.code])))))))
+    _upsert(conn, _stage_courses, _courses, sync.COURSE_COLUMNS, {},
+            _courses.c.id.in_(select([_stage_old_courses.c.id])),
+            stats, changes, now)
+    q_stale_course_ids = select([_stage_old_courses.c.id]).where(not_(
+        _stage_old_courses.c.id.in_(select([_stage_courses.c.id]))))
+    for table in (_course_classes, _department_course):
+        _count(stats, table, 'deleted', conn.execute(
+            table.delete().where(table.c.course_id.in_(q_stale_course_ids))))
+    _delete_ids(conn, _courses, _courses.c.id.in_(q_stale_course_ids),
+                stats, changes)
+
+    _sync_classes(conn, stats, changes, now)
+    _sync_department_courses(conn, campus.id, stats, changes)
+    _delete_ids(conn, _departments, and_(
+        _departments.c.campus_id == campus.id,
+        not_(_departments.c.id.in_(select([_stage_departments.c.id])))),
+        stats, changes)
+
+    _delete_unused(conn, _subjects, _stage_subjects, _courses.c.subject_id,
+                   _stage_old_courses.c.subject_id, stats, changes)
+    _delete_unused(conn, _gen_edu_categories, _stage_gen_edu_categories,
+                   _courses.c.gen_edu_category_id,
+                   _stage_old_courses.c.gen_edu_category_id, stats, changes)
+
+    # On SQLite, staging tables are emptied rather than dropped, so that the
+    # sync is not committed before DDL.
+    for table in reversed(tables):
+        if conn.dialect.name == 'sqlite':
+            conn.execute(table.delete())
+        else:
+            table.drop(bind=conn)
+    return stats
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""Streaming output of collections as newline-delimited JSON.
+
+Clients which send ``Accept: application/x-ndjson`` get the entities of
+a collection as one JSON object per line. Entities are fetched in
+batches by seeking on their IDs, and each batch is serialized and sent
+before the next one is fetched, so the memory used by a response does
+not depend on the number of entities in it.
+
+Batches are fetched with ``LIMIT`` instead of ``Query.yield_per()``,
+since the latter cannot be used with eager loading of collections.
+"""
+import json
+
+from flask import current_app, request, stream_with_context
+
+
+__all__ = ['MIMETYPE', 'requested', 'iter_batches', 'response']
+
+#: Media type of newline-delimited JSON.
+MIMETYPE = 'application/x-ndjson'
+
+#: Media types in which collections can be represented, in order of
+#: preference.
+MIMETYPES = ['application/json', MIMETYPE]
+
+
+def requested():
+    """Returns True if the client of the current request prefers
+    newline-delimited JSON.
+    """
+    return request.accept_mimetypes.best_match(MIMETYPES) == MIMETYPE
+
+
+def iter_batches(query, column, batch_size, limit=None, offset=None):
+    """Yields lists of entities from a query, ``batch_size`` entities at
+    a time.
+
+    :param query: Query ordered by ``column``.
+    :param column: Column of unique values, such as ``id``, by which
+                   batches are sought.
+    :param batch_size: Maximum number of entities in a batch.
+    :param limit: Maximum number of entities in total, or None.
+    :param offset: Number of entities to skip, or None.
+    """
+    last = None
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size,
+                                                        remaining)
+        q = query
+        if last is None:
+            q = q.offset(offset)
+        else:
+            q = q.filter(column > last)
+        batch = q.limit(size).all()
+        if not batch:
+            return
+        yield batch
+        if len(batch) < size:
+            return
+        last = getattr(batch[-1], column.key)
+        if remaining is not None:
+            remaining -= len(batch)
+
+
+def response(batches, serialize):
+    """Returns a response which streams entities from ``batches`` as
+    newline-delimited JSON.
+
+    :param batches: Iterable of lists of entities.
+    :param serialize: Function which returns a serializable form of an
+                      entity.
+    """
+    def generate():
+        for batch in batches:
+            yield ''.join(json.dumps(serialize(entity)) + '\n'
+                          for entity in batch)
+    return current_app.response_class(stream_with_context(generate()),
+                                      mimetype=MIMETYPE)
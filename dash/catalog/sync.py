@@ -0,0 +1,456 @@
+# -*- coding: utf-8 -*-
+"""One-way sync of catalog from data source to database.
+
+Entities from data source are matched with stored entities by ``code``.
+Stored entities whose code is not in data source are deleted, matched
+entities are updated, and the rest of entities from data source are
+created. Everything is done with Core statements on whole sets of rows:
+stored rows are looked up in bulk, only the columns which have changed
+are updated, and inserts, updates and deletes are sent with
+``executemany()``. Syncing a catalog which has not changed reads the
+stored catalog and writes nothing.
+
+Entities are scoped as follows:
+
+* Departments belong to a campus, and are matched among the
+  departments of the campus.
+* Courses belong to the campus whose catalog they were synced with, and
+  are matched among the courses of the campus and the courses linked to
+  its departments. Courses without departments stored before campuses
+  were recorded on courses are matched by code only, and recorded on
+  the first campus which syncs them.
+* Subjects and general education categories are shared by campuses.
+  They are matched by code, and deleted only if they were used by the
+  campus, and are not used by any course after the sync.
+* Classes of a course are matched by their periods, and associations
+  between departments and courses are matched by their ends.
+
+Writes are made in the transaction of the session, which is not
+committed. Catalogs of several campuses may be updated concurrently, as
+:mod:`dash.catalog.batch` does, but they share subjects and categories,
+and IDs of inserted rows are read back after ``executemany()``. So
+:func:`lock` is taken first, and syncs write one at a time until their
+transactions end, while scrapers still run concurrently.
+
+See :mod:`dash.catalog.staging` for a variant which matches entities
+within the database.
+"""
+import collections
+import itertools
+import operator
+import sqlite3
+
+from flask import current_app, has_app_context
+import sqlalchemy
+from sqlalchemy import (
+    and_,
+    bindparam,
+    exists,
+    false,
+    func,
+    not_,
+    or_,
+    select,
+)
+from sqlalchemy.engine import Engine
+
+from dash.catalog import models
+from dash.catalog.changes import Changes
+from dash.catalog.occupancy import classes_mask, day_masks
+from dash.database import db
+
+
+__all__ = ['sync_catalog', 'changed', 'lock']
+
+#: Maximum number of values in an ``IN`` clause.
+CHUNK_SIZE = 500
+
+_departments = models.Department.__table__
+_subjects = models.Subject.__table__
+_gen_edu_categories = models.GenEduCategory.__table__
+_courses = models.Course.__table__
+_course_classes = models.CourseClass.__table__
+_department_course = models.DepartmentCourse.__table__
+
+#: Key of the PostgreSQL advisory lock taken by :func:`lock`.
+LOCK_KEY = 0x64617368
+
+#: Columns of courses which are synced, besides ``code``.
+COURSE_COLUMNS = ('instructor', 'credit', 'subject_id',
+                  'gen_edu_category_id', 'target_grade',
+                  'major', 'campus_id') + models.OCCUPANCY_COLUMNS
+
+
+def _chunks(values, size=CHUNK_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _unique_by_code(entities):
+    by_code = collections.OrderedDict()
+    for e in entities:
+        by_code.setdefault(e.code, e)
+    return by_code
+
+
+def _delete_ids(session, table, ids, stats):
+    for chunk in _chunks(ids):
+        session.execute(table.delete().where(table.c.id.in_(chunk)))
+    stats[table.name]['deleted'] += len(ids)
+
+
+def _select_by_codes(session, table, columns, codes, *criteria):
+    rows = []
+    for chunk in _chunks(codes):
+        rows.extend(session.execute(
+            select([table.c.id, table.c.code] +
+                   [table.c[c] for c in columns])
+            .where(and_(table.c.code.in_(chunk), *criteria))
+        ).fetchall())
+    return rows
+
+
+def _upsert(session, table, columns, incoming, existing, stats, changes,
+            *scope):
+    """Updates and inserts rows of a table, matching them by code.
+
+    :param columns: Names of columns to sync, besides ``code``.
+    :param incoming: Dict of column values by code.
+    :param existing: Stored rows which may match ``incoming``, with
+                     ``id``, ``code`` and ``columns``. If several rows
+                     have the same code, the one with the lowest ID is
+                     matched.
+    :param scope: Criteria of rows among which ``existing`` were
+                  selected, by which inserted rows are told from rows
+                  of other campuses with the same code.
+    :returns: A tuple of a dict of IDs by code, and a list of IDs of
+              stored rows which are not matched.
+    """
+    matched = {}
+    unmatched = []
+    for row in sorted(existing, key=operator.itemgetter('id')):
+        if row['code'] in incoming and row['code'] not in matched:
+            matched[row['code']] = row
+        else:
+            unmatched.append(row['id'])
+
+    # Rows are updated in groups of the same changed columns.
+    updates = collections.defaultdict(list)
+    for code, row in matched.items():
+        values = incoming[code]
+        changed = tuple(c for c in columns if row[c] != values[c])
+        if changed:
+            params = dict((c, values[c]) for c in changed)
+            params['_id'] = row['id']
+            updates[changed].append(params)
+    for changed, params in updates.items():
+        stmt = table.update() \
+            .where(table.c.id == bindparam('_id')) \
+            .values(dict((c, bindparam(c, type_=table.c[c].type))
+                         for c in changed))
+        session.execute(stmt, params)
+        stats[table.name]['updated'] += len(params)
+        changes.add(table.name, 'updated', (p['_id'] for p in params))
+
+    ids = dict((code, row['id']) for code, row in matched.items())
+    inserts = [dict(incoming[code], code=code) for code in incoming
+               if code not in matched]
+    if inserts:
+        max_id = session.execute(select([func.max(table.c.id)])).scalar()
+        session.execute(table.insert(), inserts)
+        stats[table.name]['inserted'] += len(inserts)
+        # IDs of inserted rows are read back by their codes, since
+        # executemany() does not return them.
+        inserted = _select_by_codes(
+            session, table, [], [values['code'] for values in inserts],
+            table.c.id > (max_id or 0), *scope)
+        ids.update((row['code'], row['id']) for row in inserted)
+        changes.add(table.name, 'created', (row['id'] for row in inserted))
+    return ids, unmatched
+
+
+def _sync_classes(session, course_ids, classes, stats, changes):
+    """Syncs classes of courses.
+
+    :param course_ids: Dict of IDs of courses by code.
+    :param classes: Dict of lists of ``(day_of_week, start_period,
+                    end_period)`` tuples by code of course.
+    """
+    stored = collections.defaultdict(list)
+    for chunk in _chunks(course_ids.values()):
+        for row in session.execute(
+                select([_course_classes.c.id,
+                        _course_classes.c.course_id,
+                        _course_classes.c.day_of_week,
+                        _course_classes.c.start_period,
+                        _course_classes.c.end_period])
+                .where(_course_classes.c.course_id.in_(chunk))
+                .order_by(_course_classes.c.id)):
+            stored[row['course_id']].append(
+                (row['id'], (row['day_of_week'], row['start_period'],
+                             row['end_period'])))
+
+    deletes = []
+    inserts = []
+    changed_course_ids = set()
+    for code, course_id in course_ids.items():
+        remaining = collections.Counter(classes[code])
+        for class_id, periods in stored[course_id]:
+            if remaining[periods] > 0:
+                remaining[periods] -= 1
+            else:
+                deletes.append(class_id)
+                changed_course_ids.add(course_id)
+        for periods, count in sorted(remaining.items()):
+            if count:
+                changed_course_ids.add(course_id)
+            day_of_week, start_period, end_period = periods
+            inserts.extend(itertools.repeat({
+                'course_id': course_id,
+                'day_of_week': day_of_week,
+                'start_period': start_period,
+                'end_period': end_period,
+            }, count))
+    _delete_ids(session, _course_classes, deletes, stats)
+    if inserts:
+        session.execute(_course_classes.insert(), inserts)
+        stats[_course_classes.name]['inserted'] += len(inserts)
+    changes.add(_courses.name, 'updated', changed_course_ids)
+
+
+def _sync_department_courses(session, campus_id, pairs, stats, changes):
+    """Syncs associations between departments of a campus and courses.
+
+    :param pairs: Set of ``(department_id, course_id)`` tuples.
+    """
+    q_department_ids = select([_departments.c.id]) \
+        .where(_departments.c.campus_id == campus_id)
+    stored = set(
+        (row['department_id'], row['course_id'])
+        for row in session.execute(
+            select([_department_course.c.department_id,
+                    _department_course.c.course_id])
+            .where(_department_course.c.department_id.in_(q_department_ids)))
+    )
+    deletes = [{'_department_id': department_id, '_course_id': course_id}
+               for department_id, course_id in sorted(stored - pairs)]
+    if deletes:
+        session.execute(_department_course.delete().where(and_(
+            _department_course.c.department_id == bindparam('_department_id'),
+            _department_course.c.course_id == bindparam('_course_id'),
+        )), deletes)
+        stats[_department_course.name]['deleted'] += len(deletes)
+    inserts = [{'department_id': department_id, 'course_id': course_id}
+               for department_id, course_id in sorted(pairs - stored)]
+    if inserts:
+        session.execute(_department_course.insert(), inserts)
+        stats[_department_course.name]['inserted'] += len(inserts)
+    changes.add(_courses.name, 'updated',
+                (course_id for _, course_id in stored ^ pairs))
+
+
+def _delete_unused(session, table, column, ids, stats, changes):
+    """Deletes rows of ``table`` with the given IDs, which are not
+    referred to by ``column`` of courses.
+    """
+    ids = sorted(ids)
+    unused = []
+    for chunk in _chunks(ids):
+        unused.extend(id for id, in session.execute(
+            select([table.c.id])
+            .where(table.c.id.in_(chunk))
+            .where(not_(exists().where(column == table.c.id)))))
+    _delete_ids(session, table, unused, stats)
+    changes.add(table.name, 'deleted', unused)
+
+
+def _course_values(course, campus_id, subject_ids, gen_edu_category_ids):
+    category = course.gen_edu_category
+    values = {
+        'campus_id': campus_id,
+        'instructor': course.instructor,
+        'credit': course.credit,
+        'subject_id': subject_ids[course.subject.code],
+        'gen_edu_category_id': (gen_edu_category_ids[category.code]
+                                if category is not None else None),
+        'target_grade': course.target_grade,
+        'major': course.major,
+    }
+    values.update(zip(models.OCCUPANCY_COLUMNS,
+                      day_masks(classes_mask(course.classes))))
+    models.check_course_type(values['major'], values['gen_edu_category_id'])
+    return values
+
+
+def lock(conn):
+    """Waits until syncs of other campuses are done, and keeps the rest
+    waiting until the transaction of ``conn`` ends.
+
+    On PostgreSQL, a transaction-level advisory lock is taken. On SQLite,
+    the write lock of the database is taken with a no-op delete, waiting
+    up to ``CATALOG_SYNC_LOCK_TIMEOUT`` seconds for it, as set when the
+    connection was made. Other databases are not locked.
+    """
+    dialect = conn.dialect.name
+    if dialect == 'postgresql':
+        conn.execute(select([func.pg_advisory_xact_lock(LOCK_KEY)]))
+    elif dialect == 'sqlite':
+        conn.execute(_departments.delete().where(false()))
+
+
+@sqlalchemy.event.listens_for(Engine, 'connect')
+def _set_busy_timeout(dbapi_connection, connection_record):
+    # The timeout is set when connecting rather than in lock(), since the
+    # sqlite3 module of Python 2 commits the transaction in progress before
+    # statements such as PRAGMA.
+    if isinstance(dbapi_connection, sqlite3.Connection) and has_app_context():
+        timeout = current_app.config['CATALOG_SYNC_LOCK_TIMEOUT']
+        dbapi_connection.execute('PRAGMA busy_timeout = {0:d}'.format(
+            int(timeout * 1000)))
+
+
+def detach_held(session):
+    """Expunges held catalog entities which were added to a session, and
+    flushes the session.
+    """
+    for obj in list(session.new):
+        if isinstance(obj, (models.Department, models.Subject,
+                            models.GenEduCategory, models.Course,
+                            models.CourseClass, models.DepartmentCourse)):
+            session.expunge(obj)
+    # The campus itself may not have been flushed yet.
+    session.flush()
+
+
+def collect(catalog):
+    """Returns dicts of held departments, subjects, general education
+    categories and courses by code, including entities related to held
+    courses. Of entities with the same code, the first one is kept.
+    """
+    courses = _unique_by_code(catalog.courses)
+    departments = _unique_by_code(itertools.chain(
+        catalog.departments,
+        (d for c in courses.values() for d in c.departments)))
+    subjects = _unique_by_code(itertools.chain(
+        catalog.subjects,
+        (c.subject for c in courses.values())))
+    gen_edu_categories = _unique_by_code(itertools.chain(
+        catalog.gen_edu_categories,
+        (c.gen_edu_category for c in courses.values()
+         if c.gen_edu_category is not None)))
+    return departments, subjects, gen_edu_categories, courses
+
+
+def sync_catalog(campus, catalog, session=None, changes=None):
+    """Syncs the catalog of a campus with entities held by a
+    :class:`dash.catalog.scraper.Catalog` object. Entities related to
+    held courses are synced even if they are not held. This does not
+    commit.
+
+    Held entities are not added to the session. If some of them were
+    added, for example by cascading from a related campus, they are
+    expunged.
+
+    :param campus: Campus of which catalog will be synced.
+    :param catalog: :class:`dash.catalog.scraper.Catalog` object.
+    :param changes: :class:`dash.catalog.changes.Changes` object to which
+                    IDs of written entities are added, if given.
+    :returns: Numbers of rows inserted, updated and deleted, as
+              ``stats[table name][operation]``.
+    """
+    session = session or db.session
+    changes = changes if changes is not None else Changes()
+    detach_held(session)
+    lock(session.connection())
+    stats = collections.defaultdict(collections.Counter)
+    departments, subjects, gen_edu_categories, courses = collect(catalog)
+
+    # Departments are deleted after courses, so that courses of deleted
+    # departments are still found among the courses of the campus.
+    department_ids, stale_department_ids = _upsert(
+        session, _departments, ['name'],
+        dict((code, {'name': d.name, 'campus_id': campus.id})
+             for code, d in departments.items()),
+        session.execute(
+            select([_departments.c.id, _departments.c.code,
+                    _departments.c.name])
+            .where(_departments.c.campus_id == campus.id)).fetchall(),
+        stats, changes, _departments.c.campus_id == campus.id)
+    subject_ids, stale_subject_ids = _upsert(
+        session, _subjects, ['name'],
+        dict((code, {'name': s.name}) for code, s in subjects.items()),
+        _select_by_codes(session, _subjects, ['name'], subjects),
+        stats, changes)
+    gen_edu_category_ids, stale_category_ids = _upsert(
+        session, _gen_edu_categories, ['name'],
+        dict((code, {'name': c.name})
+             for code, c in gen_edu_categories.items()),
+        _select_by_codes(session, _gen_edu_categories, ['name'],
+                         gen_edu_categories),
+        stats, changes)
+
+    q_campus_course_ids = select([_department_course.c.course_id]) \
+        .select_from(_department_course.join(_departments)) \
+        .where(_departments.c.campus_id == campus.id)
+    q_stored_courses = select([_courses.c.id, _courses.c.code] +
+                              [_courses.c[c] for c in COURSE_COLUMNS])
+    stored_courses = session.execute(q_stored_courses.where(or_(
+        _courses.c.campus_id == campus.id,
+        _courses.c.id.in_(q_campus_course_ids)))).fetchall()
+    # Courses without departments and campus are rare, so they are all
+    # read and matched here.
+    stored_courses.extend(
+        row for row in session.execute(q_stored_courses.where(and_(
+            _courses.c.campus_id == None,  # noqa
+            not_(_courses.c.id.in_(select([_department_course.c.course_id])))
+        )))
+        if row['code'] in courses)
+    course_ids, stale_course_ids = _upsert(
+        session, _courses, COURSE_COLUMNS,
+        dict((code, _course_values(c, campus.id, subject_ids,
+                                   gen_edu_category_ids))
+             for code, c in courses.items()),
+        stored_courses,
+        stats, changes, _courses.c.campus_id == campus.id)
+    for chunk in _chunks(stale_course_ids):
+        for table in (_course_classes, _department_course):
+            result = session.execute(
+                table.delete().where(table.c.course_id.in_(chunk)))
+            stats[table.name]['deleted'] += result.rowcount
+    _delete_ids(session, _courses, stale_course_ids, stats)
+    changes.add(_courses.name, 'deleted', stale_course_ids)
+
+    _sync_classes(
+        session, course_ids,
+        dict((code, [(cc.day_of_week, cc.start_period, cc.end_period)
+                     for cc in c.classes])
+             for code, c in courses.items()),
+        stats, changes)
+    _sync_department_courses(
+        session, campus.id,
+        set((department_ids[d.code], course_ids[code])
+            for code, c in courses.items() for d in c.departments),
+        stats, changes)
+    _delete_ids(session, _departments, stale_department_ids, stats)
+    changes.add(_departments.name, 'deleted', stale_department_ids)
+
+    # Subjects and categories which were used by the campus, or stored
+    # twice, may be left unused.
+    _delete_unused(
+        session, _subjects, _courses.c.subject_id,
+        (set(row['subject_id'] for row in stored_courses) |
+         set(stale_subject_ids)) - set(subject_ids.values()),
+        stats, changes)
+    _delete_unused(
+        session, _gen_edu_categories, _courses.c.gen_edu_category_id,
+        (set(row['gen_edu_category_id'] for row in stored_courses
+             if row['gen_edu_category_id'] is not None) |
+         set(stale_category_ids)) - set(gen_edu_category_ids.values()),
+        stats, changes)
+    return stats
+
+
+def changed(stats):
+    """Returns True if :func:`sync_catalog` wrote any row."""
+    return any(sum(counter.values()) for counter in stats.values())
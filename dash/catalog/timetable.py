@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Timetable generation engine.
+
+A timetable is built by choosing one option from each of several
+groups, e.g. one course for each wanted subject. Each option carries
+the weekly occupancy mask from :mod:`dash.catalog.occupancy`, and a
+timetable is valid only if no two chosen options share a bit.
+"""
+import collections
+import itertools
+
+from six import iteritems
+
+
+__all__ = ['iter_timetables']
+
+
+def iter_timetables(groups):
+    """Generates all timetables without time conflicts.
+
+    Options in a group which have the same occupancy mask are searched
+    only once, and groups with fewer distinct masks are searched first.
+    After each choice, the search backtracks as soon as some remaining
+    group has no option which fits the occupied slots.
+
+    :param groups: Sequence of groups, each of which is an iterable of
+                   ``(key, mask)`` pairs.
+
+    :returns: An iterator of tuples of keys. The n-th key of a tuple is
+              chosen from the n-th group.
+    """
+    buckets = []
+    for index, group in enumerate(groups):
+        # Options are searched in the order of the group on every Python.
+        by_mask = collections.OrderedDict()
+        for key, mask in group:
+            by_mask.setdefault(mask, []).append(key)
+        if not by_mask:
+            return
+        buckets.append((index, list(iteritems(by_mask))))
+    if not buckets:
+        return
+
+    buckets.sort(key=lambda b: len(b[1]))
+    order = [index for index, _ in buckets]
+    options = [opts for _, opts in buckets]
+    depth_max = len(options)
+    chosen = [None] * depth_max
+
+    def fits(occupied, depth):
+        for opts in options[depth:]:
+            if not any(not (mask & occupied) for mask, _ in opts):
+                return False
+        return True
+
+    def search(depth, occupied):
+        if depth == depth_max:
+            for keys in itertools.product(*chosen):
+                timetable = [None] * depth_max
+                for i, key in zip(order, keys):
+                    timetable[i] = key
+                yield tuple(timetable)
+            return
+
+        for mask, keys in options[depth]:
+            if mask & occupied:
+                continue
+            next_occupied = occupied | mask
+            if not fits(next_occupied, depth + 1):
+                continue
+            chosen[depth] = keys
+            for timetable in search(depth + 1, next_occupied):
+                yield timetable
+
+    for timetable in search(0, 0):
+        yield timetable
@@ -12,7 +12,37 @@ class Config(object):
     ASSETS_DEBUG = False
     DEBUG_TB_ENABLED = False  # Disable Debug toolbar
     DEBUG_TB_INTERCEPT_REDIRECTS = False
-    CACHE_TYPE = 'simple'  # Can be "memcached", "redis", etc.
+    # Can be "memcached", "redis", etc. Use a backend shared by all
+    # processes in order to share cached responses among them.
+    CACHE_TYPE = os_env.get('DASH_CACHE_TYPE', 'simple')
+    CACHE_KEY_PREFIX = 'dash:'
+    CACHE_DEFAULT_TIMEOUT = int(os_env.get('DASH_CACHE_DEFAULT_TIMEOUT', 3600))
+    CACHE_REDIS_URL = os_env.get('DASH_CACHE_REDIS_URL')
+    CACHE_MEMCACHED_SERVERS = \
+        os_env.get('DASH_CACHE_MEMCACHED_SERVERS', '').split() or None
+    # Seconds for which the latest catalog version is cached.
+    CATALOG_VERSION_TIMEOUT = 60
+    # Directory to which catalog snapshots of campuses are written.
+    CATALOG_SNAPSHOT_DIR = os_env.get(
+        'DASH_CATALOG_SNAPSHOT_DIR', os.path.join(PROJECT_ROOT, 'snapshots'))
+    # Whether catalogs are synced through staging tables. None means only
+    # on PostgreSQL. See dash.catalog.staging.
+    CATALOG_SYNC_STAGING = None
+    # Number of rows loaded into staging tables at once.
+    CATALOG_SYNC_BATCH_SIZE = 1000
+    # Seconds for which a sync waits for syncs of other campuses on
+    # SQLite. On PostgreSQL it waits until they are done. See
+    # dash.catalog.sync.lock.
+    CATALOG_SYNC_LOCK_TIMEOUT = 600
+    # Days for which changes of catalog versions are kept for the change
+    # feed.
+    CATALOG_CHANGES_RETENTION_DAYS = 30
+    # Whether responses carry numbers and durations of queries and time
+    # spent in marshalling in a Server-Timing header. See dash.timing.
+    SERVER_TIMING = os_env.get('DASH_SERVER_TIMING') == '1'
+    # Whether a line of JSON with the same numbers is logged for each
+    # request.
+    REQUEST_TIMING_LOG = os_env.get('DASH_REQUEST_TIMING_LOG') == '1'
 
 
 class ProdConfig(Config):
@@ -35,7 +65,7 @@ class DevConfig(Config):
     SQLALCHEMY_DATABASE_URI = 'sqlite:///{0}'.format(DB_PATH)
     DEBUG_TB_ENABLED = True
     ASSETS_DEBUG = True  # Don't bundle/minify static assets
-    CACHE_TYPE = 'simple'  # Can be "memcached", "redis", etc.
+    SERVER_TIMING = True
 
 
 class TestConfig(Config):
@@ -44,3 +74,4 @@ class TestConfig(Config):
     SQLALCHEMY_DATABASE_URI = 'sqlite://'
     BCRYPT_LOG_ROUNDS = 1  # For faster tests
     WTF_CSRF_ENABLED = False  # Allows form testing
+    CACHE_TYPE = 'simple'
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Per-request timing of database queries and marshalling.
+
+Resources of the catalog API easily slip into N+1 queries, e.g. by
+reading ``Course.departments`` through its association proxy or the lazy
+``Campus.departments`` of each entity while marshalling. The debug
+toolbar shows that only in development. Here statements executed during
+a request are counted and timed by engine events, and the time spent in
+marshalling is measured by :func:`timed`, so that every response
+carries them in a ``Server-Timing`` header::
+
+    Server-Timing: db;dur=12.4;desc="31 queries", marshal;dur=3.1,
+                   total;dur=18.0
+
+Durations are in milliseconds. Queries run while marshalling count in
+both ``db`` and ``marshal``. The header is sent if ``SERVER_TIMING`` is
+set, and a line of JSON is logged to the ``dash.timing`` logger for each
+request if ``REQUEST_TIMING_LOG`` is set.
+
+Bodies streamed as newline-delimited JSON are fetched and marshalled
+after the headers are sent, so the header of a streamed response only
+covers the work done before its body. The line logged for it is written
+when the response is closed, and covers the whole body.
+"""
+import contextlib
+import json
+import logging
+import timeit
+
+import sqlalchemy.event
+from flask import _request_ctx_stack, current_app, request
+from sqlalchemy.engine import Engine
+
+
+__all__ = ['Timing', 'current', 'timed', 'init_app']
+
+logger = logging.getLogger(__name__)
+
+_timer = timeit.default_timer
+
+
+class Timing(object):
+    """Numbers of a request. Durations are in seconds."""
+
+    def __init__(self):
+        self.start = _timer()
+        self.queries = 0
+        self.db = 0.0
+        self.marshal = 0.0
+
+    def total(self):
+        return _timer() - self.start
+
+    def header(self):
+        """Returns the value of ``Server-Timing``."""
+        return ('db;dur={0:.1f};desc="{1} queries", marshal;dur={2:.1f}, '
+                'total;dur={3:.1f}').format(self.db * 1e3, self.queries,
+                                            self.marshal * 1e3,
+                                            self.total() * 1e3)
+
+
+def current():
+    """Returns the :class:`Timing` of the current request, or None outside
+    requests.
+    """
+    ctx = _request_ctx_stack.top
+    return getattr(ctx, 'timing', None) if ctx is not None else None
+
+
+@contextlib.contextmanager
+def timed(name):
+    """Context manager which adds the time spent in it to an attribute of
+    the current :class:`Timing`, such as ``marshal``.
+    """
+    timing = current()
+    if timing is None:
+        yield
+        return
+    start = _timer()
+    try:
+        yield
+    finally:
+        setattr(timing, name, getattr(timing, name) + _timer() - start)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if current() is not None:
+        conn.info['timing_start'] = _timer()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    start = conn.info.pop('timing_start', None)
+    timing = current()
+    if timing is not None and start is not None:
+        timing.queries += 1
+        timing.db += _timer() - start
+
+
+def _begin():
+    _request_ctx_stack.top.timing = Timing()
+
+
+def _finish(response):
+    timing = current()
+    if timing is None:
+        return response
+    if current_app.config.get('SERVER_TIMING'):
+        response.headers['Server-Timing'] = timing.header()
+    if current_app.config.get('REQUEST_TIMING_LOG'):
+        line = {
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'status': response.status_code,
+        }
+        if response.is_streamed:
+            # The body is generated later in the same request context, by
+            # which its queries and marshalling are still timed.
+            response.call_on_close(lambda: _log(timing, line))
+        else:
+            _log(timing, line)
+    return response
+
+
+def _log(timing, line):
+    line = dict(line, queries=timing.queries,
+                db_ms=round(timing.db * 1e3, 1),
+                marshal_ms=round(timing.marshal * 1e3, 1),
+                total_ms=round(timing.total() * 1e3, 1))
+    logger.info(json.dumps(line, sort_keys=True))
+
+
+def init_app(app):
+    """Times requests of an app. Statements are timed on every engine,
+    including ones created after this is called.
+    """
+    if not sqlalchemy.event.contains(Engine, 'before_cursor_execute',
+                                     _before_cursor_execute):
+        sqlalchemy.event.listen(Engine, 'before_cursor_execute',
+                                _before_cursor_execute)
+        sqlalchemy.event.listen(Engine, 'after_cursor_execute',
+                                _after_cursor_execute)
+    if app.config.get('REQUEST_TIMING_LOG') and not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+        logger.setLevel(logging.INFO)
+    app.before_request(_begin)
+    app.after_request(_finish)
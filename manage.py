@@ -8,15 +8,17 @@ from flask.ext.script import Manager, Shell, Server
 from flask.ext.migrate import MigrateCommand
 
 from dash.app import create_app
-from dash.catalog.models import Campus
+from dash.catalog import batch, columnar, snapshot
+from dash.catalog.models import Campus, CatalogVersion
 from dash.user.models import User
 from dash.settings import DevConfig, ProdConfig
 from dash.database import db
 
 if os.environ.get("DASH_ENV") == 'prod':
-    app = create_app(ProdConfig)
+    config_object = ProdConfig
 else:
-    app = create_app(DevConfig)
+    config_object = DevConfig
+app = create_app(config_object)
 
 manager = Manager(app)
 TEST_CMD = "py.test tests"
@@ -38,11 +40,59 @@ def test():
 
 
 @manager.option('-c', '--code', dest='campus_code')
-def update_catalog(campus_code):
-    """Updates catalog of a campus using user-written scraper."""
+@manager.option('--codes', dest='campus_codes',
+                help='Comma-separated codes of campuses to update at once')
+@manager.option('-a', '--all', dest='all_campuses', action='store_true',
+                help='Update all campuses at once')
+@manager.option('-p', '--processes', dest='processes', type=int,
+                help='Number of campuses updated at once')
+def update_catalog(campus_code=None, campus_codes=None, all_campuses=False,
+                   processes=None):
+    """Updates catalog of a campus, or catalogs of several campuses at
+    once, using user-written scrapers.
+    """
+    if campus_code is not None:
+        campus = Campus.query.filter_by(code=campus_code)[0]
+        scraper = importlib.import_module(campus.scraper)
+        scraper.update(campus)
+        return
+    if all_campuses:
+        codes = [code for code, in
+                 db.session.query(Campus.code).order_by(Campus.id)]
+    elif campus_codes:
+        codes = [code.strip() for code in campus_codes.split(',')
+                 if code.strip()]
+    else:
+        print('Specify a campus with -c, --codes or --all')
+        return 1
+    results = batch.update_campuses(
+        codes,
+        '{0}.{1}'.format(config_object.__module__, config_object.__name__),
+        processes=processes)
+    for line in batch.summary(results):
+        print(line)
+    if not all(result.ok for result in results):
+        return 1
+
+
+@manager.option('-c', '--code', dest='campus_code')
+def write_snapshot(campus_code):
+    """Writes catalog snapshot of a campus at its latest version."""
+    campus = Campus.query.filter_by(code=campus_code)[0]
+    version = CatalogVersion.query.filter_by(campus=campus) \
+        .order_by(CatalogVersion.id.desc()).first()
+    if version is None:
+        print('No catalog version of campus {0}'.format(campus_code))
+        return 1
+    snapshot.write(campus, version.id)
+
+
+@manager.option('-c', '--code', dest='campus_code')
+@manager.option('-o', '--output', dest='path')
+def export_columnar(campus_code, path):
+    """Exports courses of a campus to a columnar binary file."""
     campus = Campus.query.filter_by(code=campus_code)[0]
-    scraper = importlib.import_module(campus.scraper)
-    scraper.update(campus)
+    columnar.export(campus, path)
 
 manager.add_command('server', Server())
 manager.add_command('shell', Shell(make_context=_make_context))
@@ -0,0 +1,45 @@
+"""Add indexes for course search
+
+Revision ID: 51c7e0b3a6d2
+Revises: 3f2a9c41d8e7
+Create Date: 2026-10-17 11:03:45.618220
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '51c7e0b3a6d2'
+down_revision = '3f2a9c41d8e7'
+
+from alembic import op
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute("CREATE INDEX ix_subjects_name_trgm ON subjects "
+                   "USING gin (name gin_trgm_ops)")
+        op.execute("CREATE INDEX ix_subjects_code_trgm ON subjects "
+                   "USING gin (code gin_trgm_ops)")
+        op.execute("CREATE INDEX ix_courses_instructor_trgm ON courses "
+                   "USING gin (instructor gin_trgm_ops)")
+    elif dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS course_search "
+                   "USING fts5(name, subject_code, instructor, "
+                   "tokenize='trigram')")
+        op.execute("INSERT INTO course_search "
+                   "(rowid, name, subject_code, instructor) "
+                   "SELECT courses.id, subjects.name, subjects.code, "
+                   "courses.instructor "
+                   "FROM courses JOIN subjects "
+                   "ON subjects.id = courses.subject_id")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.drop_index('ix_courses_instructor_trgm', table_name='courses')
+        op.drop_index('ix_subjects_code_trgm', table_name='subjects')
+        op.drop_index('ix_subjects_name_trgm', table_name='subjects')
+    elif dialect == 'sqlite':
+        op.execute("DROP TABLE IF EXISTS course_search")
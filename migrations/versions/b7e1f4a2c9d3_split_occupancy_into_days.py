@@ -0,0 +1,91 @@
+"""Split occupancy masks of courses into masks of days
+
+Revision ID: b7e1f4a2c9d3
+Revises: 8c3e5d1a7f20
+Create Date: 2026-10-18 09:21:54.730162
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b7e1f4a2c9d3'
+down_revision = '8c3e5d1a7f20'
+
+from alembic import op
+from sqlalchemy.sql import table, column, select
+import sqlalchemy as sa
+
+# Layout of occupancy masks at this revision, inlined so that this
+# migration does not change with dash.catalog.occupancy.
+DAYS_PER_WEEK = 7
+PERIODS_PER_DAY = 32
+HEX_DIGITS = DAYS_PER_WEEK * PERIODS_PER_DAY // 4
+DAY_COLUMNS = ['occupancy_{0}'.format(day) for day in range(DAYS_PER_WEEK)]
+
+
+def day_masks(mask):
+    masks = []
+    for day in range(DAYS_PER_WEEK):
+        day_mask = (mask >> (day * PERIODS_PER_DAY)) & 0xffffffff
+        if day_mask & 0x80000000:
+            day_mask -= 1 << 32
+        masks.append(int(day_mask))
+    return masks
+
+
+def from_day_masks(masks):
+    mask = 0
+    for day, day_mask in enumerate(masks):
+        mask |= (day_mask & 0xffffffff) << (day * PERIODS_PER_DAY)
+    return mask
+
+
+def upgrade():
+    for name in DAY_COLUMNS:
+        op.add_column('courses', sa.Column(name, sa.Integer(),
+                                           nullable=False,
+                                           server_default='0'))
+    courses = table('courses',
+                    column('id', sa.Integer),
+                    column('occupancy', sa.String),
+                    *[column(name, sa.Integer) for name in DAY_COLUMNS])
+    conn = op.get_bind()
+    params = [dict(zip(['_' + name for name in DAY_COLUMNS],
+                       day_masks(int(occupancy, 16))), _id=course_id)
+              for course_id, occupancy in conn.execute(
+                  select([courses.c.id, courses.c.occupancy])
+                  .where(courses.c.occupancy != '0' * HEX_DIGITS))]
+    if params:
+        conn.execute(courses.update()
+                     .where(courses.c.id == sa.bindparam('_id'))
+                     .values(dict((name, sa.bindparam('_' + name))
+                                  for name in DAY_COLUMNS)),
+                     params)
+    op.drop_index('ix_courses_occupancy', table_name='courses')
+    op.drop_column('courses', 'occupancy')
+
+
+def downgrade():
+    op.add_column('courses', sa.Column('occupancy',
+                                       sa.String(length=HEX_DIGITS),
+                                       nullable=False,
+                                       server_default='0' * HEX_DIGITS))
+    courses = table('courses',
+                    column('id', sa.Integer),
+                    column('occupancy', sa.String),
+                    *[column(name, sa.Integer) for name in DAY_COLUMNS])
+    conn = op.get_bind()
+    params = [{'_id': row[0],
+               '_occupancy': '{0:0{1}x}'.format(from_day_masks(row[1:]),
+                                                HEX_DIGITS)}
+              for row in conn.execute(
+                  select([courses.c.id] +
+                         [courses.c[name] for name in DAY_COLUMNS]))]
+    if params:
+        conn.execute(courses.update()
+                     .where(courses.c.id == sa.bindparam('_id'))
+                     .values(occupancy=sa.bindparam('_occupancy')),
+                     params)
+    op.create_index('ix_courses_occupancy', 'courses', ['occupancy'],
+                    unique=False)
+    for name in reversed(DAY_COLUMNS):
+        op.drop_column('courses', name)
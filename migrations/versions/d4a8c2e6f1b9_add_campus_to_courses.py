@@ -0,0 +1,48 @@
+"""Add campus to courses
+
+Revision ID: d4a8c2e6f1b9
+Revises: b7e1f4a2c9d3
+Create Date: 2026-10-18 11:42:07.316548
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'd4a8c2e6f1b9'
+down_revision = 'b7e1f4a2c9d3'
+
+from alembic import op
+from sqlalchemy.sql import table, column, select
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('courses', sa.Column('campus_id', sa.Integer(),
+                                       nullable=True))
+    op.create_foreign_key('fk_courses_campus_id', 'courses', 'campuses',
+                          ['campus_id'], ['id'])
+    op.create_index('ix_courses_campus_id', 'courses', ['campus_id'],
+                    unique=False)
+    # Courses with departments belong to the campus of their departments.
+    # Courses without departments are left to the next sync.
+    courses = table('courses',
+                    column('id', sa.Integer),
+                    column('campus_id', sa.Integer))
+    departments = table('departments',
+                        column('id', sa.Integer),
+                        column('campus_id', sa.Integer))
+    department_course = table('department_course',
+                              column('department_id', sa.Integer),
+                              column('course_id', sa.Integer))
+    op.execute(courses.update().values(
+        campus_id=select([sa.func.min(departments.c.campus_id)])
+        .select_from(department_course.join(
+            departments,
+            departments.c.id == department_course.c.department_id))
+        .where(department_course.c.course_id == courses.c.id)
+        .as_scalar()))
+
+
+def downgrade():
+    op.drop_index('ix_courses_campus_id', table_name='courses')
+    op.drop_constraint('fk_courses_campus_id', 'courses', type_='foreignkey')
+    op.drop_column('courses', 'campus_id')
@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
 """Defines fixtures available to all tests."""
 import os
+import threading
+import time
 
 import pytest
+from six.moves import BaseHTTPServer, socketserver
 from webtest import TestApp
 
 from dash.settings import TestConfig
 from dash.app import create_app
 from dash.database import db as _db
+from dash.catalog import conflicts, search
 
 from .factories import (
     UserFactory,
@@ -22,8 +26,9 @@ from .factories import (
 
 
 @pytest.yield_fixture(scope='function')
-def app():
+def app(tmpdir):
     _app = create_app(TestConfig)
+    _app.config['CATALOG_SNAPSHOT_DIR'] = str(tmpdir.join('snapshots'))
     ctx = _app.test_request_context()
     ctx.push()
 
@@ -38,6 +43,12 @@ def testapp(app):
     return TestApp(app)
 
 
+@pytest.fixture(scope='function')
+def server_timing(app):
+    """Sends the Server-Timing header, by which tests count queries."""
+    app.config['SERVER_TIMING'] = True
+
+
 @pytest.yield_fixture(scope='function')
 def db(app):
     _db.app = app
@@ -47,6 +58,72 @@ def db(app):
     yield _db
 
     _db.drop_all()
+    conflicts.discard()
+
+
+class StandInServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """A local HTTP server which stands in for data sources of scrapers.
+
+    Responses are given by functions in :attr:`routes` by path, which take
+    the request handler and return a tuple of status, a dict of headers
+    and a body. The handler has the body of the request in ``body``.
+    Requests are recorded in :attr:`log` as tuples of path, client port and
+    time.
+    """
+    daemon_threads = True
+    # Many workers of a fetcher connect at once.
+    request_queue_size = 64
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           StandInHandler)
+        self.routes = {}
+        self.log = []
+        self.url = 'http://127.0.0.1:{0}'.format(self.server_address[1])
+
+    def requests_to(self, path):
+        return [entry for entry in self.log if entry[0] == path]
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length)
+        path = self.path.split('?', 1)[0]
+        self.server.log.append((path, self.client_address[1], time.time()))
+        route = self.server.routes.get(path)
+        if route is None:
+            status, headers, body = 404, {}, b'not found'
+        else:
+            status, headers, body = route(self)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.yield_fixture
+def http_server():
+    """A :class:`StandInServer` running in a thread."""
+    server = StandInServer()
+    thread = threading.Thread(target=server.serve_forever,
+                              kwargs={'poll_interval': 0.01})
+    thread.daemon = True
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
 
 
 @pytest.fixture
@@ -507,5 +584,9 @@ def courses(db, departments, subjects, gen_edu_categories):
         course=c,
     )
 
+    for c in _courses:
+        c.update_occupancy()
+    db.session.flush()
+    search.reindex()
     db.session.commit()
     return _courses
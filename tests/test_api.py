@@ -1,15 +1,25 @@
 # -*- coding: utf-8 -*-
 import collections
 import itertools
+import json
 import pytest
 import dateutil.parser
 from six import text_type as unicode
 from six.moves.urllib import parse
 from functools import reduce
+from dash.catalog import api, search, streaming
+from dash.catalog.caching import publish_catalog_version
+from dash.catalog.models import CatalogVersion, CourseClass
+from dash.catalog.occupancy import classes_mask, to_hex
 from dash.compat import UnicodeMixin
 from .factories import CourseFactory
 
 
+def bump_catalog_version(campus):
+    version = CatalogVersion(campus=campus).save()
+    publish_catalog_version(version.id)
+
+
 class Url(UnicodeMixin):
 
     def __init__(self, entity_name, entity_id=None, prefix=u""):
@@ -194,6 +204,118 @@ class TestCatalogEntityApi(object):
                 map(cls.assert_entity, expected_objs, result_objs)
 
 
+    @classmethod
+    def walk_cursor(cls, testapp, url, results_per_page):
+        """Walks through pages of a collection with cursor tokens, and
+        returns the objects of all pages.
+        """
+        objs = []
+        token = u''
+        while token is not None:
+            resp = testapp.get(url.query(after=token,
+                                         results_per_page=results_per_page))
+            cls.assert_response(resp)
+            assert 'num_results' not in resp.json
+            assert len(resp.json['objects']) <= results_per_page
+            objs.extend(resp.json['objects'])
+            token = resp.json['next']
+        return objs
+
+
+class TestConditionalGet(object):
+
+    @pytest.mark.parametrize('url', [
+        '/api/campuses',
+        '/api/campuses/1',
+        '/api/departments',
+        '/api/campuses/1/departments',
+        '/api/gen_edu_categories',
+        '/api/subjects?page=1',
+        '/api/courses?name=understanding',
+        '/api/courses/1',
+    ])
+    def test_etag(self, campuses, courses, testapp, url):
+        resp = testapp.get(url)
+        etag = resp.headers['ETag']
+        assert etag.startswith('"')
+
+        resp = testapp.get(url, headers={'If-None-Match': etag}, status=304)
+        assert resp.headers['ETag'] == etag
+        assert not resp.body
+
+        resp = testapp.get(url, headers={'If-None-Match': '"other"'})
+        assert resp.headers['ETag'] == etag
+
+        bump_catalog_version(campuses[0])
+        resp = testapp.get(url, headers={'If-None-Match': etag})
+        assert resp.status_code == 200
+        assert resp.headers['ETag'] != etag
+
+    def test_etag_depends_on_args(self, courses, testapp):
+        etag1 = testapp.get('/api/courses?page=1').headers['ETag']
+        etag2 = testapp.get('/api/courses?page=2', status=404) \
+            .headers.get('ETag')
+        etag3 = testapp.get('/api/courses?count=false').headers['ETag']
+        assert etag2 is None
+        assert etag1 != etag3
+
+
+class TestStreaming(object):
+
+    headers = {'Accept': streaming.MIMETYPE}
+
+    @pytest.fixture(autouse=True)
+    def small_batches(self, monkeypatch):
+        monkeypatch.setattr(api.Collection, 'batch_size', 3)
+
+    @classmethod
+    def get_lines(cls, testapp, url):
+        resp = testapp.get(url, headers=cls.headers)
+        assert resp.status_code == 200
+        assert resp.content_type == streaming.MIMETYPE
+        text = resp.body.decode('utf-8')
+        assert text == '' or text.endswith('\n')
+        return [json.loads(line) for line in text.splitlines()]
+
+    @pytest.mark.parametrize('url', [
+        '/api/campuses',
+        '/api/departments',
+        '/api/campuses/1/departments',
+        '/api/gen_edu_categories',
+        '/api/courses?results_per_page=1000',
+        '/api/courses?results_per_page=5&page=2',
+        '/api/courses?results_per_page=3&page=2',
+        '/api/courses?name=understanding',
+        '/api/subjects?results_per_page=7&page=2',
+    ])
+    def test_same_objects_as_json(self, courses, testapp, url):
+        objects = testapp.get(url).json['objects']
+        assert objects
+        assert self.get_lines(testapp, url) == objects
+
+    def test_page_past_last(self, courses, testapp):
+        url = '/api/courses?results_per_page=20&page=2'
+        testapp.get(url, status=404)
+        assert self.get_lines(testapp, url) == []
+
+    def test_json_preferred(self, courses, testapp):
+        resp = testapp.get('/api/campuses', headers={
+            'Accept': 'application/json, {0};q=0.5'.format(streaming.MIMETYPE),
+        })
+        assert resp.content_type == 'application/json'
+
+    def test_etag_depends_on_representation(self, courses, testapp):
+        resp_json = testapp.get('/api/courses')
+        resp_ndjson = testapp.get('/api/courses', headers=self.headers)
+        assert resp_json.headers['Vary'] == 'Accept'
+        assert resp_ndjson.headers['Vary'] == 'Accept'
+        assert resp_json.headers['ETag'] != resp_ndjson.headers['ETag']
+
+        headers = dict(self.headers,
+                       **{'If-None-Match': resp_ndjson.headers['ETag']})
+        testapp.get('/api/courses', headers=headers, status=304)
+
+
 class TestCampusApi(TestCatalogEntityApi):
 
     base_url = Url('campuses', prefix="/api")   # "/api/campuses"
@@ -274,6 +396,15 @@ class TestSubjectApi(TestCatalogEntityApi):
         map(self.assert_entity, subjects, objects)
 
 
+    def test_get_subjects_with_cursor(self, subjects, testapp):
+        objs = self.walk_cursor(testapp, self.base_url, 5)
+        assert [o['id'] for o in objs] == sorted(s.id for s in subjects)
+
+    def test_get_subjects_with_bad_cursor(self, subjects, testapp):
+        testapp.get(self.base_url.query(after=u'not a cursor'), status=400)
+        testapp.get(self.base_url.query(after=u'ImEi'), status=400)
+
+
 class TestGenEduCategoryApi(TestCatalogEntityApi):
 
     base_url = Url('gen_edu_categories', prefix="/api")
@@ -336,6 +467,7 @@ class TestCourseApi(TestCatalogEntityApi):
             TestGenEduCategoryApi.assert_entity(entity.gen_edu_category,
                                                 json['category'])
         assert json['target_grade'] == entity.target_grade
+        assert int(json['occupancy'], 16) == entity.occupancy
 
     @staticmethod
     def entity_test_under_campus(entity, campus):
@@ -367,6 +499,74 @@ class TestCourseApi(TestCatalogEntityApi):
         db.session.commit()
         self.collection_test_under_campuses(campuses, courses, testapp)
 
+    def test_paging_get_courses_with_cursor(self, campuses, departments,
+                                            db, testapp):
+        n_deps = len(departments)
+        for i in range(50):
+            CourseFactory(departments=[departments[i % n_deps]])
+        db.session.commit()
+
+        for campus in campuses:
+            url = TestCampusApi.base_url.ent(campus.id) \
+                .append(self.base_url)
+            expected = self.get_all_ids(testapp, url)
+            assert len(expected) > 10
+            objs = self.walk_cursor(testapp, url, 7)
+            assert [o['id'] for o in objs] == expected
+
+    def test_search_courses_with_cursor(self, courses, testapp):
+        url = self.base_url.query(name='understanding')
+        objs = self.walk_cursor(testapp, url, 3)
+        assert set(o['code'] for o in objs) == set([
+            "10037", "15254", "15002", "11543", "11970", "22294", "22361",
+            "20025"])
+
+    @classmethod
+    def get_all_ids(cls, testapp, url):
+        resp = testapp.get(url.query(results_per_page=1000))
+        return [o['id'] for o in resp.json['objects']]
+
+    def test_get_courses_without_count(self, courses, testapp):
+        resp = testapp.get(self.base_url.query(count='false',
+                                               results_per_page=5, page=2))
+        self.assert_response(resp)
+        assert 'num_results' not in resp.json
+        assert 'num_pages' not in resp.json
+        assert resp.json['page'] == 2
+        assert [o['id'] for o in resp.json['objects']] == \
+            sorted(c.id for c in courses)[5:10]
+
+    def test_get_courses_count_cached(self, campuses, courses, db, testapp):
+        url = self.base_url.query(results_per_page=2, instructor='sunny')
+        resp = testapp.get(url)
+        assert resp.json['num_results'] == 3
+
+        # Counts are kept until catalog version is changed.
+        CourseFactory(instructor='Sunny Yoon', departments=[])
+        db.session.flush()
+        search.reindex()
+        db.session.commit()
+        resp = testapp.get(url.query(page=2))
+        assert len(resp.json['objects']) == 2
+        assert resp.json['num_results'] == 3
+
+        bump_catalog_version(campuses[0])
+        assert testapp.get(url).json['num_results'] == 4
+
+    def test_get_course_cached(self, campuses, courses, db, testapp):
+        course = courses[0]
+        url = self.base_url.ent(course.id)
+        instructor = course.instructor
+        assert testapp.get(url).json['instructor'] == instructor
+
+        # Responses are kept until catalog version is changed.
+        course.instructor = 'Someone Else'
+        db.session.commit()
+        assert testapp.get(url).json['instructor'] == instructor
+
+        bump_catalog_version(campuses[0])
+        assert testapp.get(url).json['instructor'] == 'Someone Else'
+
     @pytest.mark.parametrize("name,codes_from_name", [
         ("understanding",
          frozenset(["10037", "15254", "15002", "11543", "11970", "22294",
@@ -435,3 +635,265 @@ class TestCourseApi(TestCatalogEntityApi):
             campuses, selected_courses_all, testapp,
             url_processors=[process_search_options],
             )
+
+    @pytest.mark.parametrize("occupied,free", [
+        ([(1, 5, 8)], None),
+        ([(3, 15, 15), (0, 0, 31)], None),
+        (None, [(d, 0, 31) for d in (0, 1, 2)]),
+        ([(2, 11, 11)], [(d, 0, 31) for d in (2, 3, 4)]),
+        (None, []),
+    ])
+    def test_search_courses_fit_free_time(self, campuses, courses, testapp,
+                                          occupied, free):
+        def to_classes(slots):
+            return [CourseClass(day_of_week=d, start_period=s, end_period=e)
+                    for d, s, e in slots]
+
+        def fits(course):
+            for c in course.classes:
+                if occupied and any(c.conflicts_with(o)
+                                    for o in to_classes(occupied)):
+                    return False
+                if free is not None and not any(
+                        c.day_of_week == f.day_of_week and
+                        f.start_period <= c.start_period and
+                        c.end_period <= f.end_period
+                        for f in to_classes(free)):
+                    return False
+            return True
+
+        def process_free_time(url):
+            if occupied is not None:
+                url = url.query(occupied=to_hex(
+                    classes_mask(to_classes(occupied))))
+            if free is not None:
+                url = url.query(free=to_hex(classes_mask(to_classes(free))))
+            return url
+
+        self.collection_test_under_campuses(
+            campuses, [c for c in courses if fits(c)], testapp,
+            url_processors=[process_free_time],
+            )
+
+    def test_search_courses_bad_free_time(self, courses, testapp):
+        testapp.get(self.base_url.query(occupied='xyz'), status=400)
+        testapp.get(self.base_url.query(free='f' * 57), status=400)
+
+    def test_fits_filter_criterion(self):
+        Course = api.models.Course
+        criterion = api.fits_filter_criterion(
+            Course, classes_mask(CourseClass(day_of_week=d, start_period=0,
+                                             end_period=31)
+                                 for d in (0, 3)))
+        compiled = criterion.compile()
+        assert sorted(compiled.params.values()) == [-1, -1, 0, 0]
+        assert 'occupancy_0 & ' in str(compiled)
+        assert 'occupancy_3 & ' in str(compiled)
+
+    def test_search_courses_fit_empty(self, campuses, courses, testapp):
+        resp = testapp.get(self.base_url.query(occupied='0'))
+        assert resp.json['num_results'] == len(courses)
+
+
+@pytest.mark.usefixtures('server_timing')
+class TestBatchFetch(object):
+
+    def test_get_ids(self, campuses, courses, testapp):
+        ids = [courses[3].id, courses[0].id, courses[5].id, 99999]
+        resp = testapp.get('/api/courses',
+                           {'ids': ','.join(str(i) for i in ids)})
+        # Courses are in the order of ids, and missing ones are omitted.
+        assert [o['id'] for o in resp.json['objects']] == ids[:3]
+        assert 'page' not in resp.json
+        expected = testapp.get(
+            '/api/courses/{0}'.format(courses[0].id)).json
+        assert expected in resp.json['objects']
+
+        # Other filters still apply.
+        campus = campuses[0]
+        resp = testapp.get('/api/campuses/{0}/courses'.format(campus.id),
+                           {'ids': ','.join(str(c.id) for c in courses)})
+        assert [o['id'] for o in resp.json['objects']] == [
+            c.id for c in courses
+            if any(d.campus_id == campus.id for d in c.departments)]
+
+    def test_get_ids_streamed(self, courses, testapp):
+        ids = [courses[2].id, courses[1].id, courses[2].id]
+        resp = testapp.get('/api/courses',
+                           {'ids': ','.join(str(i) for i in ids)},
+                           headers={'Accept': streaming.MIMETYPE})
+        assert [json.loads(line)['id']
+                for line in resp.text.splitlines()] == ids[:2]
+
+    def test_get_ids_in_one_query(self, courses, testapp):
+        def queries(ids):
+            resp = testapp.get('/api/courses', {
+                'ids': ','.join(str(c.id) for c in ids)})
+            return int(resp.headers['Server-Timing']
+                       .split('desc="', 1)[1].split(' ', 1)[0])
+        queries(courses[:1])
+        assert queries(courses[:2]) == queries(courses[:10])
+
+    def test_get_no_ids(self, courses, testapp):
+        resp = testapp.get('/api/courses', {'ids': ''})
+        assert resp.json == {'objects': []}
+
+    def test_get_bad_ids(self, courses, testapp):
+        testapp.get('/api/courses', {'ids': '1,x'}, status=400)
+        testapp.get('/api/courses', {'ids': ','.join(
+            str(i) for i in range(api.CourseList.max_ids + 1))}, status=400)
+
+
+@pytest.mark.usefixtures('server_timing')
+class TestFieldSelection(object):
+
+    @staticmethod
+    def queries(resp):
+        timing = resp.headers['Server-Timing']
+        return int(timing.split('desc="', 1)[1].split(' ', 1)[0])
+
+    def test_fields(self, courses, testapp):
+        resp = testapp.get('/api/courses',
+                           {'fields': 'id,instructor,subject.name'})
+        by_id = dict((c.id, c) for c in courses)
+        assert resp.json['objects']
+        for obj in resp.json['objects']:
+            course = by_id[obj['id']]
+            assert obj == {'id': course.id,
+                           'instructor': course.instructor,
+                           'subject': {'name': course.subject.name}}
+
+        resp = testapp.get('/api/courses/{0}'.format(courses[0].id),
+                           {'fields': 'code,departments.code'})
+        assert resp.json == {
+            'code': courses[0].code,
+            'departments': [{'code': d.code}
+                            for d in courses[0].departments],
+        }
+
+    def test_expand(self, courses, testapp):
+        plain = set(api.course_fields) - set(api.CourseList.relationships)
+        resp = testapp.get('/api/courses', {'expand': 'classes'})
+        for obj in resp.json['objects']:
+            assert set(obj) == plain | set(['classes'])
+        resp = testapp.get('/api/courses', {'expand': ''})
+        for obj in resp.json['objects']:
+            assert set(obj) == plain
+        resp = testapp.get('/api/campuses', {'expand': ''})
+        for obj in resp.json['objects']:
+            assert 'departments' not in obj
+        resp = testapp.get('/api/courses',
+                           {'fields': 'id', 'expand': 'subject'})
+        for obj in resp.json['objects']:
+            assert set(obj) == set(['id', 'subject'])
+
+    def test_unknown(self, courses, testapp):
+        testapp.get('/api/courses', {'fields': 'id,nothing'}, status=400)
+        testapp.get('/api/courses', {'fields': 'code.x'}, status=400)
+        testapp.get('/api/courses', {'expand': 'code'}, status=400)
+        testapp.get('/api/subjects/1', {'expand': 'code'}, status=400)
+
+    def test_fewer_queries(self, courses, testapp):
+        args = {'count': 'false', 'results_per_page': 100}
+        testapp.get('/api/courses', args)
+        full = self.queries(testapp.get('/api/courses',
+                                        dict(args, type='major')))
+        narrow = self.queries(testapp.get(
+            '/api/courses', dict(args, type='major',
+                                 fields='id,code,instructor')))
+        assert narrow == full - 2
+
+    def test_search_without_subject(self, courses, testapp):
+        expected = set(o['code'] for o in testapp.get(
+            '/api/courses', {'name': 'understanding'}).json['objects'])
+        assert expected
+        resp = testapp.get('/api/courses', {'name': 'understanding',
+                                            'fields': 'code'})
+        assert set(o['code'] for o in resp.json['objects']) == expected
+
+
+class TestTimetableApi(object):
+
+    def get_course_ids(self, testapp, url, status=200):
+        resp = testapp.get(url, status=status)
+        if status != 200:
+            return None
+        assert resp.content_type == 'application/json'
+        return sorted(tuple(o['course_ids']) for o in resp.json['objects'])
+
+    def test_get_timetables_by_subjects(self, courses, testapp):
+        # Understanding Patent Law, Media Criticism
+        assert self.get_course_ids(testapp,
+                                   '/api/timetables?subject_id=1'
+                                   '&subject_id=2') == [(1, 3), (2, 3)]
+
+    def test_get_timetables_with_course(self, courses, testapp):
+        # Signals and Systems (11615) conflicts with Dynamics in the Korean
+        # Language (22291).
+        assert self.get_course_ids(testapp,
+                                   '/api/timetables?course_id=7'
+                                   '&subject_id=10') == []
+        assert self.get_course_ids(testapp,
+                                   '/api/timetables?course_id=7'
+                                   '&subject_id=1') == [(7, 1), (7, 2)]
+
+    def test_get_timetables_course_overrides_subject(self, courses, testapp):
+        assert self.get_course_ids(testapp,
+                                   '/api/timetables?course_id=2'
+                                   '&subject_id=1') == [(2,)]
+
+    def test_get_timetables_under_campus(self, campuses, courses, testapp):
+        # Courses of Understanding Patent Law are opened in HYU Seoul.
+        url = '/api/campuses/{0}/timetables?subject_id=1'
+        assert self.get_course_ids(testapp, url.format(campuses[0].id)) == \
+            [(1,), (2,)]
+        assert self.get_course_ids(testapp, url.format(campuses[1].id)) == []
+
+    def test_get_timetables_truncated(self, courses, testapp):
+        resp = testapp.get('/api/timetables?subject_id=1&limit=1')
+        assert len(resp.json['objects']) == 1
+        assert resp.json['truncated'] is True
+
+    def test_get_timetables_bad_request(self, courses, testapp):
+        self.get_course_ids(testapp, '/api/timetables', status=400)
+        self.get_course_ids(testapp, '/api/timetables?course_id=999',
+                            status=404)
+
+
+class TestCourseConflictApi(object):
+
+    def test_get_course_conflicts(self, campuses, courses, testapp):
+        hyu_seoul = campuses[0]
+        # Understanding The Chinese Literature (15002) conflicts with
+        # Understanding Patent Law (15254).
+        course = courses[4]
+        resp = testapp.get('/api/campuses/{0}/courses/{1}/conflicts'
+                           .format(hyu_seoul.id, course.id))
+        assert resp.content_type == 'application/json'
+        assert resp.json == {'course_id': course.id,
+                             'conflicts': [courses[1].id]}
+
+        # Understanding Patent Law (10037) conflicts with no course.
+        course = courses[0]
+        resp = testapp.get('/api/campuses/{0}/courses/{1}/conflicts'
+                           .format(hyu_seoul.id, course.id))
+        assert resp.json['conflicts'] == []
+
+    def test_get_course_conflicts_not_in_campus(self, campuses, courses,
+                                                testapp):
+        hyu_erica = campuses[1]
+        testapp.get('/api/campuses/{0}/courses/{1}/conflicts'
+                    .format(hyu_erica.id, courses[0].id), status=404)
+
+    def test_get_conflicts_of_courses(self, campuses, courses, testapp):
+        hyu_erica = campuses[1]
+        # Understanding Middle East and Islamic World (22361) conflicts with
+        # Dynamics in the Korean Language (22291).
+        resp = testapp.get('/api/campuses/{0}/conflicts?course_id={1}'
+                           '&course_id={2}'
+                           .format(hyu_erica.id, courses[8].id,
+                                   courses[9].id))
+        assert resp.json == {'objects': [
+            {'course_id': courses[8].id, 'conflicts': []},
+            {'course_id': courses[9].id, 'conflicts': [courses[10].id]},
+        ]}
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Tests for updating catalogs of several campuses at once."""
+import sys
+import types
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from dash.catalog import batch, sync
+from dash.catalog.models import Campus, Course, Department, Subject
+from dash.catalog.scraper import update_catalog
+from dash.database import db as _db
+from .factories import CampusFactory
+from .test_scraper import (
+    catalog_spec,
+    hold_catalog,
+    normalized,
+    snapshot_of_campus,
+)
+
+CONFIG_OBJECT = 'dash.settings.TestConfig'
+
+
+@pytest.yield_fixture
+def app(app, tmpdir):
+    # Processes updating campuses do not share an in-memory database.
+    app.config['SQLALCHEMY_DATABASE_URI'] = \
+        'sqlite:///' + str(tmpdir.join('dash.db'))
+    yield app
+
+
+def spec_of(prefix):
+    spec = catalog_spec()
+    spec['departments'] = dict((prefix + code, name) for code, name
+                               in spec['departments'].items())
+    spec['subjects'] = dict((prefix + code, name) for code, name
+                            in spec['subjects'].items())
+    spec['categories'] = dict((prefix + code, name) for code, name
+                              in spec['categories'].items())
+    spec['courses'] = [
+        (prefix + code, prefix + subject, category and prefix + category,
+         [prefix + d for d in dept_codes], instructor, classes)
+        for code, subject, category, dept_codes, instructor, classes
+        in spec['courses']]
+    return spec
+
+
+def syncing(campus):
+    with update_catalog(campus) as catalog:
+        hold_catalog(catalog, spec_of(campus.code))
+
+
+def syncing_shared(campus):
+    # Every campus holds the same codes.
+    with update_catalog(campus) as catalog:
+        hold_catalog(catalog, catalog_spec())
+
+
+def failing(campus):
+    _db.session.add(Department(code='X', name='Partial', campus=campus))
+    _db.session.flush()
+    raise RuntimeError('source is down')
+
+
+@pytest.fixture
+def scrapers(monkeypatch):
+    """Installs scraper modules of campuses, which are inherited by the
+    processes updating them.
+    """
+    def install(campus, update):
+        name = str(campus.scraper)
+        # Python 2 imports the parent package first.
+        package = name.rpartition('.')[0]
+        if package not in sys.modules:
+            monkeypatch.setitem(sys.modules, package,
+                                types.ModuleType(package))
+        module = types.ModuleType(name)
+        module.update = update
+        monkeypatch.setitem(sys.modules, name, module)
+    return install
+
+
+@pytest.mark.usefixtures('db')
+class TestUpdateCampuses(object):
+
+    def test_update(self, db, scrapers):
+        campuses = [CampusFactory(), CampusFactory(), CampusFactory()]
+        db.session.commit()
+        codes = [campus.code for campus in campuses]
+        scrapers(campuses[0], syncing)
+        scrapers(campuses[1], failing)
+        scrapers(campuses[2], syncing)
+
+        results = batch.update_campuses(codes + ['NOSUCH'], CONFIG_OBJECT,
+                                        processes=2)
+
+        assert [r.code for r in results] == codes + ['NOSUCH']
+        assert [r.ok for r in results] == [True, False, True, False]
+        assert results[1].error == 'RuntimeError: source is down'
+        assert results[3].error == 'no such campus'
+        for code in (codes[0], codes[2]):
+            campus = Campus.query.filter_by(code=code).one()
+            assert sorted(d.code for d in campus.departments) == \
+                [code + d for d in ('D1', 'D2', 'D3')]
+            assert Course.query.filter_by(code=code + 'C4').count() == 1
+        # The failed campus is rolled back.
+        assert Department.query.filter_by(code='X').count() == 0
+
+    def test_update_shared_codes(self, db, scrapers):
+        campuses = [CampusFactory(), CampusFactory(), CampusFactory()]
+        db.session.commit()
+        for campus in campuses:
+            scrapers(campus, syncing_shared)
+
+        codes = [campus.code for campus in campuses]
+
+        results = batch.update_campuses(codes, CONFIG_OBJECT, processes=3)
+
+        assert [r.ok for r in results] == [True, True, True]
+        for code in codes:
+            campus = Campus.query.filter_by(code=code).one()
+            assert normalized(snapshot_of_campus(campus)) == \
+                normalized(catalog_spec())
+        # Shared subjects are stored once, and courses once per campus.
+        assert Subject.query.count() == 3
+        assert Course.query.filter_by(code='C4').count() == 3
+
+    def test_lock(self, app, db):
+        app.config['CATALOG_SYNC_LOCK_TIMEOUT'] = 0.1
+        first = db.engine.connect()
+        second = db.engine.connect()
+        try:
+            with first.begin():
+                sync.lock(first)
+                with pytest.raises(OperationalError):
+                    with second.begin():
+                        sync.lock(second)
+            with second.begin():
+                sync.lock(second)
+        finally:
+            first.close()
+            second.close()
+
+    def test_update_nothing(self):
+        assert batch.update_campuses([], CONFIG_OBJECT) == []
+
+
+def test_summary():
+    lines = batch.summary([
+        batch.Result('H0002256', 12.34, None),
+        batch.Result('Y1', 3.0, 'RuntimeError: source is down'),
+    ])
+    assert lines == [
+        'H0002256  ok         12.3s',
+        'Y1        failed      3.0s  RuntimeError: source is down',
+        '1 campuses updated, 1 failed',
+    ]
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Tests for the change feed of catalog."""
+import datetime
+
+import pytest
+
+from dash.catalog import changes
+from dash.catalog.models import (
+    CatalogChange,
+    CatalogVersion,
+    Course,
+    Department,
+    Subject,
+)
+from dash.catalog.scraper import update_catalog
+from dash.utils import utcnow
+from .factories import CampusFactory
+from .test_scraper import catalog_spec, hold_catalog
+
+
+def ids_by_code(model, codes):
+    return sorted(e.id for e in model.query.filter(model.code.in_(codes)))
+
+
+def empty_ids():
+    return dict((entity, dict((op, []) for op in changes.OPERATIONS))
+                for entity in changes.ENTITIES)
+
+
+@pytest.mark.usefixtures('db')
+class TestChanges(object):
+
+    @pytest.fixture(params=[False, True], ids=['sync', 'staging'])
+    def campus(self, request, app, db):
+        app.config['CATALOG_SYNC_STAGING'] = request.param
+        campus = CampusFactory()
+        db.session.commit()
+        return campus
+
+    @staticmethod
+    def sync(campus, spec):
+        with update_catalog(campus) as catalog:
+            hold_catalog(catalog, spec)
+        return catalog
+
+    @staticmethod
+    def changed_spec():
+        spec = catalog_spec()
+        del spec['departments']['D2']
+        spec['subjects']['S1'] = 'Algorithms and Data Structures'
+        del spec['subjects']['S2']
+        spec['courses'] = [
+            ('C1', 'S1', None, ['D1'], 'Kim', [(0, 1, 2), (4, 1, 2)]),
+            ('C2', 'S1', None, ['D1'], 'Lee', [(1, 3, 4)]),
+            ('C4', 'S3', 'G1', ['D3'], 'Choi', []),
+            ('C5', 'S3', 'G1', ['D1', 'D3'], 'Jung', [(5, 0, 0)]),
+        ]
+        return spec
+
+    def test_record(self, campus):
+        self.sync(campus, catalog_spec())
+        version, ids = changes.since(0)
+        assert version == 1
+        assert ids['courses'] == {
+            'created': ids_by_code(Course, ['C1', 'C2', 'C3', 'C4']),
+            'updated': [],
+            'deleted': [],
+        }
+        assert ids['departments']['created'] == \
+            ids_by_code(Department, ['D1', 'D2', 'D3'])
+
+        old_ids = dict((c.code, c.id) for c in Course.query)
+        old_department_ids = dict((d.code, d.id) for d in Department.query)
+        old_subject_ids = dict((s.code, s.id) for s in Subject.query)
+        self.sync(campus, self.changed_spec())
+        version, ids = changes.since(1)
+        assert version == 2
+        # C1 has a changed class, and C2 has a removed department.
+        assert ids['courses'] == {
+            'created': ids_by_code(Course, ['C5']),
+            'updated': sorted([old_ids['C1'], old_ids['C2']]),
+            'deleted': [old_ids['C3']],
+        }
+        assert ids['departments'] == {
+            'created': [], 'updated': [],
+            'deleted': [old_department_ids['D2']],
+        }
+        assert ids['subjects'] == {
+            'created': [],
+            'updated': [old_subject_ids['S1']],
+            'deleted': [old_subject_ids['S2']],
+        }
+        assert ids['gen_edu_categories'] == \
+            empty_ids()['gen_edu_categories']
+
+    def test_unchanged_records_nothing(self, campus):
+        self.sync(campus, catalog_spec())
+        count = CatalogChange.query.count()
+        self.sync(campus, catalog_spec())
+        assert CatalogChange.query.count() == count
+        assert changes.since(1) == (1, empty_ids())
+
+    def test_since_merges_versions(self, campus):
+        self.sync(campus, catalog_spec())
+        old_c3_id = ids_by_code(Course, ['C3'])
+        self.sync(campus, self.changed_spec())
+        c5_id = ids_by_code(Course, ['C5'])
+        self.sync(campus, catalog_spec())
+
+        _, ids = changes.since(0)
+        assert ids['courses'] == {
+            'created': ids_by_code(Course, ['C1', 'C2', 'C3', 'C4']),
+            'updated': [],
+            'deleted': [],
+        }
+        # C5 was created and deleted, and C3 was deleted and created
+        # again.
+        _, ids = changes.since(1)
+        assert ids['courses']['created'] == ids_by_code(Course, ['C3'])
+        assert ids['courses']['deleted'] == old_c3_id
+        assert c5_id[0] not in sum(ids['courses'].values(), [])
+
+    def test_since_unknown_version(self, campus):
+        self.sync(campus, catalog_spec())
+        with pytest.raises(ValueError):
+            changes.since(2)
+        with pytest.raises(ValueError):
+            changes.since(-1)
+
+    def test_prune(self, campus, db):
+        self.sync(campus, catalog_spec())
+        self.sync(campus, self.changed_spec())
+        version = CatalogVersion.query.get(1)
+        version.created_at = utcnow() - datetime.timedelta(days=31)
+        db.session.commit()
+
+        assert changes.prune() > 0
+        db.session.commit()
+        assert CatalogChange.query.filter_by(version_id=1).count() == 0
+        with pytest.raises(changes.Expired):
+            changes.since(0)
+        assert changes.since(1)[0] == 2
+
+
+@pytest.mark.usefixtures('db')
+class TestChangesApi(object):
+
+    @pytest.fixture
+    def campus(self, db):
+        campus = CampusFactory()
+        db.session.commit()
+        with update_catalog(campus) as catalog:
+            hold_catalog(catalog, catalog_spec())
+        return campus
+
+    def test_get(self, campus, testapp):
+        resp = testapp.get('/api/catalog/changes', {'since': 0})
+        assert resp.json['since'] == 0
+        assert resp.json['version'] == 1
+        assert resp.json['changes']['courses']['created'] == \
+            sorted(c.id for c in Course.query)
+        assert 'ETag' in resp.headers
+
+        resp = testapp.get('/api/catalog/changes', {'since': 1})
+        assert resp.json['changes'] == empty_ids()
+
+    def test_get_bad_version(self, campus, testapp):
+        testapp.get('/api/catalog/changes', status=400)
+        testapp.get('/api/catalog/changes', {'since': 'x'}, status=400)
+        testapp.get('/api/catalog/changes', {'since': 2}, status=400)
+
+    def test_get_expired(self, campus, db, testapp):
+        CatalogChange.query.delete()
+        db.session.commit()
+        testapp.get('/api/catalog/changes', {'since': 0}, status=410)
+        testapp.get('/api/catalog/changes', {'since': 1}, status=200)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Tests for columnar export of courses."""
+import numpy as np
+import pytest
+
+from dash.catalog import columnar
+from dash.catalog.conflicts import ConflictMatrix
+from dash.catalog.models import Course
+
+
+@pytest.fixture
+def exported(campuses, courses, tmpdir):
+    path = str(tmpdir.join('campus.bin'))
+    columnar.export(campuses[0], path, version=7)
+    return columnar.load(path)
+
+
+def campus_courses(campus):
+    return sorted(set(c for d in campus.departments for c in d.courses),
+                  key=lambda c: c.id)
+
+
+class TestColumnar(object):
+
+    def test_export_and_load(self, campuses, exported):
+        expected = campus_courses(campuses[0])
+        assert exported.campus_id == campuses[0].id
+        assert exported.version == 7
+        assert len(exported) == len(expected)
+        assert isinstance(exported.course_id, np.memmap)
+        assert not exported.course_id.flags.writeable
+
+        for i, course in enumerate(expected):
+            assert exported.index(course.id) == i
+            assert exported.course_id[i] == course.id
+            assert exported.subject_id[i] == course.subject_id
+            assert exported.gen_edu_category_id[i] == \
+                (course.gen_edu_category_id or -1)
+            assert exported.credit[i] == course.credit
+            assert exported.target_grade[i] == \
+                (course.target_grade if course.target_grade is not None
+                 else -1)
+            assert exported.mask(i) == course.occupancy
+            assert exported.classes(i) == [
+                (c.day_of_week, c.start_period, c.end_period)
+                for c in course.classes
+            ]
+
+    def test_index_missing(self, exported):
+        with pytest.raises(KeyError):
+            exported.index(10 ** 6)
+
+    def test_conflict_matrix(self, campuses, exported):
+        expected = campus_courses(campuses[0])
+        matrix = exported.conflict_matrix()
+        orm_matrix = ConflictMatrix([c.id for c in expected],
+                                    [c.occupancy for c in expected])
+        for course in expected:
+            assert matrix.conflicts(course.id) == \
+                orm_matrix.conflicts(course.id)
+
+    def test_export_empty_campus(self, db, campuses, tmpdir):
+        path = str(tmpdir.join('empty.bin'))
+        columnar.export(campuses[1], path)
+        arrays = columnar.load(path)
+        assert len(arrays) == 0
+        assert arrays.occupancy.shape == (0, 28)
+        assert list(arrays.class_offset) == [0]
+
+    def test_load_bad_file(self, tmpdir):
+        path = tmpdir.join('bad.bin')
+        path.write(b'not columnar')
+        with pytest.raises(ValueError):
+            columnar.load(str(path))
@@ -9,6 +9,7 @@ def test_production_config():
     assert app.config['DEBUG'] is False
     assert app.config['DEBUG_TB_ENABLED'] is False
     assert app.config['ASSETS_DEBUG'] is False
+    assert app.config['SERVER_TIMING'] is False
 
 
 def test_dev_config():
@@ -16,3 +17,4 @@ def test_dev_config():
     assert app.config['ENV'] == 'dev'
     assert app.config['DEBUG'] is True
     assert app.config['ASSETS_DEBUG'] is True
+    assert app.config['SERVER_TIMING'] is True
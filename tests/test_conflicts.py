@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Conflict matrix unit tests."""
+import itertools
+import random
+
+import pytest
+
+from dash.catalog.conflicts import ConflictMatrix, get_matrix
+from dash.catalog.models import CourseClass
+from dash.catalog.occupancy import classes_mask
+
+
+def random_classes(rng):
+    classes = []
+    for _ in range(rng.randrange(3)):
+        start = rng.randrange(10)
+        classes.append(CourseClass(day_of_week=rng.randrange(3),
+                                   start_period=start,
+                                   end_period=start + rng.randrange(3)))
+    return classes
+
+
+class TestConflictMatrix(object):
+
+    def test_agrees_with_conflicts_with(self):
+        rng = random.Random(0)
+        course_ids = rng.sample(range(1000), 60)
+        classes = dict((i, random_classes(rng)) for i in course_ids)
+        matrix = ConflictMatrix(course_ids,
+                                [classes_mask(classes[i]) for i in course_ids])
+        assert len(matrix) == len(course_ids)
+
+        for a in course_ids:
+            expected = sorted(
+                b for b in course_ids
+                if b != a and any(x.conflicts_with(y) for x, y in
+                                  itertools.product(classes[a], classes[b])))
+            assert matrix.conflicts(a) == expected
+
+    def test_conflicts_any(self):
+        matrix = ConflictMatrix([3, 1, 2, 4], [0b0011, 0b0110, 0b1000, 0])
+        assert matrix.conflicts(1) == [3]
+        assert matrix.conflicts(4) == []
+        assert matrix.conflicts_any([1, 2]) == [3]
+        assert matrix.conflicts_any([3, 1]) == []
+
+    def test_unknown_course(self):
+        matrix = ConflictMatrix([1], [0b1])
+        assert 1 in matrix
+        assert 2 not in matrix
+        with pytest.raises(KeyError):
+            matrix.conflicts(2)
+
+    def test_empty(self):
+        matrix = ConflictMatrix([], [])
+        assert len(matrix) == 0
+        assert 1 not in matrix
+
+    def test_get_matrix(self, campuses, courses):
+        hyu_seoul, hyu_erica = campuses
+        matrix = get_matrix(hyu_seoul.id)
+        assert get_matrix(hyu_seoul.id) is matrix
+        assert sorted(matrix.course_ids) == \
+            sorted(c.id for c in courses if c.code.startswith('1'))
+        assert sorted(get_matrix(hyu_erica.id).course_ids) == \
+            sorted(c.id for c in courses if c.code.startswith('2'))
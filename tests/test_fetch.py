@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""Tests for concurrent fetching of pages."""
+import itertools
+import time
+
+import pytest
+import requests
+
+from dash.catalog.fetch import Fetcher, RateLimiter, ResponseCache
+from dash.catalog.models import Department
+from dash.catalog.scraper import Catalog
+
+
+def body(response):
+    return response.text
+
+
+def ok(text, delay=0):
+    def route(handler):
+        time.sleep(delay)
+        return 200, {'Content-Type': 'text/plain'}, text.encode('utf-8')
+    return route
+
+
+def failing(statuses, headers=None):
+    """Returns a route which responds with ``statuses`` in turn, and then
+    with 200.
+    """
+    statuses = iter(statuses)
+
+    def route(handler):
+        status = next(statuses, 200)
+        return status, (headers or {}) if status != 200 else {}, b'ok'
+    return route
+
+
+def page(versions, etag=True, last_modified=False):
+    """Returns a route which serves the text in ``versions['text']`` with
+    validators, and answers conditional requests for the same text with
+    304.
+    """
+    def route(handler):
+        text = versions['text']
+        headers = {'Content-Type': 'text/plain'}
+        if etag:
+            headers['ETag'] = '"{0}"'.format(text)
+        if last_modified:
+            headers['Last-Modified'] = 'Mon, 01 Jun 2015 00:00:{0:02d} GMT' \
+                .format(len(text))
+        if (etag and handler.headers.get('If-None-Match') ==
+                headers['ETag']) or \
+                (not etag and last_modified and
+                 handler.headers.get('If-Modified-Since') ==
+                 headers['Last-Modified']):
+            return 304, headers, b''
+        return 200, headers, text.encode('utf-8')
+    return route
+
+
+class TestFetcher(object):
+
+    def test_imap_keeps_order(self, http_server):
+        for i in range(10):
+            # Earlier pages are slower.
+            http_server.routes['/{0}'.format(i)] = \
+                ok(str(i), delay=(10 - i) * 0.01)
+        urls = ['{0}/{1}'.format(http_server.url, i) for i in range(10)]
+        with Fetcher(workers=4) as fetcher:
+            assert fetcher.map(body, urls) == [str(i) for i in range(10)]
+
+    def test_fetches_concurrently(self, http_server):
+        http_server.routes['/slow'] = ok('slow', delay=0.2)
+        urls = [http_server.url + '/slow'] * 8
+        start = time.time()
+        with Fetcher(workers=8) as fetcher:
+            assert fetcher.map(body, urls) == ['slow'] * 8
+        # Fetched one at a time, it would take 0.2 * 8 seconds.
+        assert time.time() - start < 0.2 * 6
+
+    def test_requests_as_dicts(self, http_server):
+        http_server.routes['/form'] = ok('form')
+        with Fetcher(workers=2) as fetcher:
+            results = fetcher.map(
+                lambda r: (r.request.method, r.text),
+                [{'url': http_server.url + '/form', 'method': 'POST',
+                  'data': {'dept': 'D1'}}])
+        assert results == [('POST', 'form')]
+
+    def test_retries(self, http_server):
+        http_server.routes['/flaky'] = failing([503, 500])
+        with Fetcher(workers=1, retries=2, backoff=0) as fetcher:
+            assert fetcher.fetch(http_server.url + '/flaky').text == 'ok'
+        assert len(http_server.requests_to('/flaky')) == 3
+
+    def test_honors_retry_after(self, http_server):
+        http_server.routes['/busy'] = failing([429], {'Retry-After': '0.3'})
+        with Fetcher(workers=1, backoff=0) as fetcher:
+            fetcher.fetch(http_server.url + '/busy')
+        times = [t for _, _, t in http_server.requests_to('/busy')]
+        assert times[1] - times[0] >= 0.3
+
+    def test_gives_up(self, http_server):
+        http_server.routes['/down'] = failing(itertools.repeat(502))
+        with Fetcher(workers=1, retries=2, backoff=0) as fetcher:
+            with pytest.raises(requests.HTTPError):
+                fetcher.map(body, [http_server.url + '/down'])
+        assert len(http_server.requests_to('/down')) == 3
+
+    def test_client_errors_are_not_retried(self, http_server):
+        with Fetcher(workers=1, backoff=0) as fetcher:
+            with pytest.raises(requests.HTTPError):
+                fetcher.fetch(http_server.url + '/missing')
+        assert len(http_server.requests_to('/missing')) == 1
+
+    def test_connection_errors_raise_after_retries(self, http_server):
+        url = http_server.url + '/'
+        http_server.shutdown()
+        http_server.server_close()
+        with Fetcher(workers=1, retries=1, backoff=0, timeout=1) as fetcher:
+            with pytest.raises(requests.ConnectionError):
+                fetcher.fetch(url)
+
+    def test_rate_limit(self, http_server):
+        http_server.routes['/page'] = ok('page')
+        with Fetcher(workers=4, rate=20) as fetcher:
+            fetcher.map(body, [http_server.url + '/page'] * 5)
+        times = sorted(t for _, _, t in http_server.requests_to('/page'))
+        # Requests arrive at the server with some jitter.
+        assert times[-1] - times[0] >= 4 / 20.0 - 0.05
+
+    def test_reuses_connections(self, http_server):
+        http_server.routes['/page'] = ok('page')
+        with Fetcher(workers=1) as fetcher:
+            fetcher.map(body, [http_server.url + '/page'] * 5)
+        ports = set(port for _, port, _ in http_server.requests_to('/page'))
+        assert len(ports) == 1
+
+    def test_feeds_catalog(self, http_server):
+        for code in ('D1', 'D2', 'D3'):
+            http_server.routes['/departments/' + code] = ok(code)
+
+        def parse(response):
+            return [Department(code=response.text, name=response.text)]
+
+        catalog = Catalog()
+        with Fetcher(workers=3) as fetcher:
+            for departments in fetcher.imap(
+                    parse, [http_server.url + '/departments/' + code
+                            for code in ('D1', 'D2', 'D3')]):
+                catalog.hold_departments(departments)
+        assert [d.code for d in catalog.departments] == ['D1', 'D2', 'D3']
+
+
+class TestCache(object):
+
+    def test_replays_unmodified_pages(self, http_server, tmpdir):
+        versions = {'text': 'courses'}
+        http_server.routes['/courses'] = page(versions)
+        url = http_server.url + '/courses'
+        with Fetcher(workers=1, cache=str(tmpdir)) as fetcher:
+            response = fetcher.fetch(url)
+            assert (response.text, response.from_cache) == \
+                ('courses', False)
+        # Another run reads the same directory.
+        with Fetcher(workers=1, cache=str(tmpdir)) as fetcher:
+            response = fetcher.fetch(url)
+            assert (response.status_code, response.text,
+                    response.from_cache) == (200, 'courses', True)
+            assert response.headers['ETag'] == '"courses"'
+            versions['text'] = 'changed courses'
+            response = fetcher.fetch(url)
+            assert (response.text, response.from_cache) == \
+                ('changed courses', False)
+            assert fetcher.fetch(url).from_cache
+        assert len(http_server.requests_to('/courses')) == 4
+
+    def test_last_modified(self, http_server, tmpdir):
+        http_server.routes['/courses'] = \
+            page({'text': 'courses'}, etag=False, last_modified=True)
+        with Fetcher(workers=1, cache=str(tmpdir)) as fetcher:
+            fetcher.fetch(http_server.url + '/courses')
+            assert fetcher.fetch(http_server.url + '/courses').from_cache
+
+    def test_keyed_by_request(self, http_server, tmpdir):
+        def form(handler):
+            return 200, {'ETag': '"form"'}, handler.body
+        http_server.routes['/form'] = form
+        url = http_server.url + '/form'
+        with Fetcher(workers=1, cache=str(tmpdir)) as fetcher:
+            texts = fetcher.map(body, [
+                {'url': url, 'method': 'POST', 'data': {'dept': 'D1'}},
+                {'url': url, 'method': 'POST', 'data': {'dept': 'D2'}},
+            ])
+        assert texts == ['dept=D1', 'dept=D2']
+        cache = ResponseCache(str(tmpdir))
+        assert cache.key('POST', url, data={'dept': 'D1'}) != \
+            cache.key('POST', url, data={'dept': 'D2'})
+        assert cache.key('GET', url, params={'a': 1}) == \
+            cache.key('get', url + '?a=1')
+        assert cache.get(cache.key('POST', url, data={'dept': 'D2'})) \
+            .text == 'dept=D2'
+
+    def test_stores_only_validated_responses(self, http_server, tmpdir):
+        http_server.routes['/plain'] = ok('plain')
+        with Fetcher(workers=1, cache=str(tmpdir)) as fetcher:
+            fetcher.fetch(http_server.url + '/plain')
+            assert not fetcher.fetch(http_server.url + '/plain').from_cache
+        assert tmpdir.listdir() == []
+
+    def test_broken_file_is_a_miss(self, http_server, tmpdir):
+        http_server.routes['/courses'] = page({'text': 'courses'})
+        url = http_server.url + '/courses'
+        cache = ResponseCache(str(tmpdir))
+        tmpdir.join(cache.key('GET', url)).write('broken')
+        with Fetcher(workers=1, cache=cache) as fetcher:
+            assert fetcher.fetch(url).text == 'courses'
+            assert fetcher.fetch(url).from_cache
+        cache.clear()
+        assert tmpdir.listdir() == []
+
+
+def test_rate_limiter():
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    limiter = RateLimiter(0.5, clock=lambda: now[0], sleep=sleep)
+    for _ in range(3):
+        limiter.wait('a')
+    limiter.wait('b')
+    assert sleeps == [0.5, 0.5]
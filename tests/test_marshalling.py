@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""Tests for precompiled serializers."""
+import json
+
+import pytest
+from flask.ext.restful import fields, marshal
+
+from dash.catalog import api, models
+from dash.catalog.marshalling import compile_fields, select_fields
+
+
+def dumps(data):
+    return json.dumps(data)
+
+
+@pytest.mark.parametrize('model,spec', [
+    (models.Campus, api.campus_fields),
+    (models.Department, api.department_fields),
+    (models.Subject, api.subject_fields),
+    (models.GenEduCategory, api.gen_edu_category_fields),
+    (models.Course, api.course_fields),
+])
+def test_same_as_marshal(courses, model, spec):
+    entities = model.query.order_by(model.id).all()
+    serialize = compile_fields(spec)
+    assert dumps(serialize(entities)) == dumps(marshal(entities, spec))
+    for entity in entities:
+        assert dumps(serialize(entity)) == dumps(marshal(entity, spec))
+
+
+class Point(object):
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+class Shape(object):
+    def __init__(self, name, origin, points, tags):
+        self.name = name
+        self.origin = origin
+        self.points = points
+        self.tags = tags
+
+
+class Upper(fields.Raw):
+    def format(self, value):
+        return value.upper()
+
+
+class Constant(fields.Raw):
+    def output(self, key, obj):
+        return 'constant'
+
+
+point_fields = {'x': fields.Integer, 'y': fields.Float}
+
+
+@pytest.mark.parametrize('spec', [
+    {'name': fields.String, 'missing': fields.String},
+    {'name': fields.Raw, 'missing': fields.Integer},
+    {'name': Upper, 'missing': Upper(default='none')},
+    {'name': Constant},
+    {'x': fields.Integer(attribute='origin.x'),
+     'z': fields.Integer(attribute='origin.z')},
+    {'len': fields.Integer(attribute=lambda s: len(s.points or []))},
+    {'origin': fields.Nested(point_fields)},
+    {'origin': fields.Nested(point_fields, allow_null=True)},
+    {'origin': fields.Nested(point_fields, default={})},
+    {'points': fields.List(fields.Nested(point_fields))},
+    {'points': fields.List(fields.Nested(point_fields, allow_null=True))},
+    {'tags': fields.List(fields.String)},
+    {'nested': {'name': fields.String,
+                'origin': fields.Nested(point_fields)}},
+])
+@pytest.mark.parametrize('shape', [
+    Shape(u'Square', Point(0, 0), [Point(0, 0), Point(1, 1)], [u'a', u'b']),
+    Shape(u'Empty', None, [], []),
+    Shape(u'Holes', Point(1, 2), [None, Point(3, 4)], None),
+    Shape(None, None, None, None),
+])
+def test_same_as_marshal_with_fields(spec, shape):
+    serialize = compile_fields(spec)
+    assert dumps(serialize(shape)) == dumps(marshal(shape, spec))
+
+
+shape_fields = {
+    'name': fields.String,
+    'origin': fields.Nested(point_fields, allow_null=True),
+    'points': fields.List(fields.Nested(point_fields)),
+    'nested': {'name': fields.String, 'origin': fields.Nested(point_fields)},
+    'tags': fields.List(fields.String),
+}
+
+
+@pytest.mark.parametrize('paths,expand,expected', [
+    (None, None, shape_fields),
+    (['name', 'origin.x'], None,
+     {'name': fields.String,
+      'origin': fields.Nested({'x': fields.Integer}, allow_null=True)}),
+    (['points.y', 'nested.name', 'nested'], None,
+     {'points': fields.List(fields.Nested({'y': fields.Float})),
+      'nested': shape_fields['nested']}),
+    (None, [], {'name': fields.String, 'nested': shape_fields['nested'],
+                'tags': fields.List(fields.String)}),
+    (['name'], ['points'],
+     {'name': fields.String, 'points': shape_fields['points']}),
+])
+def test_select_fields(paths, expand, expected):
+    shape = Shape(u'Square', Point(0, 1), [Point(0, 0), Point(1, 1)],
+                  [u'a'])
+    shape.nested = Shape(u'Inner', Point(2, 3), None, None)
+    spec = select_fields(shape_fields, paths, expand,
+                         relationships=('origin', 'points'))
+    assert sorted(spec) == sorted(expected)
+    # Selected fields are not in the order of ``expected`` on Python 2.
+    assert json.loads(dumps(compile_fields(spec)(shape))) == \
+        json.loads(dumps(marshal(shape, expected)))
+
+
+@pytest.mark.parametrize('paths,expand', [
+    (['missing'], None),
+    (['name.x'], None),
+    (['origin.z'], None),
+    (None, ['name']),
+])
+def test_select_fields_unknown(paths, expand):
+    with pytest.raises(ValueError):
+        select_fields(shape_fields, paths, expand,
+                      relationships=('origin', 'points'))
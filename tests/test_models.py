@@ -225,3 +225,23 @@ class TestCatalog:
         assert bool(course_class.course)
         assert course_class in course_class.course.classes
         assert bool(course_class.course_id)
+
+    def test_course_occupancy(self, db):
+        course = CourseFactory()
+        db.session.commit()
+        assert Course.get_by_id(course.id).occupancy == 0
+
+        CourseClassFactory(day_of_week=0, start_period=1, end_period=2,
+                           course=course)
+        CourseClassFactory(day_of_week=6, start_period=31, end_period=31,
+                           course=course)
+        course.update_occupancy()
+        db.session.commit()
+        expected = 0b110 | (1 << (7 * 32 - 1))
+        assert course.occupancy == expected
+
+        db.session.expire_all()
+        assert Course.get_by_id(course.id).occupancy == expected
+        assert course.occupancy_0 == 0b110
+        assert course.occupancy_6 == -(1 << 31)
+        assert Course.query.filter_by(occupancy_0=0b110).one() is course
@@ -1,16 +1,23 @@
 # -*- coding: utf-8 -*-
 """Scraper unit tests."""
 import operator
+import os
+import weakref
 
 import pytest
+import sqlalchemy.event
 
 from dash.catalog.models import (
+    CatalogVersion,
     Department,
     Subject,
     GenEduCategory,
     Course,
+    CourseClass,
 )
-from dash.catalog.scraper import update_catalog
+from dash.catalog import snapshot, staging, sync
+from dash.catalog.occupancy import classes_mask
+from dash.catalog.scraper import Catalog, update_catalog
 from .factories import (
     CampusFactory,
     DepartmentFactory,
@@ -18,6 +25,7 @@ from .factories import (
     GenEduCategoryFactory,
     CourseFactory,
     GeneralCourseFactory,
+    CourseClassFactory,
 )
 
 
@@ -65,7 +73,12 @@ class TestScraper(object):
                                     departments=[departments[0]]))
             major_courses.append(
                 CourseFactory.build(subject=subjects[1],
-                                    departments=[departments[1]]))
+                                    departments=[departments[1]],
+                                    classes=[CourseClassFactory.build(
+                                        course=None,
+                                        day_of_week=0,
+                                        start_period=1,
+                                        end_period=2)]))
             catalog.hold_courses(major_courses)
 
             general_courses.append(
@@ -87,17 +100,345 @@ class TestScraper(object):
             mock_objs_sorted = sorted(mock_objs,
                                       key=operator.attrgetter('code'))
             stored_objs = Model.query.order_by(Model.code).all()
-            assert len(mock_objs_sorted) == len(stored_objs)
-            assert all(m is s for m, s in zip(mock_objs_sorted, stored_objs))
+            assert [m.code for m in mock_objs_sorted] == \
+                [s.code for s in stored_objs]
+
+        # A new catalog version should be created.
+        assert CatalogVersion.current() == 1
+        assert CatalogVersion.query.one().campus is campus
+        # And a snapshot of the campus at the version.
+        assert snapshot.latest_version(campus.id) == 1
+
+        def stored(obj):
+            return type(obj).query.filter_by(code=obj.code).one()
+
+        # Occupancy of courses should be computed from their classes.
+        assert stored(major_courses[2]).occupancy == 0
+        assert stored(major_courses[3]).occupancy == 0b110
 
         # Test relationships between departments and courses
-        d = departments[0]
-        assert major_courses[0] in d.courses
-        assert major_courses[1] in d.courses
-        assert major_courses[2] in d.courses
-        d = departments[1]
-        assert major_courses[3] in d.courses
-        d = departments[2]
-        assert major_courses[1] in d.courses
-        d = departments[3]
-        assert general_courses[0] in d.courses
+        def stored_courses(d):
+            d = stored(d)
+            return set(c.code for c in d.courses)
+
+        assert stored_courses(departments[0]) == set(
+            c.code for c in major_courses[:3])
+        assert stored_courses(departments[1]) == set([major_courses[3].code])
+        assert stored_courses(departments[2]) == set([major_courses[1].code])
+        assert stored_courses(departments[3]) == \
+            set([general_courses[0].code])
+        assert stored(departments[0]).campus is campus
+
+    @pytest.mark.parametrize('staging', [False, True],
+                             ids=['sync', 'staging'])
+    def test_snapshot_fails_before_commit(self, app, db, monkeypatch,
+                                          staging):
+        app.config['CATALOG_SYNC_STAGING'] = staging
+        campus = CampusFactory()
+        db.session.commit()
+
+        def prepare(campus, version):
+            raise IOError('disk is full')
+        monkeypatch.setattr(snapshot, 'prepare', prepare)
+
+        with pytest.raises(IOError):
+            with update_catalog(campus) as catalog:
+                hold_catalog(catalog, catalog_spec())
+        db.session.rollback()
+        assert CatalogVersion.query.count() == 0
+        assert Course.query.count() == 0
+
+    def test_snapshot_fails_after_commit(self, app, db, monkeypatch):
+        campus = CampusFactory()
+        db.session.commit()
+
+        def publish(campus, version, tmp_path):
+            raise OSError('permission denied')
+        monkeypatch.setattr(snapshot, 'publish', publish)
+
+        with update_catalog(campus) as catalog:
+            hold_catalog(catalog, catalog_spec())
+        # The version is committed, and the snapshot is left unpublished.
+        assert CatalogVersion.current() == 1
+        assert snapshot.latest_version(campus.id) is None
+        assert os.listdir(app.config['CATALOG_SNAPSHOT_DIR']) == []
+
+
+def hold_catalog(catalog, spec):
+    """Holds entities described by a dict, as a scraper would."""
+    departments = dict((code, Department(code=code, name=name))
+                       for code, name in spec['departments'].items())
+    subjects = dict((code, Subject(code=code, name=name))
+                    for code, name in spec['subjects'].items())
+    categories = dict((code, GenEduCategory(code=code, name=name))
+                      for code, name in spec['categories'].items())
+    courses = []
+    for code, subject, category, dept_codes, instructor, classes in \
+            spec['courses']:
+        course = Course(code=code, subject=subject and subjects[subject],
+                        gen_edu_category=category and categories[category],
+                        major=category is None, credit=3.0,
+                        instructor=instructor,
+                        target_grade=None if category else 2)
+        for dept_code in dept_codes:
+            departments[dept_code].courses.add(course)
+        course.classes = [CourseClass(day_of_week=d, start_period=s,
+                                      end_period=e) for d, s, e in classes]
+        courses.append(course)
+    catalog.hold_departments(departments.values())
+    catalog.hold_subjects(subjects.values())
+    catalog.hold_gen_edu_categories(categories.values())
+    catalog.hold_courses(courses)
+
+
+def catalog_spec():
+    return {
+        'departments': {'D1': 'CSE', 'D2': 'ECE', 'D3': 'Undergraduate'},
+        'subjects': {'S1': 'Algorithms', 'S2': 'Circuits', 'S3': 'Writing'},
+        'categories': {'G1': 'Communication'},
+        'courses': [
+            ('C1', 'S1', None, ['D1'], 'Kim', [(0, 1, 2), (2, 1, 2)]),
+            ('C2', 'S1', None, ['D1', 'D2'], 'Lee', [(1, 3, 4)]),
+            ('C3', 'S2', None, ['D2'], 'Park', [(3, 5, 6)]),
+            ('C4', 'S3', 'G1', ['D3'], 'Choi', []),
+        ],
+    }
+
+
+def snapshot_of_campus(campus):
+    """Returns the stored catalog of a campus in the form of specs."""
+    courses = []
+    for c in Course.query.order_by(Course.code):
+        dept_codes = sorted(d.code for d in c.departments
+                            if d.campus_id == campus.id)
+        if not dept_codes:
+            continue
+        courses.append((
+            c.code, c.subject.code,
+            c.gen_edu_category.code if c.gen_edu_category else None,
+            dept_codes, c.instructor,
+            sorted((cc.day_of_week, cc.start_period, cc.end_period)
+                   for cc in c.classes),
+        ))
+    return {
+        'departments': dict((d.code, d.name) for d in campus.departments),
+        'subjects': dict((s.code, s.name) for s in Subject.query),
+        'categories': dict((g.code, g.name) for g in GenEduCategory.query),
+        'courses': courses,
+    }
+
+
+def normalized(spec):
+    spec = dict(spec)
+    spec['courses'] = sorted(
+        (code, subject, category, sorted(depts), instructor, sorted(classes))
+        for code, subject, category, depts, instructor, classes
+        in spec['courses'])
+    return spec
+
+
+@pytest.mark.usefixtures('db', 'staging')
+class TestSync(object):
+
+    @pytest.fixture(params=[False, True], ids=['sync', 'staging'])
+    def staging(self, request, app):
+        app.config['CATALOG_SYNC_STAGING'] = request.param
+        return request.param
+
+    @pytest.fixture
+    def campus(self, db):
+        campus = CampusFactory()
+        db.session.commit()
+        return campus
+
+    @staticmethod
+    def sync(campus, spec):
+        with update_catalog(campus) as catalog:
+            hold_catalog(catalog, spec)
+        return catalog.stats
+
+    @staticmethod
+    def count_writes(db):
+        """Returns a list to which statements which write rows of
+        catalog tables are appended.
+        """
+        statements = []
+
+        def after_cursor_execute(conn, cursor, statement, *args):
+            words = statement.split(None, 3)
+            if words[0] in ('INSERT', 'DELETE'):
+                table = words[2]
+            elif words[0] == 'UPDATE':
+                table = words[1]
+            else:
+                return
+            if cursor.rowcount > 0 and not table.startswith('stage_'):
+                statements.append(statement)
+        sqlalchemy.event.listen(db.engine, 'after_cursor_execute',
+                                after_cursor_execute)
+        return statements
+
+    def test_resync_unchanged(self, campus, db):
+        self.sync(campus, catalog_spec())
+        assert CatalogVersion.current() == 1
+
+        writes = self.count_writes(db)
+        stats = self.sync(campus, catalog_spec())
+        assert writes == []
+        assert not sync.changed(stats)
+        assert CatalogVersion.current() == 1
+        assert Course.query.count() == 4
+        assert normalized(snapshot_of_campus(campus)) == \
+            normalized(catalog_spec())
+
+    def test_resync_changed(self, campus, db):
+        self.sync(campus, catalog_spec())
+        course_ids = dict((c.code, c.id) for c in Course.query)
+
+        spec = catalog_spec()
+        del spec['departments']['D2']
+        spec['subjects']['S1'] = 'Algorithms and Data Structures'
+        del spec['subjects']['S2']
+        spec['courses'] = [
+            # Instructor and a class are changed.
+            ('C1', 'S1', None, ['D1'], 'Kang', [(0, 1, 2), (4, 1, 2)]),
+            # Moved out of a removed department.
+            ('C2', 'S1', None, ['D1'], 'Lee', [(1, 3, 4)]),
+            # C3 is removed, and C5 is added.
+            ('C4', 'S3', 'G1', ['D3'], 'Choi', []),
+            ('C5', 'S3', 'G1', ['D1', 'D3'], 'Jung', [(5, 0, 0)]),
+        ]
+        stats = self.sync(campus, spec)
+
+        assert normalized(snapshot_of_campus(campus)) == normalized(spec)
+        assert stats['departments'] == {'deleted': 1}
+        assert stats['subjects'] == {'updated': 1, 'deleted': 1}
+        assert stats['courses'] == {'inserted': 1, 'updated': 1,
+                                    'deleted': 1}
+        assert stats['course_classes'] == {'inserted': 2, 'deleted': 2}
+        assert stats['department_course'] == {'inserted': 2, 'deleted': 2}
+        assert CatalogVersion.current() == 2
+
+        # Matched courses keep their IDs.
+        for code in ('C1', 'C2', 'C4'):
+            assert Course.query.filter_by(code=code).one().id == \
+                course_ids[code]
+        c1 = Course.query.filter_by(code='C1').one()
+        assert c1.occupancy == classes_mask(c1.classes)
+
+    def test_sync_keeps_other_campuses(self, campus, db):
+        other = CampusFactory()
+        db.session.commit()
+        other_spec = catalog_spec()
+        other_spec['departments'] = {'E1': 'Design'}
+        other_spec['courses'] = [
+            ('C9', 'S2', None, ['E1'], 'Han', [(0, 0, 1)]),
+        ]
+        self.sync(other, other_spec)
+
+        spec = catalog_spec()
+        del spec['subjects']['S2']
+        spec['courses'] = [c for c in spec['courses'] if c[1] != 'S2']
+        self.sync(campus, spec)
+
+        # S2 is still used by the other campus.
+        assert Subject.query.filter_by(code='S2').count() == 1
+        assert [c.code for c in other.departments[0].courses] == ['C9']
+
+    def test_sync_scopes_courses_without_departments(self, campus, db):
+        other = CampusFactory()
+        db.session.commit()
+        for c, instructor in ((campus, 'Kim'), (other, 'Han')):
+            spec = catalog_spec()
+            spec['courses'].append(('C8', 'S3', None, [], instructor, []))
+            self.sync(c, spec)
+
+        # Each campus has its own course, which is not updated by the
+        # other campus.
+        courses = Course.query.filter_by(code='C8').order_by(Course.id).all()
+        assert [(c.campus_id, c.instructor) for c in courses] == \
+            [(campus.id, 'Kim'), (other.id, 'Han')]
+
+        stats = self.sync(campus, catalog_spec())
+        assert stats['courses'] == {'deleted': 1}
+        assert [(c.campus_id, c.instructor)
+                for c in Course.query.filter_by(code='C8')] == \
+            [(other.id, 'Han')]
+
+    def test_sync_merges_duplicates(self, campus, db):
+        # Catalogs used to be duplicated by every run of a scraper.
+        for _ in range(2):
+            catalog = Catalog()
+            hold_catalog(catalog, catalog_spec())
+            for d in catalog.departments:
+                d.campus = campus
+            db.session.add_all(catalog.courses)
+            db.session.commit()
+        assert Course.query.count() == 8
+
+        self.sync(campus, catalog_spec())
+        assert Course.query.count() == 4
+        assert Subject.query.count() == 3
+        assert CourseClass.query.count() == 4
+        assert normalized(snapshot_of_campus(campus)) == \
+            normalized(catalog_spec())
+
+    def test_sync_checks_course_type(self, campus, db):
+        spec = catalog_spec()
+        with pytest.raises(AssertionError):
+            with update_catalog(campus) as catalog:
+                hold_catalog(catalog, spec)
+                catalog.hold_courses([Course(
+                    code='C9', subject=Subject(code='S9', name='Ethics'),
+                    major=False, credit=3.0)])
+
+    def test_sync_from_generators(self, campus, app):
+        app.config['CATALOG_SYNC_BATCH_SIZE'] = 2
+        spec = catalog_spec()
+        # Courses are held twice, and later ones are ignored.
+        duplicates = [('C1', 'S2', None, ['D2'], 'Lee', [])]
+        with update_catalog(campus) as catalog:
+            held = Catalog()
+            hold_catalog(held, dict(spec, courses=spec['courses'] +
+                                    duplicates))
+            catalog.hold_departments(d for d in held.departments)
+            catalog.hold_subjects(s for s in held.subjects)
+            catalog.hold_gen_edu_categories(
+                c for c in held.gen_edu_categories)
+            catalog.hold_courses(c for c in held.courses)
+        assert normalized(snapshot_of_campus(campus)) == normalized(spec)
+
+
+@pytest.mark.usefixtures('db')
+class TestStagingCatalog(object):
+
+    def test_flushes_in_batches(self, app):
+        app.config['CATALOG_SYNC_BATCH_SIZE'] = 3
+        catalog = staging.StagingCatalog()
+        refs = []
+
+        def departments():
+            for i in range(10):
+                d = Department(code='D{0}'.format(i), name='Department')
+                refs.append(weakref.ref(d))
+                yield d
+        catalog.hold_departments(departments())
+        # Rows of held entities are loaded, and the entities are not kept.
+        assert catalog.conn.execute(
+            staging._stage_departments.count()).scalar() == 9
+        assert all(ref() is None for ref in refs)
+        catalog.flush()
+        assert catalog.conn.execute(
+            staging._stage_departments.count()).scalar() == 10
+
+
+@pytest.mark.parametrize('value,text', [
+    (None, u'\\N'),
+    (True, u't'),
+    (False, u'f'),
+    (3, u'3'),
+    (0.1, u'0.1'),
+    (u'Kim\tLee\\Park\r\n', u'Kim\\tLee\\\\Park\\r\\n'),
+])
+def test_copy_text(value, text):
+    assert staging._copy_text(value) == text
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Course search unit tests."""
+import pytest
+
+from dash.catalog import search
+from dash.catalog.changes import Changes
+from dash.catalog.models import Course
+from dash.database import db
+from .factories import SubjectFactory
+
+
+requires_fts = pytest.mark.skipif(not search._fts_supported(),
+                                  reason='SQLite has no trigram tokenizer')
+
+
+def search_codes(field, keyword):
+    q = Course.query.join(Course.subject) \
+        .filter(*search.keyword_filter_criterion(field, keyword))
+    return set(c.code for c in q)
+
+
+@pytest.mark.usefixtures('db')
+class TestSearch(object):
+
+    @requires_fts
+    def test_has_fts(self, db):
+        assert search.has_fts()
+
+    @requires_fts
+    def test_keyword_uses_fts(self, db):
+        criteria = list(search.keyword_filter_criterion('name',
+                                                        'understanding'))
+        assert len(criteria) == 1
+        assert 'MATCH' in str(criteria[0].compile(db.engine))
+
+    @pytest.mark.parametrize('field,keyword,codes', [
+        ('name', 'UNDERSTANDING law', set(['10037', '15254'])),
+        ('name', 'of', set(['20025', '20016'])),
+        ('name', 'of culture', set(['20025'])),
+        ('subject_code', 'kor', set(['22294', '22291'])),
+        ('instructor', 'sunny yoon', set(['15254', '11552', '12798'])),
+        ('instructor', 'nobody', set()),
+    ])
+    def test_keyword_filter_criterion(self, courses, field, keyword, codes):
+        assert search_codes(field, keyword) == codes
+
+    def test_reindex(self, db, courses):
+        subject = courses[0].subject
+        subject.name = 'Patent Law in Practice'
+        db.session.commit()
+        search.reindex()
+        db.session.commit()
+        assert search_codes('name', 'practice') == set(['10037', '15254'])
+
+    @requires_fts
+    def test_reindex_changes(self, db, courses):
+        courses[0].instructor = 'Grace Hopper'
+        courses[1].instructor = 'Grace Hopper'
+        db.session.commit()
+        changes = Changes()
+        changes.add('courses', 'updated', [courses[0].id])
+        search.reindex(changes=changes)
+        db.session.commit()
+        # Only courses in the changes are reindexed.
+        assert search_codes('instructor', 'hopper') == set([courses[0].code])
+
+        courses[2].subject.name = 'Compilers'
+        db.session.commit()
+        changes = Changes()
+        changes.add('subjects', 'updated', [courses[2].subject_id])
+        search.reindex(changes=changes)
+        db.session.commit()
+        assert search_codes('name', 'compilers') == set(
+            c.code for c in courses if c.subject_id == courses[2].subject_id)
+
+
+def test_reindex_in_transaction(app, tmpdir):
+    # On a file, looking up course_search on another connection would wait
+    # for the lock of the transaction.
+    app.config['SQLALCHEMY_DATABASE_URI'] = \
+        'sqlite:///' + str(tmpdir.join('dash.db'))
+    db.app = app
+    db.create_all()
+    try:
+        search._fts_engines.clear()
+        # As when written pages are spilled by a large sync.
+        db.session.execute('BEGIN EXCLUSIVE')
+        SubjectFactory(name='Patent Law')
+        db.session.flush()
+        search.reindex()
+        db.session.commit()
+    finally:
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Tests for catalog snapshots."""
+import gzip
+import io
+import json
+import os
+
+import pytest
+
+from dash.catalog import snapshot
+
+
+def read_snapshot(campus_id, version):
+    with gzip.open(snapshot.path(campus_id, version), 'rb') as f:
+        return json.loads(f.read().decode('utf-8'))
+
+
+def campus_course_ids(campus):
+    return sorted(set(c.id for d in campus.departments for c in d.courses))
+
+
+class TestSnapshot(object):
+
+    def test_write(self, campuses, courses):
+        campus = campuses[0]
+        snapshot.write(campus, 3)
+        assert snapshot.latest_version(campus.id) == 3
+        assert snapshot.latest_version(campuses[1].id) is None
+
+        document = read_snapshot(campus.id, 3)
+        assert document['version'] == 3
+        assert document['campus']['id'] == campus.id
+        assert 'departments' not in document['campus']
+        assert [d['id'] for d in document['departments']] == \
+            sorted(d.id for d in campus.departments)
+        assert [c['id'] for c in document['courses']] == \
+            campus_course_ids(campus)
+
+        subject_ids = set(s['id'] for s in document['subjects'])
+        category_ids = set(c['id'] for c in document['gen_edu_categories'])
+        department_ids = set(d['id'] for d in document['departments'])
+        for c in document['courses']:
+            assert c['subject_id'] in subject_ids
+            assert c['gen_edu_category_id'] in category_ids | set([None])
+            assert set(c['department_ids']) <= department_ids
+            assert 'subject' not in c
+            assert 'departments' not in c
+
+    def test_write_removes_older_snapshots(self, campuses, courses):
+        snapshot.write(campuses[0], 1)
+        snapshot.write(campuses[1], 2)
+        snapshot.write(campuses[0], 3)
+        assert not os.path.exists(snapshot.path(campuses[0].id, 1))
+        assert os.path.exists(snapshot.path(campuses[1].id, 2))
+        assert os.path.exists(snapshot.path(campuses[0].id, 3))
+
+
+class TestSnapshotApi(object):
+
+    gzip_headers = {'Accept-Encoding': 'gzip'}
+
+    @pytest.fixture
+    def written(self, campuses, courses):
+        snapshot.write(campuses[0], 4)
+        return read_snapshot(campuses[0].id, 4)
+
+    def test_get_latest(self, written, app):
+        # WebTest decodes gzipped responses, so Flask client is used.
+        client = app.test_client()
+        resp = client.get('/api/campuses/1/snapshot',
+                          headers=self.gzip_headers)
+        assert resp.status_code == 200
+        assert resp.mimetype == 'application/json'
+        assert resp.headers['Content-Encoding'] == 'gzip'
+        assert resp.headers['Content-Location'] == \
+            '/api/campuses/1/snapshot/4'
+        assert 'max-age=0' in resp.headers['Cache-Control']
+        with gzip.GzipFile(fileobj=io.BytesIO(resp.data)) as f:
+            assert json.loads(f.read().decode('utf-8')) == written
+
+        resp = client.get('/api/campuses/1/snapshot',
+                          headers=dict(self.gzip_headers, **{
+                              'If-None-Match': resp.headers['ETag'],
+                          }))
+        assert resp.status_code == 304
+
+    def test_get_version(self, written, testapp):
+        resp = testapp.get('/api/campuses/1/snapshot/4',
+                           headers=self.gzip_headers)
+        assert 'max-age={0}'.format(snapshot.MAX_AGE) in \
+            resp.headers['Cache-Control']
+        testapp.get('/api/campuses/1/snapshot/3', status=404)
+
+    def test_get_without_gzip(self, written, testapp):
+        resp = testapp.get('/api/campuses/1/snapshot')
+        assert 'Content-Encoding' not in resp.headers
+        assert resp.json == written
+
+    def test_get_missing(self, written, testapp):
+        testapp.get('/api/campuses/2/snapshot', status=404)
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""Timetable engine unit tests."""
+import itertools
+import random
+
+import pytest
+import six
+
+from dash.catalog.models import CourseClass
+from dash.catalog.occupancy import (
+    PERIODS_PER_DAY,
+    slot_mask,
+    classes_mask,
+    day_masks,
+    from_day_masks,
+)
+from dash.catalog.timetable import iter_timetables
+
+
+def brute_force(groups):
+    for choice in itertools.product(*groups):
+        occupied = 0
+        for _, mask in choice:
+            if occupied & mask:
+                break
+            occupied |= mask
+        else:
+            yield tuple(key for key, _ in choice)
+
+
+def random_groups(rng, n_groups, n_options, n_days=5, n_periods=20):
+    # randrange() differs between Python 2 and 3, but random() does not.
+    def below(n):
+        return int(rng.random() * n)
+
+    groups = []
+    for g in range(n_groups):
+        group = []
+        for o in range(n_options):
+            mask = 0
+            for _ in range(2):
+                start = below(n_periods - 2)
+                mask |= slot_mask(below(n_days), start, start + 2)
+            group.append(((g, o), mask))
+        groups.append(group)
+    return groups
+
+
+class CountingMask(six.integer_types[-1]):
+    """A mask which counts how many times it is tested against others.
+    Masks are ``long`` on Python 2.
+    """
+    tests = 0
+
+    def __and__(self, other):
+        CountingMask.tests += 1
+        return six.integer_types[-1].__and__(self, other)
+
+
+def counting(groups):
+    CountingMask.tests = 0
+    return [[(key, CountingMask(mask)) for key, mask in group]
+            for group in groups]
+
+
+class TestOccupancy(object):
+
+    def test_slot_mask(self):
+        assert slot_mask(0, 0, 0) == 1
+        assert slot_mask(0, 1, 3) == 0b1110
+        assert slot_mask(1, 0, 1) == 0b11 << PERIODS_PER_DAY
+
+    @pytest.mark.parametrize('args', [
+        (-1, 0, 0),
+        (7, 0, 0),
+        (0, 3, 2),
+        (0, 0, PERIODS_PER_DAY),
+    ])
+    def test_slot_mask_out_of_range(self, args):
+        with pytest.raises(ValueError):
+            slot_mask(*args)
+
+    def test_day_masks(self):
+        mask = slot_mask(0, 0, 1) | slot_mask(2, 31, 31) | \
+            slot_mask(6, 0, PERIODS_PER_DAY - 1)
+        assert day_masks(mask) == [0b11, 0, -(1 << 31), 0, 0, 0, -1]
+        assert from_day_masks(day_masks(mask)) == mask
+        assert day_masks(0) == [0] * 7
+
+    def test_classes_mask_agrees_with_conflicts_with(self):
+        rng = random.Random(0)
+        classes = []
+        for _ in range(30):
+            start = rng.randrange(10)
+            classes.append(CourseClass(day_of_week=rng.randrange(3),
+                                       start_period=start,
+                                       end_period=start + rng.randrange(4)))
+        for a, b in itertools.combinations(classes, 2):
+            conflicts = bool(classes_mask([a]) & classes_mask([b]))
+            assert conflicts == a.conflicts_with(b)
+
+
+class TestIterTimetables(object):
+
+    def test_no_groups(self):
+        assert list(iter_timetables([])) == []
+
+    def test_empty_group(self):
+        assert list(iter_timetables([[('a', 1)], []])) == []
+
+    def test_keys_follow_group_order(self):
+        groups = [
+            [('a1', 0b0011), ('a2', 0b1100)],
+            [('b1', 0b0001)],
+        ]
+        assert list(iter_timetables(groups)) == [('a2', 'b1')]
+
+    def test_same_masks(self):
+        groups = [
+            [('a1', 0b01), ('a2', 0b01)],
+            [('b1', 0b10), ('b2', 0b10)],
+        ]
+        assert sorted(iter_timetables(groups)) == [
+            ('a1', 'b1'), ('a1', 'b2'), ('a2', 'b1'), ('a2', 'b2'),
+        ]
+
+    @pytest.mark.parametrize('seed', range(5))
+    def test_agrees_with_brute_force(self, seed):
+        groups = random_groups(random.Random(seed), 5, 6)
+        assert sorted(iter_timetables(groups)) == \
+            sorted(brute_force(groups))
+
+    @pytest.mark.parametrize('n_groups,n_options,max_tests', [
+        (10, 20, 25000),
+        (12, 24, 32000),
+    ])
+    def test_search_is_bounded(self, n_groups, n_options, max_tests):
+        # Bounds are about 1.5 times the numbers of masks tested by the
+        # search now, so that a lost pruning fails. Timing is measured by
+        # benchmarks/timetable.py.
+        groups = counting(random_groups(random.Random(42), n_groups,
+                                        n_options, n_periods=26))
+        timetables = list(itertools.islice(iter_timetables(groups), 1000))
+
+        assert CountingMask.tests < max_tests
+        assert len(timetables) == 1000
+        for t in timetables:
+            occupied = 0
+            for g, key in enumerate(t):
+                mask = dict(groups[g])[key]
+                assert not occupied & mask
+                occupied |= mask
+
+    @pytest.mark.parametrize('n_groups,n_options,n_periods,max_tests', [
+        (10, 20, 8, 450000),
+        (12, 24, 8, 1100000),
+    ])
+    def test_exhaustive_search_is_bounded(self, n_groups, n_options,
+                                          n_periods, max_tests):
+        # Dense timetables with few or no solutions need the whole search
+        # space to be explored.
+        groups = counting(random_groups(random.Random(42), n_groups,
+                                        n_options, n_periods=n_periods))
+        assert list(iter_timetables(groups)) == []
+        assert CountingMask.tests < max_tests
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""Tests for per-request timing."""
+import json
+import logging
+import re
+
+import pytest
+
+from dash import timing
+from dash.catalog import streaming
+
+SERVER_TIMING = re.compile(
+    r'^db;dur=(?P<db>[\d.]+);desc="(?P<queries>\d+) queries", '
+    r'marshal;dur=(?P<marshal>[\d.]+), total;dur=(?P<total>[\d.]+)$')
+
+
+def server_timing(resp):
+    match = SERVER_TIMING.match(resp.headers['Server-Timing'])
+    assert match is not None
+    return dict((k, float(v)) for k, v in match.groupdict().items())
+
+
+@pytest.mark.usefixtures('server_timing')
+class TestTiming(object):
+
+    def test_server_timing(self, campuses, courses, testapp):
+        numbers = server_timing(testapp.get('/api/courses'))
+        assert numbers['queries'] > 0
+        assert 0 < numbers['db'] <= numbers['total']
+        assert 0 < numbers['marshal'] <= numbers['total']
+
+        # The response is cached.
+        numbers = server_timing(testapp.get('/api/courses'))
+        assert numbers['marshal'] == 0
+
+    def test_counts_queries_of_request(self, campuses, courses, db,
+                                       testapp):
+        # Arguments vary so that responses are not cached.
+        testapp.get('/api/campuses', {'x': 0})
+        first = server_timing(testapp.get('/api/campuses', {'x': 1}))
+        # Queries outside requests are not counted.
+        db.session.query(db.func.count(1)).scalar()
+        second = server_timing(testapp.get('/api/campuses', {'x': 2}))
+        assert second['queries'] == first['queries'] > 0
+
+    def test_disabled(self, app, campuses, testapp):
+        app.config['SERVER_TIMING'] = False
+        resp = testapp.get('/api/campuses')
+        assert 'Server-Timing' not in resp.headers
+
+    def test_log(self, app, campuses, testapp, caplog):
+        app.config['REQUEST_TIMING_LOG'] = True
+        caplog.set_level(logging.INFO, logger='dash.timing')
+        testapp.get('/api/campuses', {'a': 'b'})
+        [record] = [r for r in caplog.records if r.name == 'dash.timing']
+        line = json.loads(record.getMessage())
+        assert line['method'] == 'GET'
+        assert line['path'] == '/api/campuses?a=b'
+        assert line['status'] == 200
+        assert line['queries'] > 0
+        assert set(['db_ms', 'marshal_ms', 'total_ms']) <= set(line)
+
+    def test_log_streamed(self, app, campuses, courses, testapp, caplog):
+        app.config['REQUEST_TIMING_LOG'] = True
+        caplog.set_level(logging.INFO, logger='dash.timing')
+        resp = testapp.get('/api/courses',
+                           headers={'Accept': streaming.MIMETYPE})
+        [record] = [r for r in caplog.records if r.name == 'dash.timing']
+        line = json.loads(record.getMessage())
+        # The header is sent before the body is fetched and marshalled,
+        # and the line is logged after.
+        assert server_timing(resp)['marshal'] == 0
+        assert line['queries'] > server_timing(resp)['queries']
+        assert line['marshal_ms'] > 0
+
+
+def test_timed_outside_request(app):
+    assert timing.current() is None
+    with timing.timed('marshal'):
+        pass